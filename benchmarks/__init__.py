@@ -0,0 +1 @@
+"""Performance benchmarks for challengeutils and the scoring harness"""
@@ -0,0 +1,1417 @@
+"""Local stand-in for the Synapse REST API
+
+Serves the endpoints that challengeutils and the scoring harness call
+(submission bundles and statuses, the evaluation query service, forums,
+threads, replies, wikis, teams, ACLs, messages and the file handles they
+need) from in-memory state, with a configurable latency on every request
+so that throughput changes can be measured without the real service.
+
+    python -m benchmarks.fake_synapse --port 8080 --submissions 500 \\
+        --latency 0.05 --config fake.synapseConfig
+
+Point a client at it with the written config file and the printed
+evaluation id, e.g.
+
+    python bin/runqueue.py config.py -c fake.synapseConfig --evaluation 9600025
+    challengeutils -c fake.synapseConfig query "select * from evaluation_9600025"
+
+where config.py lists the evaluation in its EVALUATION_QUEUES_CONFIG.
+
+or, from Python, with FakeSynapseServer.client().  Any auth token is
+accepted and every request is made as the same user.
+"""
+
+import argparse
+import bisect
+from collections import Counter
+import datetime
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+import synapseclient
+from synapseclient.core.utils import iso_to_datetime
+
+REPO_PREFIX = "/repo/v1"
+AUTH_PREFIX = "/auth/v1"
+FILE_PREFIX = "/file/v1"
+
+EVALUATION_QUERY_COLUMNS = [
+    "objectId",
+    "evaluationId",
+    "entityId",
+    "versionNumber",
+    "name",
+    "userId",
+    "submitterId",
+    "teamId",
+    "status",
+    "createdOn",
+    "modifiedOn",
+]
+
+_ROUTES = []
+
+
+def _route(method, pattern):
+    """Register a FakeSynapse method as the handler of an endpoint.  The
+    handler is called with the request and the groups of the pattern and
+    named after the method for latency and request counts."""
+
+    def register(func):
+        _ROUTES.append((method, re.compile(f"^{pattern}$"), func))
+        return func
+
+    return register
+
+
+class FakeSynapseError(Exception):
+    """Error response of the fake service"""
+
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class FakeRequest:
+    """Request passed to the route handlers"""
+
+    def __init__(self, method, path, query, body, base_url):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.base_url = base_url
+
+    def json(self):
+        """Body of the request decoded from JSON"""
+        return json.loads(self.body) if self.body else {}
+
+    def page(self, items):
+        """Slice items with the limit and offset of the request"""
+        limit = int(self.query.get("limit", 10))
+        offset = int(self.query.get("offset", 0))
+        return {
+            "results": items[offset : offset + limit],
+            "totalNumberOfResults": len(items),
+        }
+
+
+class _Response:
+    """Raw response of a route that doesn't return JSON"""
+
+    def __init__(self, content, content_type="application/octet-stream"):
+        self.content = content
+        self.content_type = content_type
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _iso(when):
+    return when.strftime("%Y-%m-%dT%H:%M:%S.") + f"{when.microsecond // 1000:03d}Z"
+
+
+def _epoch_ms(when):
+    return int(when.timestamp() * 1000)
+
+
+def _flatten_annotations(status):
+    """Annotations of a submission status as a flat dict"""
+    flat = {}
+    for annotation_type, annotations in (status.get("annotations") or {}).items():
+        if annotation_type in ("objectId", "scopeId"):
+            continue
+        for annotation in annotations:
+            flat[annotation["key"]] = annotation["value"]
+    submission_annotations = status.get("submissionAnnotations") or {}
+    for key, value in submission_annotations.get("annotations", {}).items():
+        values = value.get("value", [])
+        flat[key] = values[0] if len(values) == 1 else values
+    return flat
+
+
+def _check_submission_annotations(status):
+    """Reject submission annotations that aren't in the shape Synapse
+    expects: {"id", "etag", "annotations": {key: {"type", "value"}}}"""
+    submission_annotations = status.get("submissionAnnotations")
+    if submission_annotations is None:
+        return
+    annotations = submission_annotations.get("annotations")
+    if not isinstance(annotations, dict) or not all(
+        isinstance(value, dict) and {"type", "value"} <= set(value)
+        for value in annotations.values()
+    ):
+        raise FakeSynapseError(
+            400, f"Invalid submissionAnnotations: {submission_annotations}"
+        )
+
+
+def _compare(left, operator, right):
+    """Compare a query column value to a literal"""
+    if left is None:
+        return operator in ("!=", "<>") and right is not None
+    try:
+        left, right = float(left), float(right)
+    except (TypeError, ValueError):
+        left, right = str(left), str(right)
+    return {
+        "==": left == right,
+        "=": left == right,
+        "!=": left != right,
+        "<>": left != right,
+        ">": left > right,
+        ">=": left >= right,
+        "<": left < right,
+        "<=": left <= right,
+    }[operator]
+
+
+_QUERY = re.compile(
+    r"select\s+(?P<columns>.+?)\s+from\s+evaluation_(?P<evaluation>\d+)"
+    r"(?:\s+where\s+(?P<where>.+?))?"
+    r"(?:\s+limit\s+(?P<limit>\d+))?(?:\s+offset\s+(?P<offset>\d+))?\s*$",
+    re.IGNORECASE,
+)
+_CONDITION = re.compile(
+    r"^\s*(?P<column>\w+)\s*(?P<operator>==|>=|<=|!=|<>|=|>|<)\s*"
+    r"(?P<value>'[^']*'|\"[^\"]*\"|[^\s]+)\s*$"
+)
+
+
+def _parse_query(query):
+    """Parse the subset of the evaluation query language used by
+    challengeutils: select, where clauses joined by and, limit and offset
+
+    Returns:
+        (columns, evaluation id, conditions, limit, offset)
+    """
+    match = _QUERY.match(query.strip())
+    if match is None:
+        raise FakeSynapseError(400, f"Unable to parse query: {query}")
+    columns = [column.strip() for column in match.group("columns").split(",")]
+    conditions = []
+    if match.group("where"):
+        for clause in re.split(r"\s+and\s+", match.group("where"), flags=re.I):
+            condition = _CONDITION.match(clause)
+            if condition is None:
+                raise FakeSynapseError(400, f"Unsupported condition: {clause}")
+            value = condition.group("value")
+            if value[0] in "'\"":
+                value = value[1:-1]
+            conditions.append(
+                (condition.group("column"), condition.group("operator"), value)
+            )
+    return (
+        columns,
+        match.group("evaluation"),
+        conditions,
+        int(match.group("limit") or 10),
+        int(match.group("offset") or 0),
+    )
+
+
+class FakeSynapse:
+    """In-memory state and endpoint handlers of the fake service.  Use
+    the add_* methods to seed it.
+
+    Args:
+        user_name: Name of the user every request is made as
+    """
+
+    def __init__(self, user_name="fake-admin"):
+        self._lock = threading.RLock()
+        self._ids = itertools.count(9600000)
+        self.users = {}
+        self.teams = {}
+        self.team_members = {}
+        self.entities = {}
+        self.acls = {}
+        self.evaluations = {}
+        self.submissions = {}
+        self.statuses = {}
+        # Evaluation id to status, or None for all, to submission ids
+        self._queues = {}
+        self.file_handles = {}
+        self.file_contents = {}
+        self.uploads = {}
+        self.forums = {}
+        self.threads = {}
+        self.replies = {}
+        self.message_contents = {}
+        self.wikis = {}
+        self.messages = []
+        self.batch_tokens = set()
+        self.user_id = self.add_user(user_name)
+
+    def _next_id(self):
+        return str(next(self._ids))
+
+    def _etag(self):
+        return str(uuid.uuid4())
+
+    def _get(self, table, key, kind):
+        try:
+            return table[str(key)]
+        except KeyError:
+            raise FakeSynapseError(404, f"{kind} {key} does not exist")
+
+    # Seeding
+
+    def add_user(self, user_name=None):
+        """Add a user and get its id"""
+        with self._lock:
+            user_id = self._next_id()
+            self.users[user_id] = {
+                "ownerId": user_id,
+                "userName": user_name or f"user{user_id}",
+                "firstName": "",
+                "lastName": "",
+                "etag": self._etag(),
+            }
+            return user_id
+
+    def add_team(self, name, members=()):
+        """Add a team of users and get its id"""
+        with self._lock:
+            team_id = self._next_id()
+            self.teams[team_id] = {
+                "id": team_id,
+                "name": name,
+                "etag": self._etag(),
+                "canPublicJoin": False,
+                "createdBy": self.user_id,
+                "createdOn": _iso(_now()),
+            }
+            self.team_members[team_id] = [str(member) for member in members]
+            return team_id
+
+    def add_project(self, name):
+        """Add a project with a forum and get its Synapse id"""
+        with self._lock:
+            project_id = f"syn{self._next_id()}"
+            self.entities[project_id] = {
+                "id": project_id,
+                "name": name,
+                "etag": self._etag(),
+                "concreteType": "org.sagebionetworks.repo.model.Project",
+                "createdOn": _iso(_now()),
+                "createdBy": self.user_id,
+            }
+            self.acls[project_id] = {
+                "id": project_id,
+                "etag": self._etag(),
+                "resourceAccess": [
+                    {
+                        "principalId": int(self.user_id),
+                        "accessType": ["READ", "UPDATE", "CHANGE_PERMISSIONS"],
+                    }
+                ],
+            }
+            forum_id = self._next_id()
+            self.forums[forum_id] = {
+                "id": forum_id,
+                "projectId": project_id,
+                "etag": self._etag(),
+                "moderators": [self.user_id],
+            }
+            return project_id
+
+    def add_evaluation(self, name, content_source):
+        """Add an evaluation queue and get its id"""
+        with self._lock:
+            evaluation_id = self._next_id()
+            self.evaluations[evaluation_id] = {
+                "id": evaluation_id,
+                "name": name,
+                "etag": self._etag(),
+                "contentSource": content_source,
+                "ownerId": self.user_id,
+                "createdOn": _iso(_now()),
+                "status": "OPEN",
+            }
+            self.acls[f"evaluation:{evaluation_id}"] = {
+                "id": evaluation_id,
+                "etag": self._etag(),
+                "resourceAccess": [],
+            }
+            return evaluation_id
+
+    def add_file_handle(self, content, file_name="file.txt", content_type=None):
+        """Store bytes as a file handle and get its id"""
+        with self._lock:
+            file_handle_id = self._next_id()
+            self.file_handles[file_handle_id] = {
+                "id": file_handle_id,
+                "concreteType": "org.sagebionetworks.repo.model.file.S3FileHandle",
+                "etag": self._etag(),
+                "fileName": file_name,
+                "contentType": content_type or "application/octet-stream",
+                "contentMd5": hashlib.md5(content).hexdigest(),
+                "contentSize": len(content),
+                "createdBy": self.user_id,
+                "createdOn": _iso(_now()),
+            }
+            self.file_contents[file_handle_id] = content
+            return file_handle_id
+
+    def add_submission(
+        self,
+        evaluation_id,
+        user_id=None,
+        team_id=None,
+        content=b"prediction",
+        file_name="prediction.csv",
+        status="RECEIVED",
+    ):
+        """Add a file submission to an evaluation queue and get its id"""
+        with self._lock:
+            evaluation_id = str(evaluation_id)
+            self._get(self.evaluations, evaluation_id, "Evaluation")
+            user_id = str(user_id or self.user_id)
+            submission_id = self._next_id()
+            entity_id = f"syn{self._next_id()}"
+            file_handle_id = self.add_file_handle(content, file_name)
+            created_on = _iso(_now())
+            entity = {
+                "id": entity_id,
+                "name": file_name,
+                "etag": self._etag(),
+                "concreteType": "org.sagebionetworks.repo.model.FileEntity",
+                "parentId": self.evaluations[evaluation_id]["contentSource"],
+                "dataFileHandleId": file_handle_id,
+                "versionNumber": 1,
+                "createdOn": created_on,
+                "createdBy": user_id,
+            }
+            bundle = {
+                "entity": entity,
+                "annotations": {
+                    "id": entity_id,
+                    "etag": entity["etag"],
+                    "annotations": {},
+                },
+                "fileHandles": [self.file_handles[file_handle_id]],
+            }
+            self.submissions[submission_id] = {
+                "id": submission_id,
+                "evaluationId": evaluation_id,
+                "entityId": entity_id,
+                "versionNumber": 1,
+                "name": file_name,
+                "userId": user_id,
+                "submitterAlias": self.users.get(user_id, {}).get("userName"),
+                "createdOn": created_on,
+                "entityBundleJSON": json.dumps(bundle),
+                "contributors": [{"principalId": user_id, "createdOn": created_on}],
+            }
+            if team_id is not None:
+                self.submissions[submission_id]["teamId"] = str(team_id)
+            self._queues.setdefault(evaluation_id, {}).setdefault(None, []).append(
+                int(submission_id)
+            )
+            self._set_status(
+                {
+                    "id": submission_id,
+                    "etag": self._etag(),
+                    "entityId": entity_id,
+                    "versionNumber": 1,
+                    "status": status,
+                    "modifiedOn": created_on,
+                    "statusVersion": 0,
+                    "canCancel": False,
+                    "cancelRequested": False,
+                }
+            )
+            return submission_id
+
+    def add_wiki(self, owner_id, title, markdown, parent_wiki_id=None):
+        """Add a wiki page to an entity and get its id"""
+        with self._lock:
+            return self._store_wiki(
+                owner_id,
+                {"title": title, "markdown": markdown, "parentWikiId": parent_wiki_id},
+            )["id"]
+
+    def _store_wiki(self, owner_id, wiki, wiki_id=None):
+        with self._lock:
+            wiki_id = wiki_id or self._next_id()
+            markdown = wiki.get("markdown") or ""
+            stored = {
+                "id": wiki_id,
+                "title": wiki.get("title"),
+                "parentWikiId": wiki.get("parentWikiId"),
+                "markdown": markdown,
+                "markdownFileHandleId": self.add_file_handle(
+                    gzip.compress(markdown.encode("utf-8")), "markdown.txt.gz"
+                ),
+                "attachmentFileHandleIds": wiki.get("attachmentFileHandleIds") or [],
+                "etag": self._etag(),
+                "createdBy": self.user_id,
+                "modifiedOn": _iso(_now()),
+            }
+            self.wikis.setdefault(str(owner_id), {})[wiki_id] = stored
+            return stored
+
+    def add_thread(self, forum_id, title, message):
+        """Add a thread to a forum and get its id"""
+        with self._lock:
+            forum = self._get(self.forums, forum_id, "Forum")
+            thread_id = self._next_id()
+            now = _iso(_now())
+            self.threads[thread_id] = {
+                "id": thread_id,
+                "forumId": forum["id"],
+                "projectId": forum["projectId"],
+                "title": title,
+                "createdOn": now,
+                "createdBy": self.user_id,
+                "modifiedOn": now,
+                "etag": self._etag(),
+                "messageKey": self._message_key(message),
+                "numberOfViews": 0,
+                "numberOfReplies": 0,
+                "lastActivity": now,
+                "activeAuthors": [self.user_id],
+                "isEdited": False,
+                "isDeleted": False,
+                "isPinned": False,
+            }
+            return thread_id
+
+    def forum_id(self, project_id):
+        """Get the id of the forum of a project"""
+        for forum in self.forums.values():
+            if forum["projectId"] == project_id:
+                return forum["id"]
+        raise FakeSynapseError(404, f"Project {project_id} has no forum")
+
+    def _message_key(self, content):
+        key = str(uuid.uuid4())
+        self.message_contents[key] = content
+        return key
+
+    def _message_url(self, request, key):
+        self._get(self.message_contents, key, "Message")
+        return {"messageUrl": f"{request.base_url}/content/{key}?Expires=0"}
+
+    # Users and teams
+
+    @_route("GET", "/userProfile/?")
+    def current_user(self, request):
+        return self.users[self.user_id]
+
+    @_route("GET", r"/userProfile/(\d+)")
+    def user_profile(self, request, user_id):
+        return self._get(self.users, user_id, "User")
+
+    @_route("GET", "/userGroupHeaders")
+    def user_group_headers(self, request):
+        prefix = request.query.get("prefix", "").lower()
+        return {
+            "children": [
+                {
+                    "ownerId": user["ownerId"],
+                    "userName": user["userName"],
+                    "isIndividual": True,
+                }
+                for user in self.users.values()
+                if user["userName"].lower().startswith(prefix)
+            ]
+        }
+
+    @_route("GET", r"/team/(\d+)")
+    def team(self, request, team_id):
+        return self._get(self.teams, team_id, "Team")
+
+    @_route("GET", r"/teamMembers/(\d+)")
+    def team_members_page(self, request, team_id):
+        self._get(self.teams, team_id, "Team")
+        members = [
+            {
+                "teamId": team_id,
+                "member": {
+                    "ownerId": member,
+                    "userName": self.users.get(member, {}).get("userName"),
+                    "isIndividual": True,
+                },
+                "isAdmin": False,
+            }
+            for member in self.team_members[team_id]
+        ]
+        return request.page(members)
+
+    @_route("GET", r"/teamMembers/count/(\d+)")
+    def team_member_count(self, request, team_id):
+        self._get(self.teams, team_id, "Team")
+        return {"count": len(self.team_members[team_id])}
+
+    @_route("DELETE", r"/team/(\d+)/member/(\d+)")
+    def remove_team_member(self, request, team_id, user_id):
+        with self._lock:
+            self._get(self.teams, team_id, "Team")
+            if user_id in self.team_members[team_id]:
+                self.team_members[team_id].remove(user_id)
+
+    # Entities and ACLs
+
+    @_route("GET", r"/entity/(syn\d+)")
+    def entity(self, request, entity_id):
+        return self._get(self.entities, entity_id, "Entity")
+
+    @_route("GET", r"/entity/(syn\d+)/benefactor")
+    def benefactor(self, request, entity_id):
+        return {"id": entity_id}
+
+    @_route("GET", r"/entity/(syn\d+)/acl")
+    def entity_acl(self, request, entity_id):
+        return self._get(self.acls, entity_id, "ACL")
+
+    @_route("PUT", r"/entity/(syn\d+)/acl")
+    def update_entity_acl(self, request, entity_id):
+        with self._lock:
+            acl = request.json()
+            acl.update({"id": entity_id, "etag": self._etag()})
+            self.acls[entity_id] = acl
+            return acl
+
+    @_route("POST", r"/entity/(syn\d+)/acl")
+    def create_entity_acl(self, request, entity_id):
+        return self.update_entity_acl(request, entity_id)
+
+    @_route("GET", r"/entity/(syn\d+)/permissions")
+    def permissions(self, request, entity_id):
+        return {
+            "canView": True,
+            "canEdit": True,
+            "canMove": True,
+            "canAddChild": True,
+            "canCertifiedUserEdit": True,
+            "canCertifiedUserAddChild": True,
+            "isCertifiedUser": True,
+            "canChangePermissions": True,
+            "canChangeSettings": True,
+            "canDelete": True,
+            "canDownload": True,
+            "canUpload": True,
+            "canEnableInheritance": False,
+            "ownerPrincipalId": int(self.user_id),
+            "canPublicRead": False,
+            "canModerate": True,
+            "isCertificationRequired": False,
+            "isEntityOpenData": False,
+        }
+
+    @_route("GET", r"/evaluation/(\d+)/acl")
+    def evaluation_acl(self, request, evaluation_id):
+        return self._get(self.acls, f"evaluation:{evaluation_id}", "ACL")
+
+    @_route("PUT", "/evaluation/acl")
+    def update_evaluation_acl(self, request):
+        with self._lock:
+            acl = request.json()
+            acl["etag"] = self._etag()
+            self.acls[f"evaluation:{acl['id']}"] = acl
+            return acl
+
+    # Evaluation queues
+
+    @_route("GET", r"/evaluation/(\d+)")
+    def evaluation(self, request, evaluation_id):
+        return self._get(self.evaluations, evaluation_id, "Evaluation")
+
+    @_route("GET", r"/entity/(syn\d+)/evaluation")
+    def evaluations_by_content_source(self, request, entity_id):
+        return request.page(
+            [
+                evaluation
+                for evaluation in self.evaluations.values()
+                if evaluation["contentSource"] == entity_id
+            ]
+        )
+
+    def _set_status(self, status):
+        """Store a submission status and move it to the queue of its
+        status"""
+        submission_id = status["id"]
+        evaluation_queues = self._queues[
+            self.submissions[submission_id]["evaluationId"]
+        ]
+        previous = self.statuses.get(submission_id)
+        if previous is not None:
+            evaluation_queues[previous["status"]].remove(int(submission_id))
+        bisect.insort(
+            evaluation_queues.setdefault(status["status"], []), int(submission_id)
+        )
+        self.statuses[submission_id] = status
+
+    def _queue_page(self, request, evaluation_id):
+        """Page of the ids of the submissions of a queue, in the order they
+        were submitted"""
+        self._get(self.evaluations, evaluation_id, "Evaluation")
+        page = request.page(
+            self._queues.get(evaluation_id, {}).get(request.query.get("status"), [])
+        )
+        page["results"] = [str(submission_id) for submission_id in page["results"]]
+        return page
+
+    @_route("GET", r"/evaluation/(\d+)/submission/bundle/all")
+    def submission_bundles(self, request, evaluation_id):
+        with self._lock:
+            page = self._queue_page(request, evaluation_id)
+            page["results"] = [
+                {
+                    "submission": self.submissions[submission_id],
+                    "submissionStatus": self.statuses[submission_id],
+                }
+                for submission_id in page["results"]
+            ]
+            return page
+
+    @_route("GET", r"/evaluation/(\d+)/submission/all")
+    def submissions_page(self, request, evaluation_id):
+        with self._lock:
+            page = self._queue_page(request, evaluation_id)
+            page["results"] = [
+                self.submissions[submission_id] for submission_id in page["results"]
+            ]
+            return page
+
+    @_route("GET", r"/evaluation/submission/(\d+)")
+    def submission(self, request, submission_id):
+        return self._get(self.submissions, submission_id, "Submission")
+
+    @_route("GET", r"/evaluation/submission/(\d+)/status")
+    def submission_status(self, request, submission_id):
+        return self._get(self.statuses, submission_id, "SubmissionStatus")
+
+    def _update_status(self, status):
+        """Store a submission status if its etag is current"""
+        submission_id = str(status["id"])
+        current = self._get(self.statuses, submission_id, "SubmissionStatus")
+        _check_submission_annotations(status)
+        if status.get("etag") != current["etag"]:
+            raise FakeSynapseError(
+                412,
+                f"Submission status {submission_id} was updated since you last "
+                "fetched it, retrieve it again and reapply the update",
+            )
+        updated = dict(current)
+        for key in (
+            "status",
+            "annotations",
+            "submissionAnnotations",
+            "canCancel",
+            "cancelRequested",
+        ):
+            if key in status:
+                updated[key] = status[key]
+        updated.update(
+            etag=self._etag(),
+            modifiedOn=_iso(_now()),
+            statusVersion=current["statusVersion"] + 1,
+        )
+        return updated
+
+    @_route("PUT", r"/evaluation/submission/(\d+)/status")
+    def update_submission_status(self, request, submission_id):
+        with self._lock:
+            status = request.json()
+            status["id"] = submission_id
+            updated = self._update_status(status)
+            self._set_status(updated)
+            return updated
+
+    @_route("PUT", r"/evaluation/(\d+)/statusBatch")
+    def status_batch(self, request, evaluation_id):
+        with self._lock:
+            batch = request.json()
+            token = batch.get("batchToken")
+            if not batch.get("isFirstBatch") and token not in self.batch_tokens:
+                raise FakeSynapseError(400, "Invalid batchToken")
+            self.batch_tokens.discard(token)
+            # Check every etag first so that a conflict stores nothing
+            updated = [self._update_status(status) for status in batch["statuses"]]
+            for status in updated:
+                self._set_status(status)
+            response = {}
+            if not batch.get("isLastBatch"):
+                response["nextUploadToken"] = self._next_id()
+                self.batch_tokens.add(response["nextUploadToken"])
+            return response
+
+    def _query_row(self, submission_id):
+        submission = self.submissions[submission_id]
+        status = self.statuses[submission_id]
+        row = {
+            "objectId": submission_id,
+            "evaluationId": submission["evaluationId"],
+            "entityId": submission["entityId"],
+            "versionNumber": submission["versionNumber"],
+            "name": submission["name"],
+            "userId": submission["userId"],
+            "submitterId": submission.get("teamId", submission["userId"]),
+            "teamId": submission.get("teamId"),
+            "status": status["status"],
+            "createdOn": _epoch_ms(iso_to_datetime(submission["createdOn"])),
+            "modifiedOn": _epoch_ms(iso_to_datetime(status["modifiedOn"])),
+        }
+        row.update(_flatten_annotations(status))
+        return row
+
+    @_route("GET", "/evaluation/submission/query")
+    def evaluation_query(self, request):
+        columns, evaluation_id, conditions, limit, offset = _parse_query(
+            request.query.get("query", "")
+        )
+        self._get(self.evaluations, evaluation_id, "Evaluation")
+        with self._lock:
+            rows = [
+                self._query_row(str(submission_id))
+                for submission_id in self._queues.get(evaluation_id, {}).get(None, [])
+            ]
+        rows = [
+            row
+            for row in rows
+            if all(
+                _compare(row.get(column), operator, value)
+                for column, operator, value in conditions
+            )
+        ]
+        if columns == ["*"]:
+            columns = list(EVALUATION_QUERY_COLUMNS)
+            for row in rows:
+                columns.extend(key for key in row if key not in columns)
+        return {
+            "totalNumberOfResults": len(rows),
+            "headers": columns,
+            "rows": [
+                {
+                    "values": [
+                        None if row.get(column) is None else str(row.get(column))
+                        for column in columns
+                    ]
+                }
+                for row in rows[offset : offset + limit]
+            ],
+        }
+
+    # Files and messages
+
+    @_route("POST", "/fileHandle/batch")
+    def file_handle_batch(self, request):
+        results = []
+        for requested in request.json()["requestedFiles"]:
+            file_handle_id = str(requested["fileHandleId"])
+            if file_handle_id not in self.file_handles:
+                results.append(
+                    {"fileHandleId": file_handle_id, "failureCode": "NOT_FOUND"}
+                )
+                continue
+            results.append(
+                {
+                    "fileHandleId": file_handle_id,
+                    "fileHandle": self.file_handles[file_handle_id],
+                    "preSignedURL": f"{request.base_url}/download/{file_handle_id}",
+                }
+            )
+        return {"requestedFiles": results}
+
+    @_route("GET", r"/fileHandle/(\d+)")
+    def file_handle(self, request, file_handle_id):
+        return self._get(self.file_handles, file_handle_id, "FileHandle")
+
+    @_route("GET", r"/download/(\d+)")
+    def download(self, request, file_handle_id):
+        content = self._get(self.file_contents, file_handle_id, "FileHandle")
+        return _Response(content)
+
+    @_route("POST", "/file/multipart")
+    def start_upload(self, request):
+        with self._lock:
+            upload = request.json()
+            upload_id = self._next_id()
+            parts = max(1, -(-upload["fileSizeBytes"] // upload["partSizeBytes"]))
+            self.uploads[upload_id] = {"request": upload, "parts": [None] * parts}
+            return {
+                "uploadId": upload_id,
+                "state": "UPLOADING",
+                "partsState": "0" * parts,
+            }
+
+    @_route("POST", r"/file/multipart/(\d+)/presigned/url/batch")
+    def upload_part_urls(self, request, upload_id):
+        self._get(self.uploads, upload_id, "Upload")
+        return {
+            "partPresignedUrls": [
+                {
+                    "partNumber": part_number,
+                    "uploadPresignedUrl": (
+                        f"{request.base_url}/upload/{upload_id}/{part_number}"
+                    ),
+                }
+                for part_number in request.json()["partNumbers"]
+            ]
+        }
+
+    @_route("PUT", r"/upload/(\d+)/(\d+)")
+    def upload_part(self, request, upload_id, part_number):
+        with self._lock:
+            upload = self._get(self.uploads, upload_id, "Upload")
+            upload["parts"][int(part_number) - 1] = request.body
+        return _Response(b"")
+
+    @_route("PUT", r"/file/multipart/(\d+)/add/(\d+)")
+    def add_upload_part(self, request, upload_id, part_number):
+        upload = self._get(self.uploads, upload_id, "Upload")
+        part = upload["parts"][int(part_number) - 1]
+        if part is None or hashlib.md5(part).hexdigest() != request.query.get(
+            "partMD5Hex"
+        ):
+            return {"addPartState": "ADD_FAILED", "errorMessage": "MD5 mismatch"}
+        return {"addPartState": "ADD_SUCCESS"}
+
+    @_route("PUT", r"/file/multipart/(\d+)/complete")
+    def complete_upload(self, request, upload_id):
+        with self._lock:
+            upload = self._get(self.uploads, upload_id, "Upload")
+            file_handle_id = self.add_file_handle(
+                b"".join(upload["parts"]),
+                upload["request"]["fileName"],
+                upload["request"].get("contentType"),
+            )
+            del self.uploads[upload_id]
+            return {
+                "uploadId": upload_id,
+                "state": "COMPLETED",
+                "resultFileHandleId": file_handle_id,
+            }
+
+    @_route("POST", "/message")
+    def send_message(self, request):
+        with self._lock:
+            message = request.json()
+            message.update(
+                id=self._next_id(),
+                createdBy=self.user_id,
+                createdOn=_iso(_now()),
+                body=self.file_contents[str(message["fileHandleId"])].decode("utf-8"),
+            )
+            self.messages.append(message)
+            return {key: value for key, value in message.items() if key != "body"}
+
+    # Forums
+
+    @_route("GET", r"/project/(syn\d+)/forum")
+    def project_forum(self, request, project_id):
+        return self.forum(request, self.forum_id(project_id))
+
+    @_route("GET", r"/forum/(\d+)")
+    def forum(self, request, forum_id):
+        forum = self._get(self.forums, forum_id, "Forum")
+        return {key: forum[key] for key in ("id", "projectId", "etag")}
+
+    @_route("GET", r"/forum/(\d+)/moderators")
+    def moderators(self, request, forum_id):
+        return request.page(self._get(self.forums, forum_id, "Forum")["moderators"])
+
+    def _filter_deleted(self, items, query_filter):
+        if query_filter == "DELETED_ONLY":
+            return [item for item in items if item["isDeleted"]]
+        if query_filter == "NO_FILTER":
+            return items
+        return [item for item in items if not item["isDeleted"]]
+
+    def _forum_threads(self, forum_id, query_filter):
+        self._get(self.forums, forum_id, "Forum")
+        return self._filter_deleted(
+            [
+                thread
+                for thread in self.threads.values()
+                if thread["forumId"] == forum_id
+            ],
+            query_filter,
+        )
+
+    @_route("GET", r"/forum/(\d+)/threads")
+    def forum_threads(self, request, forum_id):
+        return request.page(self._forum_threads(forum_id, request.query.get("filter")))
+
+    @_route("GET", r"/forum/(\d+)/threadcount")
+    def thread_count(self, request, forum_id):
+        return {
+            "count": len(self._forum_threads(forum_id, request.query.get("filter")))
+        }
+
+    @_route("GET", r"/entity/(syn\d+)/threads")
+    def entity_threads(self, request, entity_id):
+        return request.page(
+            [
+                thread
+                for thread in self.threads.values()
+                if thread["projectId"] == entity_id and not thread["isDeleted"]
+            ]
+        )
+
+    @_route("POST", "/entity/threadcounts")
+    def entity_thread_counts(self, request):
+        return {
+            "list": [
+                {
+                    "entityId": entity_id,
+                    "count": sum(
+                        thread["projectId"] == entity_id and not thread["isDeleted"]
+                        for thread in self.threads.values()
+                    ),
+                }
+                for entity_id in request.json().get("idList", [])
+            ]
+        }
+
+    @_route("POST", "/thread")
+    def create_thread(self, request):
+        body = request.json()
+        thread_id = self.add_thread(
+            body["forumId"], body["title"], body.get("messageMarkdown", "")
+        )
+        return self.threads[thread_id]
+
+    @_route("GET", r"/thread/(\d+)")
+    def thread(self, request, thread_id):
+        return self._get(self.threads, thread_id, "Thread")
+
+    def _update_thread(self, thread_id, **changes):
+        with self._lock:
+            thread = self._get(self.threads, thread_id, "Thread")
+            thread.update(changes, etag=self._etag(), modifiedOn=_iso(_now()))
+            return thread
+
+    @_route("PUT", r"/thread/(\d+)/title")
+    def update_thread_title(self, request, thread_id):
+        return self._update_thread(
+            thread_id, title=request.json().get("title"), isEdited=True
+        )
+
+    @_route("PUT", r"/thread/(\d+)/message")
+    def update_thread_message(self, request, thread_id):
+        with self._lock:
+            key = self._message_key(request.json().get("messageMarkdown", ""))
+            return self._update_thread(thread_id, messageKey=key, isEdited=True)
+
+    @_route("DELETE", r"/thread/(\d+)")
+    def delete_thread(self, request, thread_id):
+        self._update_thread(thread_id, isDeleted=True)
+
+    @_route("PUT", r"/thread/(\d+)/restore")
+    def restore_thread(self, request, thread_id):
+        self._update_thread(thread_id, isDeleted=False)
+
+    @_route("PUT", r"/thread/(\d+)/pin")
+    def pin_thread(self, request, thread_id):
+        self._update_thread(thread_id, isPinned=True)
+
+    @_route("PUT", r"/thread/(\d+)/unpin")
+    def unpin_thread(self, request, thread_id):
+        self._update_thread(thread_id, isPinned=False)
+
+    @_route("GET", "/thread/messageUrl")
+    def thread_message_url(self, request):
+        return self._message_url(request, request.query.get("messageKey"))
+
+    @_route("POST", "/reply")
+    def create_reply(self, request):
+        with self._lock:
+            body = request.json()
+            thread = self._get(self.threads, body["threadId"], "Thread")
+            reply_id = self._next_id()
+            now = _iso(_now())
+            self.replies[reply_id] = {
+                "id": reply_id,
+                "threadId": thread["id"],
+                "forumId": thread["forumId"],
+                "projectId": thread["projectId"],
+                "createdOn": now,
+                "createdBy": self.user_id,
+                "modifiedOn": now,
+                "etag": self._etag(),
+                "messageKey": self._message_key(body.get("messageMarkdown", "")),
+                "isEdited": False,
+                "isDeleted": False,
+            }
+            thread["numberOfReplies"] += 1
+            thread["lastActivity"] = now
+            return self.replies[reply_id]
+
+    @_route("GET", r"/reply/(\d+)")
+    def reply(self, request, reply_id):
+        return self._get(self.replies, reply_id, "Reply")
+
+    def _thread_replies(self, thread_id, query_filter):
+        self._get(self.threads, thread_id, "Thread")
+        return self._filter_deleted(
+            [
+                reply
+                for reply in self.replies.values()
+                if reply["threadId"] == thread_id
+            ],
+            query_filter,
+        )
+
+    @_route("GET", r"/thread/(\d+)/replies")
+    def thread_replies(self, request, thread_id):
+        return request.page(
+            self._thread_replies(thread_id, request.query.get("filter"))
+        )
+
+    @_route("GET", r"/thread/(\d+)/replycount")
+    def reply_count(self, request, thread_id):
+        return {
+            "count": len(self._thread_replies(thread_id, request.query.get("filter")))
+        }
+
+    @_route("GET", "/reply/messageUrl")
+    def reply_message_url(self, request):
+        return self._message_url(request, request.query.get("messageKey"))
+
+    @_route("GET", r"/content/([\w-]+)")
+    def message_content(self, request, key):
+        content = self._get(self.message_contents, key, "Message")
+        return _Response(content.encode("utf-8"), "text/plain; charset=utf-8")
+
+    # Wikis
+
+    def _wiki(self, owner_id, wiki_id=None):
+        wikis = self.wikis.get(owner_id, {})
+        if wiki_id is None:
+            wiki_id = next(
+                (key for key, wiki in wikis.items() if wiki["parentWikiId"] is None),
+                None,
+            )
+        return self._get(wikis, wiki_id, "Wiki")
+
+    @_route("GET", r"/entity/(syn\d+)/wiki2(?:/(\d+))?")
+    def wiki2(self, request, owner_id, wiki_id=None):
+        wiki = self._wiki(owner_id, wiki_id)
+        return {key: value for key, value in wiki.items() if key != "markdown"}
+
+    @_route("GET", r"/entity/(syn\d+)/wiki(?:/(\d+))?")
+    def wiki(self, request, owner_id, wiki_id=None):
+        return self._wiki(owner_id, wiki_id)
+
+    @_route("POST", r"/entity/(syn\d+)/wiki")
+    def create_wiki(self, request, owner_id):
+        wiki = request.json()
+        if wiki.get("parentWikiId") is None and any(
+            existing["parentWikiId"] is None
+            for existing in self.wikis.get(owner_id, {}).values()
+        ):
+            raise FakeSynapseError(409, f"{owner_id} already has a root wiki")
+        return self._store_wiki(owner_id, wiki)
+
+    @_route("PUT", r"/entity/(syn\d+)/wiki/(\d+)")
+    def update_wiki(self, request, owner_id, wiki_id):
+        with self._lock:
+            current = self._wiki(owner_id, wiki_id)
+            wiki = request.json()
+            if wiki.get("etag") != current["etag"]:
+                raise FakeSynapseError(412, f"Wiki {wiki_id} was updated")
+            return self._store_wiki(owner_id, {**current, **wiki}, wiki_id)
+
+    @_route("DELETE", r"/entity/(syn\d+)/wiki/(\d+)")
+    def delete_wiki(self, request, owner_id, wiki_id):
+        with self._lock:
+            self._wiki(owner_id, wiki_id)
+            del self.wikis[owner_id][wiki_id]
+
+    @_route("GET", r"/entity/(syn\d+)/wikiheadertree2?")
+    def wiki_headers(self, request, owner_id):
+        return request.page(
+            [
+                {
+                    "id": wiki["id"],
+                    "title": wiki["title"],
+                    "parentId": wiki["parentWikiId"],
+                }
+                for wiki in self.wikis.get(owner_id, {}).values()
+            ]
+        )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Dispatches requests to the FakeSynapse of the server"""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which would otherwise wait
+    # for a delayed ACK on every keep-alive request
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _handle(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        path = url.path
+        for prefix in (REPO_PREFIX, AUTH_PREFIX, FILE_PREFIX):
+            if path.startswith(prefix):
+                path = path[len(prefix) :]
+                break
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        query = dict(urllib.parse.parse_qsl(url.query))
+        request = FakeRequest(self.command, path, query, body, server.url)
+
+        for method, pattern, handler in _ROUTES:
+            match = pattern.match(path)
+            if method == self.command and match:
+                break
+        else:
+            return self._send(404, {"reason": f"No such endpoint: {path}"})
+        retry_after = server.wait(handler.__name__)
+        if retry_after is not None:
+            return self._send(
+                429,
+                {"reason": "Too many requests"},
+                {"Retry-After": f"{retry_after:.3f}"},
+            )
+        try:
+            result = handler(server.synapse, request, *match.groups())
+        except FakeSynapseError as error:
+            return self._send(error.status, {"reason": error.reason})
+        except Exception as error:  # pylint: disable=broad-except
+            return self._send(500, {"reason": repr(error)})
+        if result is None:
+            return self._send(204, None)
+        return self._send(200, result)
+
+    def _send(self, status, result, headers=None):
+        if isinstance(result, _Response):
+            content, content_type = result.content, result.content_type
+        elif result is None:
+            content, content_type = b"", None
+        else:
+            content = json.dumps(result).encode("utf-8")
+            content_type = "application/json"
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class FakeSynapseServer(ThreadingHTTPServer):
+    """HTTP server of a FakeSynapse that sleeps before answering each
+    request.  Use it as a context manager to serve in the background.
+
+    Args:
+        synapse: FakeSynapse with the state to serve.  Default is empty.
+        host: Host to listen on
+        port: Port to listen on. Default is any free port.
+        latency: Seconds to wait before answering each request
+        jitter: Up to this many seconds are added to the latency at random
+        route_latency: dict of handler name, e.g. "submission_bundles",
+                       to its latency, overriding latency
+        throttle: Requests per second beyond which requests are answered
+                  with HTTP 429 and a Retry-After header, like Synapse
+                  throttles clients.  Default is no limit.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        synapse=None,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        route_latency=None,
+        throttle=None,
+    ):
+        super().__init__((host, port), _Handler)
+        self.synapse = synapse or FakeSynapse()
+        self.latency = latency
+        self.jitter = jitter
+        self.route_latency = route_latency or {}
+        self.throttle = throttle
+        self.throttled = 0
+        self._window = (0, 0)
+        self.requests = Counter()
+        self._counter_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL of the server"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def wait(self, route):
+        """Count a request and sleep for its latency
+
+        Returns:
+            Seconds the client should wait if the request is throttled,
+            otherwise None
+        """
+        with self._counter_lock:
+            if self.throttle is not None:
+                now = time.monotonic()
+                second, count = self._window
+                if int(now) != second:
+                    second, count = int(now), 0
+                self._window = (second, count + 1)
+                if count >= self.throttle:
+                    self.throttled += 1
+                    return second + 1 - now
+            self.requests[route] += 1
+        delay = self.route_latency.get(route, self.latency)
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def endpoints(self):
+        """Endpoint arguments of synapseclient.Synapse for this server"""
+        return {
+            "repoEndpoint": f"{self.url}{REPO_PREFIX}",
+            "authEndpoint": f"{self.url}{AUTH_PREFIX}",
+            "fileHandleEndpoint": f"{self.url}{FILE_PREFIX}",
+            "portalEndpoint": self.url,
+        }
+
+    def client(self, **kwargs):
+        """Get a Synapse object logged in to this server
+
+        Args:
+            **kwargs: Passed to synapseclient.Synapse, e.g. cache_root_dir
+        """
+        syn = synapseclient.Synapse(skip_checks=True, **self.endpoints(), **kwargs)
+        syn.login(authToken="fake", silent=True)
+        return syn
+
+    def write_config(self, path):
+        """Write a Synapse configuration file that points clients, like
+        runqueue.py and the challengeutils command line, at this server"""
+        with open(path, "w") as config:
+            config.write("[authentication]\nauthtoken = fake\n\n[endpoints]\n")
+            for name, endpoint in self.endpoints().items():
+                config.write(f"{name} = {endpoint}\n")
+
+    def start(self):
+        """Serve requests on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def seed(
+    synapse, evaluations=1, submissions=100, teams=10, threads=0, status="RECEIVED"
+):
+    """Seed a FakeSynapse with a challenge project, its evaluation queues
+    and submissions in status spread over teams
+
+    Returns:
+        dict with the project id and the evaluation ids
+    """
+    project_id = synapse.add_project("Fake challenge")
+    synapse.add_wiki(project_id, "Fake challenge", "Welcome to the challenge")
+    team_ids = [
+        synapse.add_team(f"team {index}", [synapse.add_user()])
+        for index in range(teams)
+    ]
+    evaluation_ids = []
+    for index in range(evaluations):
+        evaluation_id = synapse.add_evaluation(f"queue {index}", project_id)
+        for submission in range(submissions):
+            team_id = team_ids[submission % len(team_ids)] if team_ids else None
+            user_id = synapse.team_members[team_id][0] if team_id else None
+            synapse.add_submission(
+                evaluation_id, user_id=user_id, team_id=team_id, status=status
+            )
+        evaluation_ids.append(evaluation_id)
+    forum_id = synapse.forum_id(project_id)
+    for index in range(threads):
+        synapse.add_thread(forum_id, f"thread {index}", f"question {index}")
+    return {"project": project_id, "evaluations": evaluation_ids}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per request"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="random extra seconds per request"
+    )
+    parser.add_argument(
+        "--throttle", type=int, help="requests per second answered with HTTP 429"
+    )
+    parser.add_argument("--evaluations", type=int, default=1)
+    parser.add_argument("--submissions", type=int, default=100)
+    parser.add_argument("--teams", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument(
+        "--config", help="Write a Synapse configuration file for clients to this path"
+    )
+    args = parser.parse_args()
+
+    server = FakeSynapseServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        throttle=args.throttle,
+    )
+    seeded = seed(
+        server.synapse,
+        evaluations=args.evaluations,
+        submissions=args.submissions,
+        teams=args.teams,
+        threads=args.threads,
+    )
+    if args.config:
+        server.write_config(args.config)
+    print(f"Serving fake Synapse at {server.url}")
+    print(f"Project: {seeded['project']}")
+    print(f"Evaluations: {', '.join(seeded['evaluations'])}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(server.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Benchmark the scoring harness end to end against the fake Synapse server
+
+Seeds a queue of synthetic submissions in benchmarks.fake_synapse and
+drains it with an EvaluationQueueProcessor, EvaluationQueueValidator and
+EvaluationQueueScorer, each run in a fresh process so that its peak RSS is
+its own.  Every submission is listed, downloaded, read, annotated and has
+its status stored over HTTP, like it is in production.  The harness is run
+until the queue is empty, because storing statuses while listing a status
+shifts the pages that are left.
+
+Reports submissions per second, p50/p95 time to process a submission, REST
+calls per submission and peak RSS, and writes them as JSON so that runs of
+different versions can be compared:
+
+    python -m benchmarks.harness_throughput --sizes 1000 10000 100000 \\
+        --output before.json
+    python -m benchmarks.harness_throughput --sizes 1000 10000 100000 \\
+        --output after.json --compare before.json
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import json
+import logging
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import synapseclient
+from tabulate import tabulate
+
+from challengeutils.__version__ import __version__
+from scoring_harness.base_processor import EvaluationQueueProcessor
+from scoring_harness.queue_scorer import EvaluationQueueScorer
+from scoring_harness.queue_validator import EvaluationQueueValidator
+
+from .fake_synapse import FakeSynapseServer, seed
+from .stats import percentile
+
+
+def _read_prediction(submission):
+    with open(submission.filePath) as prediction:
+        return prediction.read()
+
+
+class _Timed:
+    """Records the seconds spent processing each submission"""
+
+    latencies = None
+
+    def process_submission(self, submission, sub_status):
+        start = time.perf_counter()
+        try:
+            return super().process_submission(submission, sub_status)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+class Process(_Timed, EvaluationQueueProcessor):
+    """Processor that accepts every submission"""
+
+    _success_status = "ACCEPTED"
+
+    def interaction_func(self, submission, **kwargs):
+        return {
+            "valid": True,
+            "annotations": {"size": len(_read_prediction(submission))},
+            "message": "Accepted",
+        }
+
+    def notify(self, submission, submission_info):
+        pass
+
+
+class Validate(_Timed, EvaluationQueueValidator):
+    """Validator that checks the prediction file"""
+
+    def interaction_func(self, submission, **kwargs):
+        valid = _read_prediction(submission) == "prediction"
+        return {"valid": valid, "annotations": {}, "message": "Checked"}
+
+
+class Score(_Timed, EvaluationQueueScorer):
+    """Scorer that scores the prediction file"""
+
+    def interaction_func(self, submission, **kwargs):
+        score = len(_read_prediction(submission)) / 10
+        return {"valid": True, "annotations": {"score": score}, "message": "Scored"}
+
+
+PROCESSORS = {"processor": Process, "validator": Validate, "scorer": Score}
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(endpoints, name, evaluationid, max_workers):
+    """Drain a queue with a processor.  Runs in its own process.
+
+    Returns:
+        dict with the submissions processed, the number of harness runs,
+        the seconds taken, the per-submission latencies and peak RSS
+    """
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        syn = synapseclient.Synapse(
+            skip_checks=True, cache_root_dir=cache_dir, **endpoints
+        )
+        syn.login(authToken="fake", silent=True)
+        processor = PROCESSORS[name](
+            syn, evaluationid, max_workers=max_workers, remove_cache=True
+        )
+        processor.latencies = []
+        runs = 0
+        start = time.perf_counter()
+        while processor():
+            runs += 1
+        seconds = time.perf_counter() - start
+    return {
+        "processed": len(processor.latencies),
+        "runs": runs,
+        "seconds": seconds,
+        "latencies": processor.latencies,
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def benchmark(name, size, latency, max_workers):
+    """Seed a queue of size submissions and drain it with a processor
+
+    Returns:
+        dict of results
+    """
+    with FakeSynapseServer(latency=latency) as server:
+        status = PROCESSORS[name]._status
+        evaluationid = seed(server.synapse, submissions=size, status=status)[
+            "evaluations"
+        ][0]
+        server.requests.clear()
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            case = executor.submit(
+                run_case, server.endpoints(), name, evaluationid, max_workers
+            ).result()
+        rest_calls = sum(server.requests.values())
+    latencies = case["latencies"] or [0]
+    return {
+        "processor": name,
+        "submissions": size,
+        "processed": case["processed"],
+        "runs": case["runs"],
+        "seconds": round(case["seconds"], 3),
+        "submissions_per_second": round(case["processed"] / case["seconds"], 2),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "rest_calls_per_submission": round(rest_calls / max(case["processed"], 1), 2),
+        "peak_rss_mb": round(case["peak_rss_bytes"] / 1024**2, 1),
+    }
+
+
+def _commit():
+    """Current git commit, if the benchmark runs from a checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Rows of the change of each result relative to the baseline"""
+    previous = {
+        (result["processor"], result["submissions"]): result
+        for result in baseline["results"]
+    }
+    rows = []
+    for result in results:
+        before = previous.get((result["processor"], result["submissions"]))
+        if before is None:
+            continue
+        throughput = result["submissions_per_second"] / before["submissions_per_second"]
+        latency = result["latency_p95_ms"] / max(before["latency_p95_ms"], 1e-9)
+        rest_calls = (
+            result["rest_calls_per_submission"] - before["rest_calls_per_submission"]
+        )
+        rows.append(
+            [
+                result["processor"],
+                result["submissions"],
+                f"{throughput:.2f}x",
+                f"{latency:.2f}x",
+                f"{rest_calls:+.2f}",
+                f"{result['peak_rss_mb'] - before['peak_rss_mb']:+.1f}",
+            ]
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument(
+        "--processors", nargs="+", choices=list(PROCESSORS), default=list(PROCESSORS)
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per REST call"
+    )
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for name in args.processors:
+            results.append(benchmark(name, size, args.latency, args.max_workers))
+    print(tabulate(results, headers="keys"))
+
+    report = {
+        "version": __version__,
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "parameters": {"latency": args.latency, "max_workers": args.max_workers},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print()
+        print(
+            tabulate(
+                compare(results, baseline),
+                headers=[
+                    "processor",
+                    "submissions",
+                    "submissions/s",
+                    "p95 latency",
+                    "REST calls/submission",
+                    "peak RSS MB",
+                ],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
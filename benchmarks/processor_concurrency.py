@@ -0,0 +1,118 @@
+"""Benchmark EvaluationQueueProcessor throughput against max_workers
+
+Runs a validator against an in-memory stand-in for Synapse that sleeps
+for a fixed latency on every REST call, so that the time spent is
+dominated by network round-trips like it is in production.
+
+    python -m benchmarks.processor_concurrency --submissions 300 --latency 0.05
+"""
+
+import argparse
+import logging
+import time
+
+from synapseclient import Evaluation, Submission, SubmissionStatus
+from tabulate import tabulate
+
+from scoring_harness.queue_validator import EvaluationQueueValidator
+
+
+class LatencySynapse:
+    """Implements the Synapse calls used by the scoring harness with a
+    fixed latency per call"""
+
+    def __init__(self, submissions, latency):
+        self.latency = latency
+        self.evaluation = Evaluation(name="benchmark", id="1", contentSource="syn1")
+        self.bundles = [
+            (
+                Submission(
+                    id=str(subid),
+                    name=f"submission {subid}",
+                    entityId="syn2",
+                    evaluationId="1",
+                    versionNumber=1,
+                    userId="3",
+                ),
+                SubmissionStatus(id=str(subid), status="RECEIVED", etag="etag"),
+            )
+            for subid in range(submissions)
+        ]
+        self.rest_calls = 0
+
+    def _request(self):
+        self.rest_calls += 1
+        time.sleep(self.latency)
+
+    def getEvaluation(self, evaluation):
+        self._request()
+        return self.evaluation
+
+    def getUserProfile(self, userid=None):
+        self._request()
+        return {"ownerId": "3", "userName": "benchmark"}
+
+    def getTeam(self, teamid):
+        self._request()
+        return {"name": "benchmark"}
+
+    def getSubmissionBundles(self, evaluation, status=None, limit=20):
+        for index, bundle in enumerate(self.bundles):
+            if index % limit == 0:
+                self._request()
+            yield bundle
+
+    def getSubmission(self, submission, **kwargs):
+        self._request()
+        submission = Submission(**submission)
+        submission.filePath = None
+        return submission
+
+    def store(self, obj):
+        self._request()
+        return obj
+
+    def sendMessage(self, **kwargs):
+        self._request()
+
+
+class Validate(EvaluationQueueValidator):
+    """Validator that accepts everything"""
+
+    acknowledge_receipt = True
+
+    def interaction_func(self, submission, **kwargs):
+        return {"valid": True, "annotations": {}, "message": "valid"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--submissions", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument(
+        "--max-workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    args = parser.parse_args()
+    logging.getLogger("scoring_harness").setLevel(logging.WARNING)
+
+    rows = []
+    for max_workers in args.max_workers:
+        syn = LatencySynapse(args.submissions, args.latency)
+        validate = Validate(
+            syn,
+            "1",
+            admin_user_ids=["3"],
+            send_messages=True,
+            max_workers=max_workers,
+        )
+        start = time.perf_counter()
+        validate()
+        elapsed = time.perf_counter() - start
+        rows.append(
+            [max_workers, f"{elapsed:.2f}", f"{args.submissions / elapsed:.1f}"]
+        )
+    print(tabulate(rows, headers=["max_workers", "seconds", "submissions/s"]))
+
+
+if __name__ == "__main__":
+    main()
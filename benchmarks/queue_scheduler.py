@@ -0,0 +1,118 @@
+"""Simulate how long submissions wait with and without the fair scheduler
+
+One flooded queue holds most of the pending submissions, most of them from
+a single team, while a few small queues configured after it hold only a
+handful.  Every submission takes the same simulated time to process, and
+the latency of a submission is the time from the start of the run until
+it has been processed.
+
+    python -m benchmarks.queue_scheduler --flood 2000 --small-queues 3
+"""
+
+import argparse
+import random
+
+from tabulate import tabulate
+
+from scoring_harness.scheduler import fair_order, interleave
+
+from .stats import percentile
+
+
+def make_queues(flood, flood_teams, small_queues, small_size, seed):
+    """Pending submissions of each queue as (queue, submitter) pairs"""
+    rand = random.Random(seed)
+    queues = {
+        "flooded": [
+            (
+                "flooded",
+                "team-0" if rand.random() < 0.9 else f"team-{index % flood_teams}",
+            )
+            for index in range(flood)
+        ]
+    }
+    for queue_index in range(small_queues):
+        name = f"small-{queue_index}"
+        queues[name] = [
+            (name, f"team-{rand.randrange(small_size)}") for _ in range(small_size)
+        ]
+    return queues
+
+
+def simulate(order, service_time):
+    """Latencies of each queue and submitter when processed in order"""
+    queue_latencies = {}
+    submitter_latencies = {}
+    for position, (queue, submitter) in enumerate(order, start=1):
+        latency = position * service_time
+        queue_latencies.setdefault(queue, []).append(latency)
+        submitter_latencies.setdefault((queue, submitter), []).append(latency)
+    return queue_latencies, submitter_latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--flood", type=int, default=2000)
+    parser.add_argument("--flood-teams", type=int, default=20)
+    parser.add_argument("--small-queues", type=int, default=3)
+    parser.add_argument("--small-size", type=int, default=20)
+    parser.add_argument(
+        "--service-time", type=float, default=1.0, help="seconds per submission"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    queues = make_queues(
+        args.flood, args.flood_teams, args.small_queues, args.small_size, args.seed
+    )
+    orders = {
+        "sequential": [item for items in queues.values() for item in items],
+        "fair": [
+            item
+            for _, item in interleave(
+                {
+                    name: fair_order(items, key=lambda item: item[1])
+                    for name, items in queues.items()
+                }
+            )
+        ],
+    }
+    rows = []
+    for scheduler, order in orders.items():
+        queue_latencies, submitter_latencies = simulate(order, args.service_time)
+        for queue, latencies in queue_latencies.items():
+            # Time until each team got its first submission processed
+            first_results = [
+                min(team_latencies)
+                for (team_queue, _), team_latencies in submitter_latencies.items()
+                if team_queue == queue
+            ]
+            rows.append(
+                [
+                    scheduler,
+                    queue,
+                    len(latencies),
+                    f"{percentile(latencies, 50):.0f}",
+                    f"{percentile(latencies, 95):.0f}",
+                    f"{max(latencies):.0f}",
+                    f"{percentile(first_results, 95):.0f}",
+                ]
+            )
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "scheduler",
+                "queue",
+                "submissions",
+                "p50 s",
+                "p95 s",
+                "max s",
+                "p95 first result per team s",
+            ],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
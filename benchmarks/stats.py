@@ -0,0 +1,16 @@
+"""Statistics shared by the benchmarks"""
+
+
+def percentile(values, percent):
+    """Nearest rank percentile
+
+    Args:
+        values: Numbers, in any order
+        percent: Percentile between 0 and 100
+
+    Returns:
+        The value at the percentile
+    """
+    values = sorted(values)
+    rank = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[rank]
@@ -1,15 +1,25 @@
 """Run challenge invoker"""
 #! /usr/bin/env python3
 import argparse
+from datetime import timedelta
+import functools
 import importlib
 import logging
-from datetime import timedelta
+import sys
 
 import synapseclient
 from synapseclient.exceptions import SynapseAuthenticationError
 from synapseclient.exceptions import SynapseNoCredentialsError
 
-from scoring_harness import lock
+from challengeutils import ratelimit
+from challengeutils.cassette import REPLAY_AUTH_TOKEN, open_cassette
+from challengeutils.identity_cache import IdentityCache
+from scoring_harness import daemon, lock, scheduler
+from scoring_harness.discovery import WatermarkStore
+from scoring_harness.file_cache import SubmissionFileCache
+from scoring_harness.journal import ProcessingJournal
+from scoring_harness.metrics import HarnessMetrics
+from scoring_harness.outbox import MessageOutbox
 
 logging.basicConfig(format="%(asctime)s %(message)s")
 LOGGER = logging.getLogger(__name__)
@@ -28,6 +38,8 @@ def import_config_py(config_path):
     """
     spec = importlib.util.spec_from_file_location("config", config_path)
     module = importlib.util.module_from_spec(spec)
+    # Registered so that its processors can be pickled for --isolate
+    sys.modules[spec.name] = module
     spec.loader.exec_module(module)
     return module
 
@@ -35,6 +47,118 @@ def import_config_py(config_path):
 # ==================================================
 #  Handlers for command
 # ==================================================
+def build_processors(syn, evaluation_queue_maps, **processor_kwargs):
+    """
+    Create the processors of each evaluation queue
+
+    Args:
+        syn: Synapse object
+        evaluation_queue_maps: dict of evaluation id to list of queue configs
+        **processor_kwargs: Options passed to every processor
+
+    Returns:
+        dict of evaluation id to list of processors
+    """
+    queue_processors = {}
+    for queueid in evaluation_queue_maps:
+        queue_processors[queueid] = [
+            config["func"](syn, queueid, **processor_kwargs, **config["kwargs"])
+            for config in evaluation_queue_maps[queueid]
+        ]
+    return queue_processors
+
+
+def run_with_lock(queueid, processor, lock_dir=None):
+    """
+    Run a processor while holding the lock of its evaluation queue and
+    processor type, so that harness processes on any host sharing
+    lock_dir can work on different queues at once.
+
+    Args:
+        queueid: Evaluation id
+        processor: EvaluationQueueProcessor
+        lock_dir: Directory the locks are created in
+
+    Returns:
+        int: Number of submissions processed
+
+    Raises:
+        LockedException: The queue is processed by another harness
+    """
+    processor_lock = _acquire_lock(queueid, processor, lock_dir=lock_dir)
+    try:
+        return processor()
+    finally:
+        processor_lock.release()
+
+
+def _acquire_lock(queueid, processor, lock_dir=None):
+    """Acquire the lock of an evaluation queue and processor type"""
+    name = f"challenge_{queueid}_{type(processor).__name__}"
+    return lock.acquire_lock_or_fail(
+        name, directory=lock_dir, lease=lock.LOCK_DEFAULT_LEASE
+    )
+
+
+def run_fair(queue_processors, evaluation_queue_maps, max_workers=1, lock_dir=None):
+    """
+    Interleave the submissions of all evaluation queues instead of working
+    through one queue after another.  The first processor of every queue
+    (e.g. the validators) runs first, then the second and so on, so that
+    scorers see the submissions validated in the same run.  A queue
+    config can set a "weight" (default 1) for its share of the turns and
+    a "priority" (default 0) to be served before lower priority queues.
+
+    Args:
+        queue_processors: dict of evaluation id to list of processors
+        evaluation_queue_maps: dict of evaluation id to list of queue configs
+        max_workers: Number of submissions processed at once
+        lock_dir: Directory the locks are created in
+
+    Returns:
+        bool: False if any queue was skipped because it is locked
+    """
+    all_locks_acquired = True
+    rounds = max((len(queue) for queue in queue_processors.values()), default=0)
+    for index in range(rounds):
+        processors, weights, priorities, held_locks = {}, {}, {}, []
+        try:
+            for queueid, queue in queue_processors.items():
+                if index >= len(queue):
+                    continue
+                try:
+                    held_locks.append(
+                        _acquire_lock(queueid, queue[index], lock_dir=lock_dir)
+                    )
+                except lock.LockedException as ex:
+                    LOGGER.error(f"Is the scoring script already running? {ex}")
+                    all_locks_acquired = False
+                    continue
+                config = evaluation_queue_maps[queueid][index]
+                processors[queueid] = queue[index]
+                weights[queueid] = config.get("weight", 1)
+                priorities[queueid] = config.get("priority", 0)
+            scheduler.run_interleaved(
+                processors,
+                weights=weights,
+                priorities=priorities,
+                max_workers=max_workers,
+            )
+        finally:
+            for processor_lock in held_locks:
+                processor_lock.release()
+    return all_locks_acquired
+
+
+def _run_if_unlocked(queueid, processor, lock_dir=None):
+    """Run a processor unless its queue is locked by another harness"""
+    try:
+        return run_with_lock(queueid, processor, lock_dir=lock_dir)
+    except lock.LockedException as ex:
+        LOGGER.info(f"Skipping queue {queueid}: {ex}")
+        return 0
+
+
 def command(
     syn,
     evaluation_queue_maps,
@@ -43,34 +167,184 @@ def command(
     remove_cache=False,
     send_messages=False,
     notifications=True,
+    max_workers=1,
+    prefetch=0,
+    status_batch_size=None,
+    lock_dir=None,
+    identity_cache=None,
+    outbox=None,
+    isolate=False,
+    timeout=None,
+    memory_limit=None,
+    journal=None,
+    metrics=None,
+    watermarks=None,
+    submission_view=None,
+    sweep_interval=None,
+    fair=False,
+    file_cache=None,
 ):
-    for queueid in evaluation_queue_maps:
-        for config in evaluation_queue_maps[queueid]:
-            invoke_func = config["func"]
-            invoke = invoke_func(
-                syn,
-                queueid,
-                admin_user_ids=admin_user_ids,
-                dry_run=dry_run,
-                remove_cache=remove_cache,
-                send_messages=send_messages,
-                notifications=notifications,
-                **config["kwargs"],
-            )
-            invoke()
+    """
+    Run the processors of each evaluation queue once.  If fair, the
+    submissions of all queues are interleaved (see run_fair) and each
+    queue takes turns between its submitters.
+
+    Returns:
+        bool: False if any queue was skipped because it is locked
+    """
+    queue_processors = build_processors(
+        syn,
+        evaluation_queue_maps,
+        admin_user_ids=admin_user_ids,
+        dry_run=dry_run,
+        remove_cache=remove_cache,
+        send_messages=send_messages,
+        notifications=notifications,
+        max_workers=max_workers,
+        prefetch=prefetch,
+        status_batch_size=status_batch_size,
+        identity_cache=identity_cache,
+        outbox=outbox,
+        isolate=isolate,
+        timeout=timeout,
+        memory_limit=memory_limit,
+        journal=journal,
+        metrics=metrics,
+        submitter_fairness=fair,
+        file_cache=file_cache,
+        **_discovery_kwargs(watermarks, submission_view, sweep_interval),
+    )
+    if fair:
+        return run_fair(
+            queue_processors,
+            evaluation_queue_maps,
+            max_workers=max_workers,
+            lock_dir=lock_dir,
+        )
+    all_locks_acquired = True
+    for queueid in queue_processors:
+        for invoke in queue_processors[queueid]:
+            try:
+                run_with_lock(queueid, invoke, lock_dir=lock_dir)
+            except lock.LockedException as ex:
+                LOGGER.error(f"Is the scoring script already running? {ex}")
+                all_locks_acquired = False
+    return all_locks_acquired
+
+
+def _memory_limit_bytes(memory_limit):
+    """Convert a memory limit in MB to bytes"""
+    return None if memory_limit is None else int(memory_limit * 1024**2)
+
+
+def _discovery_kwargs(watermarks, submission_view, sweep_interval):
+    """Options of watermark based submission discovery that were set"""
+    discovery_kwargs = {"watermarks": watermarks, "submission_view": submission_view}
+    if sweep_interval is not None:
+        discovery_kwargs["sweep_interval"] = timedelta(seconds=sweep_interval)
+    return discovery_kwargs
+
+
+def export_metrics(metrics, args):
+    """Write the metrics to the files requested on the command line"""
+    if args.metrics_file:
+        metrics.write_prometheus(args.metrics_file)
+    if args.metrics_summary:
+        metrics.write_summary(args.metrics_summary)
+
+
+def run_daemon(
+    syn,
+    evaluation_queue_maps,
+    args,
+    identity_cache=None,
+    outbox=None,
+    journal=None,
+    metrics=None,
+    watermarks=None,
+    file_cache=None,
+):
+    """
+    Keep one Synapse session and poll each evaluation queue on an
+    adaptive interval until SIGTERM or SIGINT is received
+
+    Args:
+        syn: Synapse object
+        evaluation_queue_maps: dict of evaluation id to list of queue configs
+        args: Parsed command line arguments
+        identity_cache: IdentityCache shared by all processors
+        outbox: MessageOutbox shared by all processors
+        journal: ProcessingJournal shared by all processors
+        metrics: HarnessMetrics shared by all processors, exported after
+                 every poll
+        watermarks: WatermarkStore shared by all processors
+        file_cache: SubmissionFileCache shared by all processors
+    """
+    queue_processors = build_processors(
+        syn,
+        evaluation_queue_maps,
+        admin_user_ids=args.admin_user_ids,
+        dry_run=args.dry_run,
+        remove_cache=args.remove_cache,
+        send_messages=args.send_messages,
+        notifications=args.notifications,
+        max_workers=args.max_workers,
+        prefetch=args.prefetch,
+        status_batch_size=args.status_batch_size,
+        identity_cache=identity_cache,
+        outbox=outbox,
+        isolate=args.isolate,
+        timeout=args.timeout,
+        memory_limit=_memory_limit_bytes(args.memory_limit),
+        journal=journal,
+        metrics=metrics,
+        submitter_fairness=args.fair,
+        file_cache=file_cache,
+        **_discovery_kwargs(watermarks, args.submission_view, args.sweep_interval),
+    )
+    # Take the lock of a queue for every poll rather than for the lifetime
+    # of the daemon so that other harnesses can pick up the queue if this
+    # one stops
+    locked_processors = {
+        queueid: [
+            functools.partial(_run_if_unlocked, queueid, processor, args.lock_dir)
+            for processor in processors
+        ]
+        for queueid, processors in queue_processors.items()
+    }
+    queue_daemon = daemon.QueueDaemon(
+        locked_processors,
+        min_interval=args.min_poll_interval,
+        max_interval=args.max_poll_interval,
+        on_poll=None if metrics is None else lambda: export_metrics(metrics, args),
+    )
+    queue_daemon.install_signal_handlers()
+    queue_daemon.run()
 
 
 def main(args):
     """Main method that executes validate / scoring"""
+    # Requests are recorded to or replayed from a cassette if asked to
+    cassette = open_cassette(record=args.record, replay=args.replay)
+    session = None if cassette is None else cassette.session()
     # Synapse login
     try:
         if args.synapse_config is not None:
             syn = synapseclient.Synapse(
-                debug=args.debug, configPath=args.synapse_config
+                debug=args.debug,
+                configPath=args.synapse_config,
+                requests_session=session,
             )
         else:
-            syn = synapseclient.Synapse(debug=args.debug)
-        syn.login(silent=True)
+            syn = synapseclient.Synapse(debug=args.debug, requests_session=session)
+        if cassette is not None and cassette.replaying:
+            syn.login(authToken=REPLAY_AUTH_TOKEN, silent=True)
+        else:
+            budgets = ratelimit.parse_budgets(args.rate_limit)
+            if budgets:
+                # The harness threads and the outbox share one rate limiter
+                ratelimit.install(syn, ratelimit.RateLimiter(budgets, defaults=False))
+            syn.login(silent=True)
     except (SynapseAuthenticationError, SynapseNoCredentialsError):
         raise ValueError(
             "Must provide Synapse credentials as parameters or "
@@ -114,29 +388,88 @@ def main(args):
     else:
         eval_queues = evaluation_queue_maps
 
-    # Acquire lock, don't run two scoring scripts at once
-    try:
-        update_lock = lock.acquire_lock_or_fail("challenge", max_age=timedelta(hours=4))
-    except lock.LockedException:
-        LOGGER.error("Is the scoring script already running? " "Can't acquire lock.")
-        # can't acquire lock, so return error code 75 which is a
-        # temporary error according to /usr/include/sysexits.h
-        return 75
-
-    try:
-        command(
-            syn,
-            eval_queues,
-            admin_user_ids=args.admin_user_ids,
-            dry_run=args.dry_run,
-            remove_cache=args.remove_cache,
-            send_messages=args.send_messages,
-            notifications=args.notifications,
+    # Each queue is locked while it is processed, so two harnesses never
+    # work on the same queue at once
+    # Validators and scorers share submitter names
+    identity_cache = IdentityCache(path=args.identity_cache)
+    # Messages are sent in the background so scoring never waits on them.
+    # The outbox is only used with a file, so that queued messages survive
+    # a crash.  Otherwise messages are sent as submissions are processed.
+    outbox = None
+    if args.outbox:
+        outbox = MessageOutbox(syn, path=args.outbox)
+        outbox.start()
+    # Work done before a crash is picked up from the journal
+    journal = ProcessingJournal(args.journal) if args.journal else None
+    metrics = HarnessMetrics()
+    watermarks = WatermarkStore(args.watermark_file) if args.watermark_file else None
+    # Validators and scorers share downloaded submissions
+    file_cache = None
+    if args.submission_cache:
+        file_cache = SubmissionFileCache(
+            args.submission_cache,
+            max_bytes=int(args.submission_cache_size * 1024**2),
         )
+    if args.metrics_port is not None:
+        port = metrics.serve(args.metrics_port)
+        LOGGER.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    all_locks_acquired = True
+    try:
+        if args.daemon:
+            run_daemon(
+                syn,
+                eval_queues,
+                args,
+                identity_cache=identity_cache,
+                outbox=outbox,
+                journal=journal,
+                metrics=metrics,
+                watermarks=watermarks,
+                file_cache=file_cache,
+            )
+        else:
+            all_locks_acquired = command(
+                syn,
+                eval_queues,
+                admin_user_ids=args.admin_user_ids,
+                dry_run=args.dry_run,
+                remove_cache=args.remove_cache,
+                send_messages=args.send_messages,
+                notifications=args.notifications,
+                max_workers=args.max_workers,
+                prefetch=args.prefetch,
+                status_batch_size=args.status_batch_size,
+                lock_dir=args.lock_dir,
+                identity_cache=identity_cache,
+                outbox=outbox,
+                isolate=args.isolate,
+                timeout=args.timeout,
+                memory_limit=_memory_limit_bytes(args.memory_limit),
+                journal=journal,
+                metrics=metrics,
+                watermarks=watermarks,
+                submission_view=args.submission_view,
+                sweep_interval=args.sweep_interval,
+                fair=args.fair,
+                file_cache=file_cache,
+            )
     except Exception as e:
         LOGGER.error(e)
+    export_metrics(metrics, args)
+    metrics.close()
+    if outbox is not None:
+        # Wait for queued messages to be sent
+        outbox.close()
+    if journal is not None:
+        journal.close()
+    identity_cache.close()
+    if cassette is not None:
+        cassette.close()
 
-    update_lock.release()
+    if not all_locks_acquired:
+        # can't acquire lock, so return error code 75 which is a
+        # temporary error according to /usr/include/sysexits.h
+        return 75
 
     return 0
 
@@ -148,6 +481,31 @@ if __name__ == "__main__":
 
     parser.add_argument("-c", "--synapse_config", help="Path to Synapse Config File")
 
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record",
+        metavar="CASSETTE",
+        help="Record every Synapse request and response to this file, with "
+        "credentials redacted, to reproduce the run with --replay",
+    )
+    cassette.add_argument(
+        "--replay",
+        metavar="CASSETTE",
+        help="Serve Synapse requests from a file written by --record "
+        "instead of Synapse",
+    )
+
+    parser.add_argument(
+        "--rate-limit",
+        action="append",
+        metavar="CLASS=RATE",
+        help="Requests per second to Synapse of an endpoint class (read, "
+        "write, query or file), e.g. --rate-limit write=5. Can be given "
+        "once per class; classes without a rate aren't limited. Throttled "
+        "requests are retried after the time Synapse asks for, except "
+        "POST and PUT requests that got a 503. Default is no limit.",
+    )
+
     parser.add_argument(
         "--notifications",
         help="Send error notifications to challenge admins",
@@ -179,6 +537,171 @@ if __name__ == "__main__":
         action="store_true",
     )
 
+    parser.add_argument(
+        "--max-workers",
+        help="Number of submissions to process at once per evaluation queue",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        help="Number of submissions to download ahead of the one being processed",
+        type=int,
+        default=0,
+    )
+
+    parser.add_argument(
+        "--status-batch-size",
+        help="Store this many submission statuses per request",
+        type=int,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--daemon",
+        help="Keep running and poll the evaluation queues until SIGTERM",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--min-poll-interval",
+        help="Daemon mode: seconds between polls of a queue that just "
+        "received submissions",
+        type=float,
+        default=daemon.DEFAULT_MIN_INTERVAL,
+    )
+
+    parser.add_argument(
+        "--max-poll-interval",
+        help="Daemon mode: longest wait in seconds between polls of an idle queue",
+        type=float,
+        default=daemon.DEFAULT_MAX_INTERVAL,
+    )
+
+    parser.add_argument(
+        "--lock-dir",
+        help="Directory to create queue locks in.  Use a shared directory "
+        "to run harnesses for the same challenge on several hosts.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--identity-cache",
+        help="SQLite file to keep submitter names in across runs",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--outbox",
+        help="SQLite file to queue messages in, which are then sent in the "
+        "background.  Messages that could not be sent before the harness "
+        "stopped are sent on the next run.  Default is to send messages "
+        "as submissions are processed.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--isolate",
+        help="Run each submission's interaction in its own process",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--timeout",
+        help="With --isolate: seconds a submission may run for before "
+        "it is marked INVALID",
+        type=float,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--memory-limit",
+        help="With --isolate: MB of memory a submission may use before "
+        "it is marked INVALID",
+        type=float,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--journal",
+        help="File to journal the progress of each submission in.  After a "
+        "crash, results that weren't stored are reused and notifications "
+        "that weren't sent are resent.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        help="File to write Prometheus metrics to at the end of each run "
+        "(or poll in daemon mode), e.g. for the node exporter textfile "
+        "collector",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        help="Serve Prometheus metrics on this localhost port",
+        type=int,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--metrics-summary",
+        help="JSON file to write a summary of the metrics to at the end of "
+        "each run (or poll in daemon mode)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--watermark-file",
+        help="JSON file to keep the latest submission seen in each queue "
+        "in.  Only newer submissions are asked for, with a full sweep of "
+        "each queue every --sweep-interval.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--submission-view",
+        help="With --watermark-file: Synapse id of a submission view of the "
+        "queues to find new submissions with.  Defaults to the evaluation "
+        "query service.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--sweep-interval",
+        help="With --watermark-file: seconds between full sweeps of a queue",
+        type=float,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--fair",
+        help="Interleave the submissions of all queues, weighted by the "
+        "'weight' and 'priority' of each queue config, and take turns "
+        "between the submitters of each queue.  With --daemon, each queue "
+        "is still polled on its own, and only its submitters take turns.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--submission-cache",
+        help="Directory to download submissions to.  Validators and scorers "
+        "share the downloaded files, and the least recently used files are "
+        "removed once the directory is larger than --submission-cache-size.  "
+        "Harnesses sharing the directory don't remove the files the others "
+        "are processing.  Use this instead of --remove-cache.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--submission-cache-size",
+        help="With --submission-cache: size budget of the cache in MB",
+        type=float,
+        default=10240,
+    )
+
     # Add these subparsers after because it takes multiple arguments
     parser.add_argument(
         "-a",
@@ -1,13 +1,12 @@
 """challengeutils command line client"""
 import argparse
+import datetime
 import json
 import logging
 import os
 
-import pandas as pd
 import synapseclient
 from synapseclient.core.retry import with_retry
-from synapseclient.core.utils import from_unix_epoch_time
 from synapseclient.core.exceptions import (
     SynapseNoCredentialsError,
     SynapseAuthenticationError,
@@ -22,11 +21,15 @@ from . import (
     evaluation_queue,
     mirrorwiki,
     permissions,
+    query_cache,
+    query_output,
+    ratelimit,
     submission,
     utils,
     wiki,
 )
 from .__version__ import __version__
+from .cassette import REPLAY_AUTH_TOKEN, open_cassette
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -116,29 +119,36 @@ def command_query(syn, args):
     out.  Proceed `here <https://docs.synapse.org/rest/GET/evaluation/submission/query.html>`_
     to learn more about this query service.
 
+    Results are written page by page as they are fetched, as CSV, JSON Lines
+    or Parquet.  CSV and Parquet fail if a later page adds a column, unless
+    --spool is given.
+
     >>> challengeutils query "select objectId, status from evaluation_12345"
+    >>> challengeutils query "select * from evaluation_12345" --outputfile leaderboard.parquet
     """
-    querydf = pd.DataFrame(
-        list(utils.evaluation_queue_query(syn, args.uri, args.limit, args.offset))
-    )
-    if args.render:
-        # Check if submitterId column exists
-        if querydf.get("submitterId") is not None:
-            submitter_names = [
-                utils._get_submitter_name(syn, submitterid)
-                for submitterid in querydf["submitterId"]
-            ]
-            querydf["submitterName"] = submitter_names
-        # Check if createdOn column exists
-        if querydf.get("createdOn") is not None:
-            createdons = [
-                from_unix_epoch_time(createdon) for createdon in querydf["createdOn"]
-            ]
-            querydf["createdOn"] = createdons
-    if args.outputfile is not None:
-        querydf.to_csv(args.outputfile, index=False)
-    else:
-        print(querydf.to_csv(index=False))
+    output_format = args.format or query_output.format_from_path(args.outputfile)
+    cache = None
+    if args.cache is not None:
+        cache = query_cache.QueryCache(
+            args.cache,
+            ttl=datetime.timedelta(seconds=args.cache_ttl),
+            max_size=args.cache_size * 1024**2,
+        )
+    try:
+        query_output.stream_query(
+            syn,
+            args.uri,
+            output_format=output_format,
+            path=args.outputfile,
+            limit=args.limit,
+            offset=args.offset,
+            render=args.render,
+            cache=cache,
+            spool=args.spool,
+        )
+    finally:
+        if cache is not None:
+            cache.close()
 
 
 def command_change_status(syn, args):
@@ -150,6 +160,27 @@ def command_change_status(syn, args):
     print(utils.change_submission_status(syn, args.submissionid, args.status))
 
 
+def command_change_all_status(syn, args):
+    """Change the status of every submission of a queue that has a status,
+    e.g. to rescore a queue.  Use --checkpoint to be able to resume the
+    change if it is interrupted.
+
+    >>> challengeutils change-all-status 12345 --from-status SCORED --to-status VALIDATED --checkpoint rescore.jsonl
+    """
+    summary = utils.change_all_submission_status(
+        syn,
+        args.evaluationid,
+        submission_status=args.from_status,
+        change_to_status=args.to_status,
+        checkpoint=args.checkpoint,
+        max_workers=args.max_workers,
+        progress=True,
+    )
+    print(summary)
+    for submissionid in summary.failed:
+        print(f"Failed: {submissionid}")
+
+
 def command_writeup_attach(syn, args):
     """Most challenges require participants to submit a writeup.  Using the
     new archive-challenge-project-tool system of receiving writeups, this is
@@ -442,6 +473,30 @@ def build_parser():
         help="credentials file",
     )
 
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record",
+        metavar="CASSETTE",
+        help="Record every Synapse request and response to this file",
+    )
+    cassette.add_argument(
+        "--replay",
+        metavar="CASSETTE",
+        help="Serve Synapse requests from a file written by --record "
+        "instead of Synapse",
+    )
+
+    parser.add_argument(
+        "--rate-limit",
+        action="append",
+        metavar="CLASS=RATE",
+        help="Requests per second to Synapse of an endpoint class (read, "
+        "write, query or file), e.g. --rate-limit write=5. Can be given "
+        "once per class; classes without a rate aren't limited. Throttled "
+        "requests are retried after the time Synapse asks for, except "
+        "POST and PUT requests that got a 503. Default is no limit.",
+    )
+
     parser.add_argument(
         "-v",
         "--version",
@@ -532,6 +587,20 @@ def build_parser():
         "If not specified, it is written as stdout.",
         default=None,
     )
+    parser_query.add_argument(
+        "--format",
+        choices=query_output.FORMATS,
+        help="Output format. Default is given by the extension of "
+        "--outputfile, or csv.",
+    )
+    parser_query.add_argument(
+        "--spool",
+        action="store_true",
+        help="Write CSV or Parquet once every page was fetched, with every "
+        "column of the results.  By default, pages are written as they "
+        "arrive and the query fails if a later page adds a column, e.g. an "
+        "annotation, or a type.",
+    )
     parser_query.add_argument(
         "--render",
         action="store_true",
@@ -540,8 +609,9 @@ def build_parser():
     parser_query.add_argument(
         "--limit",
         type=int,
-        help="How many records should be returned per request",
-        default=20,
+        help="How many records should be returned per request. "
+        "Default adapts to the number of results.",
+        default=None,
     )
     parser_query.add_argument(
         "--offset",
@@ -549,6 +619,24 @@ def build_parser():
         default=0,
         help="At what record offset from the first should iteration start",
     )
+    parser_query.add_argument(
+        "--cache",
+        metavar="PATH",
+        help="SQLite file of cached query results. Cached results are used "
+        "if the number of results and their latest modifiedOn are unchanged.",
+    )
+    parser_query.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=query_cache.DEFAULT_TTL.total_seconds(),
+        help="Seconds cached results are used for (default: one day)",
+    )
+    parser_query.add_argument(
+        "--cache-size",
+        type=int,
+        default=query_cache.DEFAULT_MAX_SIZE // 1024**2,
+        help="MB of cached results kept (default: 512)",
+    )
     parser_query.set_defaults(func=command_query)
 
     parser_change_status = subparsers.add_parser(
@@ -563,6 +651,36 @@ def build_parser():
 
     parser_change_status.set_defaults(func=command_change_status)
 
+    parser_change_all_status = subparsers.add_parser(
+        "change-all-status",
+        help="Changes the status of every submission of a queue with a status",
+    )
+    parser_change_all_status.add_argument(
+        "evaluationid", type=str, help="Synapse evaluation queue id"
+    )
+    parser_change_all_status.add_argument(
+        "--from-status",
+        default="SCORED",
+        help="Status of the submissions to change (default: SCORED)",
+    )
+    parser_change_all_status.add_argument(
+        "--to-status",
+        default="VALIDATED",
+        help="Status to change submissions to (default: VALIDATED)",
+    )
+    parser_change_all_status.add_argument(
+        "--checkpoint",
+        help="File recording the submissions that were changed. Rerun with "
+        "the same file to resume an interrupted change.",
+    )
+    parser_change_all_status.add_argument(
+        "--max-workers",
+        type=int,
+        default=1,
+        help="Number of batches of statuses stored at once",
+    )
+    parser_change_all_status.set_defaults(func=command_change_all_status)
+
     parser_attach_writeup = subparsers.add_parser(
         "attach-writeup",
         help="Attach the write ups of a challenge to its main challenge queue",
@@ -890,19 +1008,36 @@ def build_parser():
     return parser
 
 
-def synapse_login(synapse_config=synapseclient.client.CONFIG_FILE):
+def synapse_login(
+    synapse_config=synapseclient.client.CONFIG_FILE, cassette=None, budgets=None
+):
     """Login to Synapse
 
     Args:
         synapse_config: Path to synapse configuration file.
                         Defaults to ~/.synapseConfig
+        cassette: challengeutils.cassette.Cassette to record the requests
+                  to or replay them from
+        budgets: dict of endpoint class to requests per second of the
+                 rate limiter. Default is no rate limiter. Replayed
+                 requests aren't rate limited.
 
     Returns:
         Synapse connection
     """
     try:
-        syn = synapseclient.Synapse(configPath=synapse_config)
-        syn.login(silent=True)
+        if cassette is None:
+            syn = synapseclient.Synapse(configPath=synapse_config)
+        else:
+            syn = synapseclient.Synapse(
+                configPath=synapse_config, requests_session=cassette.session()
+            )
+        if cassette is not None and cassette.replaying:
+            syn.login(authToken=REPLAY_AUTH_TOKEN, silent=True)
+        else:
+            if budgets:
+                ratelimit.install(syn, ratelimit.RateLimiter(budgets, defaults=False))
+            syn.login(silent=True)
     except (SynapseNoCredentialsError, SynapseAuthenticationError):
         raise ValueError(
             "Login error: please make sure you have correctly "
@@ -918,12 +1053,20 @@ def synapse_login(synapse_config=synapseclient.client.CONFIG_FILE):
 def main():
     parser = build_parser()
     args = parser.parse_args()
-    syn = synapse_login(args.synapse_config)
+    cassette = open_cassette(record=args.record, replay=args.replay)
+    syn = synapse_login(
+        args.synapse_config,
+        cassette=cassette,
+        budgets=ratelimit.parse_budgets(args.rate_limit),
+    )
     try:
         args.func(syn, args)
     except AttributeError:
         parser.print_help()
         parser.exit()
+    finally:
+        if cassette is not None:
+            cassette.close()
 
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@ from synapseclient.annotations import (
     from_synapse_annotations,
 )
 
+from .status_update import update_submission_status_with_retry
 from .utils import update_single_submission_status
 
 
@@ -95,7 +96,9 @@ def annotate_submission_with_json(syn, submissionid, annotation_values, **kwargs
 def annotate_submission(
     syn, submissionid, annotation_dict, status=None, is_private=True, force=False
 ):
-    """Annotate submission with annotation values from a dict
+    """Annotate submission with annotation values from a dict.  If the
+    submission status is modified concurrently, it is read again and the
+    annotations are added to it.
 
     Args:
         syn: Synapse object
@@ -105,7 +108,6 @@ def annotate_submission(
         force: Force change the annotation from
                private to public and vice versa.
     """
-    sub_status = syn.getSubmissionStatus(submissionid)
     # Don't add any annotations that are None or []
     not_add = [None, []]
     annotation_dict = {
@@ -113,9 +115,12 @@ def annotate_submission(
         for key in annotation_dict
         if annotation_dict[key] not in not_add
     }
-    # TODO: Remove once submissionview is fully supported
-    sub_status = update_single_submission_status(
-        sub_status, annotation_dict, is_private=is_private, force=force
-    )
-    sub_status = update_submission_status(sub_status, annotation_dict, status=status)
-    return syn.store(sub_status)
+
+    def merge(sub_status):
+        # TODO: Remove once submissionview is fully supported
+        sub_status = update_single_submission_status(
+            sub_status, annotation_dict, is_private=is_private, force=force
+        )
+        return update_submission_status(sub_status, annotation_dict, status=status)
+
+    return update_submission_status_with_retry(syn, submissionid, merge)
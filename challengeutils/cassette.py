@@ -0,0 +1,324 @@
+"""
+Record the REST traffic of a Synapse client to a cassette file and serve
+it back, so that a slow production run can be reproduced and profiled
+offline with real data.
+
+Recording captures every request made through the client's requests
+session, along with its response and how long it took, with credentials
+and pre-signed URL signatures redacted.  Cassettes are gzip compressed
+JSON lines.  Replaying serves each request the next recorded response of
+the same method and URL, in the order they were recorded, without any
+network access.
+
+Uploads that synapseclient makes on its own per-thread sessions, such as
+the message bodies of sendMessage, are not captured.
+"""
+import base64
+from collections import defaultdict, deque
+import gzip
+import io
+import json
+import logging
+import re
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+logger = logging.getLogger(__name__)
+
+RECORD = "record"
+REPLAY = "replay"
+# Replayed requests don't reach Synapse, so any token logs in
+REPLAY_AUTH_TOKEN = "replay"
+REDACTED = "REDACTED"
+
+_SENSITIVE_HEADERS = {
+    "authorization",
+    "cookie",
+    "set-cookie",
+    "sessiontoken",
+    "signature",
+    "signaturetimestamp",
+    "userid",
+}
+_SENSITIVE_PARAMS = {
+    "x-amz-signature",
+    "x-amz-credential",
+    "x-amz-security-token",
+    "signature",
+    "awsaccesskeyid",
+    "key-pair-id",
+    "policy",
+}
+_SENSITIVE_KEYS = {
+    "accesstoken",
+    "apikey",
+    "authtoken",
+    "password",
+    "secretaccesskey",
+    "secretkey",
+    "sessiontoken",
+    "token",
+}
+_SENSITIVE_PARAM_PATTERN = re.compile(
+    r"(?i)\b({})=[^&\"'\s]+".format(
+        "|".join(re.escape(param) for param in _SENSITIVE_PARAMS)
+    )
+)
+
+
+class CassetteError(Exception):
+    """A replayed request was not recorded"""
+
+
+def redact_url(url):
+    """Replace the signatures and credentials in the query of a URL
+
+    Args:
+        url: URL
+
+    Returns:
+        str: URL with sensitive query values replaced
+    """
+    parts = urllib.parse.urlsplit(url)
+    if not parts.query:
+        return url
+    query = [
+        (key, REDACTED if key.lower() in _SENSITIVE_PARAMS else value)
+        for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    ]
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def _redact_json(value):
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key.lower() in _SENSITIVE_KEYS else _redact_json(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_redact_json(item) for item in value]
+    return value
+
+
+def _redact_body(content):
+    """Redact a request or response body
+
+    Returns:
+        dict with the body as text, or base64 encoded if it isn't text
+    """
+    if not content:
+        return {"text": ""}
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(content).decode("ascii")}
+    try:
+        text = json.dumps(_redact_json(json.loads(text)))
+    except ValueError:
+        pass
+    return {"text": _SENSITIVE_PARAM_PATTERN.sub(rf"\1={REDACTED}", text)}
+
+
+def _decode_body(body):
+    if "base64" in body:
+        return base64.b64decode(body["base64"])
+    return body["text"].encode("utf-8")
+
+
+def _redact_headers(headers):
+    return {
+        key: REDACTED if key.lower() in _SENSITIVE_HEADERS else value
+        for key, value in headers.items()
+    }
+
+
+class Cassette:
+    """Cassette file of recorded Synapse requests
+
+    Args:
+        path: Path of the cassette file
+        mode: "record" to capture requests, "replay" to serve them back
+        realtime: When replaying, wait as long as each recorded request
+                  took. Default is to answer immediately.
+    """
+
+    def __init__(self, path, mode=RECORD, realtime=False):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"mode must be {RECORD} or {REPLAY}")
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self._lock = threading.Lock()
+        self._file = None
+        # (method, url) to the interactions not replayed yet
+        self._recorded = defaultdict(deque)
+        self._last = {}
+        if mode == RECORD:
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+        else:
+            self._load()
+
+    @property
+    def replaying(self):
+        """Whether requests are served from the cassette"""
+        return self.mode == REPLAY
+
+    def _load(self):
+        count = 0
+        with gzip.open(self.path, "rt", encoding="utf-8") as cassette_file:
+            try:
+                for line in cassette_file:
+                    interaction = json.loads(line)
+                    key = (interaction["method"], interaction["url"])
+                    self._recorded[key].append(interaction)
+                    count += 1
+            except (EOFError, ValueError):
+                # The recording was cut short, e.g. by a crash
+                logger.warning(f"Cassette {self.path} is truncated")
+        logger.info(f"Loaded {count} requests from {self.path}")
+
+    def record(self, request, response):
+        """Add a request and its response to the cassette
+
+        Args:
+            request: requests.PreparedRequest
+            response: requests.Response whose content was read
+        """
+        headers = {
+            key: value
+            for key, value in response.headers.items()
+            # The content is stored decoded
+            if key.lower() not in ("content-encoding", "content-length")
+        }
+        interaction = {
+            "method": request.method,
+            "url": redact_url(request.url),
+            "request_headers": _redact_headers(request.headers),
+            "request_body": _redact_body(request.body),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": _redact_headers(headers),
+            "body": _redact_body(response.content),
+            "elapsed": response.elapsed.total_seconds(),
+        }
+        with self._lock:
+            self._file.write(json.dumps(interaction) + "\n")
+
+    def play(self, request):
+        """Get the next recorded response of a request
+
+        Args:
+            request: requests.PreparedRequest
+
+        Returns:
+            requests.Response
+        """
+        key = (request.method, redact_url(request.url))
+        with self._lock:
+            recorded = self._recorded.get(key)
+            if recorded:
+                interaction = recorded.popleft()
+                self._last[key] = interaction
+            elif request.method in ("GET", "HEAD") and key in self._last:
+                # Polled more often than when recording
+                interaction = self._last[key]
+            else:
+                raise CassetteError(f"No recorded response to {key[0]} {key[1]}")
+        if self.realtime:
+            time.sleep(interaction["elapsed"])
+        content = _decode_body(interaction["body"])
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.reason = interaction["reason"]
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        response.headers["Content-Length"] = str(len(content))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        response._content_consumed = True
+        # synapseclient reports download progress with raw.tell()
+        response.raw = io.BytesIO(content)
+        response.raw.seek(0, io.SEEK_END)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def session(self):
+        """Get a requests session that records to or replays from this
+        cassette, to pass to synapseclient.Synapse as requests_session"""
+        adapter = ReplayAdapter(self) if self.replaying else RecordingAdapter(self)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        """Finish writing the cassette"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Transport adapter that sends requests and records them
+
+    Args:
+        cassette: Cassette to record to
+    """
+
+    def __init__(self, cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        # Read streamed downloads so that they can be recorded, they are
+        # then served from memory
+        response.content
+        self.cassette.record(request, response)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Transport adapter that serves requests from a cassette
+
+    Args:
+        cassette: Cassette to replay
+    """
+
+    def __init__(self, cassette):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        return self.cassette.play(request)
+
+    def close(self):
+        pass
+
+
+def open_cassette(record=None, replay=None):
+    """Open the cassette given to the --record or --replay option
+
+    Args:
+        record: Path of a cassette to record to
+        replay: Path of a cassette to replay
+
+    Returns:
+        Cassette or None if neither is given
+    """
+    if record is not None and replay is not None:
+        raise ValueError("Only one of record and replay can be given")
+    if record is not None:
+        return Cassette(record, mode=RECORD)
+    if replay is not None:
+        return Cassette(replay, mode=REPLAY)
+    return None
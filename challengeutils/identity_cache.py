@@ -0,0 +1,162 @@
+"""
+Cache of Synapse user and team names so that the same submitter isn't
+looked up once per submission
+"""
+from collections import OrderedDict
+from datetime import timedelta
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+from synapseclient import Synapse
+
+DEFAULT_TTL = timedelta(hours=1)
+DEFAULT_MAX_SIZE = 10000
+
+
+class IdentityCache:
+    """Least recently used cache whose entries expire after a time to
+    live.  Entries can be persisted to a SQLite file so that they are
+    reused across harness runs.
+
+    Args:
+        ttl: How long an entry is valid for. Default is one hour.
+        max_size: Maximum number of entries kept. Default is 10000.
+        path: Path of a SQLite file to persist entries to. Default is
+              to only keep entries in memory.
+    """
+
+    def __init__(
+        self,
+        ttl: timedelta = DEFAULT_TTL,
+        max_size: int = DEFAULT_MAX_SIZE,
+        path: str = None,
+    ):
+        self.ttl = ttl.total_seconds()
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS identities "
+                "(key TEXT PRIMARY KEY, value TEXT, stored REAL)"
+            )
+            self._db.execute(
+                "DELETE FROM identities WHERE stored < ?", (time.time() - self.ttl,)
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT key, value, stored FROM identities ORDER BY stored DESC "
+                "LIMIT ?",
+                (max_size,),
+            ).fetchall()
+            for key, value, stored in reversed(rows):
+                self._entries[key] = (value, stored)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        """Get a cached value
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored = entry
+            if time.time() - stored > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        """Cache a value, evicting the least recently used entries if the
+        cache is full
+
+        Args:
+            key: Cache key
+            value: Value to cache
+        """
+        stored = time.time()
+        with self._lock:
+            self._entries[key] = (value, stored)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_size:
+                evicted.append(self._entries.popitem(last=False)[0])
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO identities VALUES (?, ?, ?)",
+                    (key, value, stored),
+                )
+                self._db.executemany(
+                    "DELETE FROM identities WHERE key = ?",
+                    [(evicted_key,) for evicted_key in evicted],
+                )
+                self._db.commit()
+
+    def lookup(self, key: str, fetch: Callable[[], str]) -> str:
+        """Get a cached value, calling fetch to get and cache it if missing
+
+        Args:
+            key: Cache key
+            fetch: Function returning the value
+
+        Returns:
+            Value
+        """
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            self.set(key, value)
+        return value
+
+    def close(self):
+        """Close the SQLite file"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def get_team_name(syn: Synapse, teamid: str, cache: IdentityCache = None) -> str:
+    """Get the name of a Synapse team
+
+    Args:
+        syn: Synapse object
+        teamid: Synapse team id
+        cache: IdentityCache to use. Default is to not cache.
+
+    Returns:
+        Team name
+    """
+    if cache is None:
+        return syn.getTeam(teamid)["name"]
+    return cache.lookup(f"team:{teamid}", lambda: syn.getTeam(teamid)["name"])
+
+
+def get_user_name(syn: Synapse, userid: str, cache: IdentityCache = None) -> str:
+    """Get the username of a Synapse user
+
+    Args:
+        syn: Synapse object
+        userid: Synapse user id
+        cache: IdentityCache to use. Default is to not cache.
+
+    Returns:
+        Username
+    """
+    if cache is None:
+        return syn.getUserProfile(userid)["userName"]
+    return cache.lookup(
+        f"user:{userid}", lambda: syn.getUserProfile(userid)["userName"]
+    )
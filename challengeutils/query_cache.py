@@ -0,0 +1,271 @@
+"""
+On-disk cache of evaluation queue query results
+
+Results are stored page by page in a SQLite file, keyed by the query
+normalized.  Before cached results are served again, they are revalidated
+with two single row queries: the query must still have as many results,
+and none of them may have been modified after the latest modifiedOn of the
+cached results.  Otherwise the query is fetched again.  Queries with an
+order by, limit or offset clause aren't cached and are run as usual.
+
+    cache = QueryCache("queries.sqlite")
+    leaderboard = list(cache.query(syn, "select * from evaluation_12345"))
+"""
+from datetime import timedelta
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = timedelta(days=1)
+# Bytes of compressed results kept
+DEFAULT_MAX_SIZE = 512 * 1024**2
+MODIFIED_ON = "modifiedOn"
+
+_QUERY_PATTERN = re.compile(
+    r"^\s*select\s+(?P<columns>.+?)\s+from\s+evaluation_(?P<evaluation>\d+)"
+    r"(?:\s+where\s+(?P<where>.+?))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+# Clauses that can't be combined with the conditions and paging added to
+# a cached query
+_UNCACHEABLE_PATTERN = re.compile(r"\b(?:order\s+by|limit|offset)\b", re.IGNORECASE)
+_QUOTED_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"")
+
+
+class CachedQuery:
+    """Parts of an evaluation queue query
+
+    Args:
+        uri: Query (select * from evaluation_12345 where status == 'SCORED')
+    """
+
+    def __init__(self, uri):
+        match = _QUERY_PATTERN.match(uri)
+        if match is None or _UNCACHEABLE_PATTERN.search(_QUOTED_PATTERN.sub("", uri)):
+            raise ValueError(f"Can't cache query {uri}")
+        self.columns = [column.strip() for column in match.group("columns").split(",")]
+        self.evaluationid = match.group("evaluation")
+        where = match.group("where")
+        self.where = " ".join(where.split()) if where else None
+
+    def uri(self, columns=None, condition=None):
+        """Query of some columns with an extra condition
+
+        Args:
+            columns: Columns to select. Default is the columns of the query.
+            condition: Condition added to the where clause
+        """
+        conditions = [part for part in (self.where, condition) if part]
+        uri = f"select {', '.join(columns or self.columns)} "
+        uri += f"from evaluation_{self.evaluationid}"
+        if conditions:
+            uri += " where " + " and ".join(conditions)
+        return uri
+
+    @property
+    def key(self):
+        """Normalized query"""
+        return self.uri()
+
+    @property
+    def fetch_columns(self):
+        """Columns to fetch, with modifiedOn to revalidate the results"""
+        if "*" in self.columns or MODIFIED_ON in self.columns:
+            return self.columns
+        return self.columns + [MODIFIED_ON]
+
+
+class QueryCache:
+    """Cache of evaluation queue query results in a SQLite file
+
+    Args:
+        path: Path of the SQLite file
+        ttl: How long results are reused for before they are fetched
+             again, even if they are unchanged. Default is one day.
+        max_size: Bytes of compressed results kept. The least recently
+                  used results are removed past this. Default is 512 MB.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: timedelta = DEFAULT_TTL,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        self.ttl = ttl.total_seconds()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS queries (key TEXT PRIMARY KEY, "
+            "count INTEGER, latest INTEGER, stored REAL, used REAL, size INTEGER)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages (key TEXT, page INTEGER, "
+            "content BLOB, PRIMARY KEY (key, page))"
+        )
+        # Pages of results whose fetch didn't finish
+        self._db.execute("DELETE FROM pages WHERE key NOT IN (SELECT key FROM queries)")
+        self._db.commit()
+
+    def _is_fresh(self, syn, query, count, latest, stored):
+        """Check if cached results are still those of the query"""
+        if time.time() - stored > self.ttl:
+            return False
+        page = utils._query_page(syn, query.uri(), 1, 0)
+        if page.get("totalNumberOfResults") != count:
+            return False
+        if latest is None:
+            return True
+        page = utils._query_page(
+            syn, query.uri(["objectId"], f"{MODIFIED_ON} > {latest}"), 1, 0
+        )
+        return page.get("totalNumberOfResults") == 0
+
+    def pages(self, syn, uri, limit=None):
+        """Get the results of a query a page at a time, from the cache if
+        they are unchanged
+
+        Args:
+            syn: Synapse object
+            uri: Evaluation queue query
+            limit: Rows per request when results are fetched
+
+        Yields:
+            dict: Column name to values of each page
+        """
+        try:
+            query = CachedQuery(uri)
+        except ValueError as ex:
+            logger.warning(f"{ex}, running it without the cache")
+            yield from utils.evaluation_queue_query(
+                syn, uri, limit=limit, columnar=True
+            )
+            return
+        with self._lock:
+            entry = self._db.execute(
+                "SELECT count, latest, stored FROM queries WHERE key = ?",
+                (query.key,),
+            ).fetchone()
+        if entry is not None and self._is_fresh(syn, query, *entry):
+            self.hits += 1
+            logger.info(f"Using cached results of {query.key}")
+            yield from self._cached_pages(query.key)
+        else:
+            self.misses += 1
+            yield from self._fetch(syn, query, limit)
+
+    def query(self, syn, uri, limit=None):
+        """Get the results of a query, from the cache if they are unchanged
+
+        Args:
+            syn: Synapse object
+            uri: Evaluation queue query
+            limit: Rows per request when results are fetched
+
+        Yields:
+            dict: A result
+        """
+        for page in self.pages(syn, uri, limit=limit):
+            columns = list(page)
+            for values in zip(*page.values()):
+                yield dict(zip(columns, values))
+
+    def _cached_pages(self, key):
+        with self._lock:
+            self._db.execute(
+                "UPDATE queries SET used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+            count = self._db.execute(
+                "SELECT COUNT(*) FROM pages WHERE key = ?", (key,)
+            ).fetchone()[0]
+        for index in range(count):
+            with self._lock:
+                content = self._db.execute(
+                    "SELECT content FROM pages WHERE key = ? AND page = ?",
+                    (key, index),
+                ).fetchone()[0]
+            yield json.loads(zlib.decompress(content))
+
+    def _fetch(self, syn, query, limit):
+        """Fetch the results of a query and cache them as they are yielded"""
+        with self._lock:
+            # Stale results are removed first, so that they aren't mixed
+            # with the new ones if the fetch doesn't finish
+            self._db.execute("DELETE FROM queries WHERE key = ?", (query.key,))
+            self._db.execute("DELETE FROM pages WHERE key = ?", (query.key,))
+            self._db.commit()
+        stored = time.time()
+        count = 0
+        latest = None
+        size = 0
+        index = 0
+        strip = MODIFIED_ON not in query.columns and "*" not in query.columns
+        results = utils.evaluation_queue_query(
+            syn, query.uri(query.fetch_columns), limit=limit, columnar=True
+        )
+        for page in results:
+            modified = [int(value) for value in page.get(MODIFIED_ON, []) if value]
+            if modified:
+                latest = max(latest or 0, max(modified))
+            count += len(next(iter(page.values()), []))
+            if strip:
+                page = {
+                    column: values
+                    for column, values in page.items()
+                    if column != MODIFIED_ON
+                }
+            content = zlib.compress(json.dumps(page).encode("utf-8"))
+            size += len(content)
+            with self._lock:
+                self._db.execute(
+                    "INSERT INTO pages VALUES (?, ?, ?)", (query.key, index, content)
+                )
+            index += 1
+            yield page
+        # Results are only looked up once they are complete
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?, ?)",
+                (query.key, count, latest, stored, stored, size),
+            )
+            self._db.commit()
+            self._evict()
+
+    def _evict(self):
+        """Remove the least recently used results past the size limit"""
+        total = self._db.execute("SELECT TOTAL(size) FROM queries").fetchone()[0]
+        entries = self._db.execute(
+            "SELECT key, size FROM queries ORDER BY used"
+        ).fetchall()
+        for key, size in entries:
+            if total <= self.max_size:
+                break
+            self._db.execute("DELETE FROM queries WHERE key = ?", (key,))
+            self._db.execute("DELETE FROM pages WHERE key = ?", (key,))
+            total -= size
+        self._db.commit()
+
+    def clear(self):
+        """Remove all cached results"""
+        with self._lock:
+            self._db.execute("DELETE FROM queries")
+            self._db.execute("DELETE FROM pages")
+            self._db.commit()
+
+    def close(self):
+        """Close the SQLite file"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,313 @@
+"""
+Write evaluation queue query results as they are fetched
+
+Each page of results is typed and written on its own as it arrives, so
+memory stays at about a page no matter how many rows the query returns.
+Results can be written as CSV, JSON Lines or Parquet, which needs pyarrow
+(pip install challengeutils[parquet]).  Pages of a query don't all have
+the same columns, as annotations are added per submission.  The header
+or schema of CSV and Parquet is that of the first page, so writing them
+fails when a later page adds a column or a type.  Spooling the pages to a
+temporary file first finds every column and its type, at the cost of
+writing nothing until every page was fetched.  JSON Lines rows don't
+share a header and are always written as they arrive.
+"""
+import json
+import logging
+import sys
+import tempfile
+
+import pandas as pd
+from synapseclient.core.utils import from_unix_epoch_time
+
+from . import utils
+from .identity_cache import IdentityCache
+
+logger = logging.getLogger(__name__)
+
+CSV = "csv"
+JSONL = "jsonl"
+PARQUET = "parquet"
+FORMATS = (CSV, JSONL, PARQUET)
+
+# Columns of every queue that hold integers, all other numeric columns are
+# written as floats
+INTEGER_COLUMNS = {"createdOn", "modifiedOn", "versionNumber"}
+# Columns that look numeric but are identifiers, which are kept as text
+TEXT_COLUMNS = {
+    "objectId",
+    "entityId",
+    "evaluationId",
+    "submitterId",
+    "submitterAlias",
+    "teamId",
+    "userId",
+    "repositoryName",
+    "dockerDigest",
+    "name",
+    "status",
+    "etag",
+}
+
+
+def format_from_path(path):
+    """Output format given by the extension of a path, CSV by default"""
+    if path is not None:
+        for extension, output_format in (
+            (".jsonl", JSONL),
+            (".ndjson", JSONL),
+            (".parquet", PARQUET),
+        ):
+            if path.endswith(extension):
+                return output_format
+    return CSV
+
+
+def _widen(dtype, other):
+    """Type that holds the values of two types"""
+    if dtype is None or dtype == other:
+        return other
+    if "string" in (dtype, other):
+        return "string"
+    return "float64"
+
+
+class PageTyper:
+    """Converts query pages to typed DataFrames.  A column is numeric while
+    all of its values are numbers, and becomes text once a page has other
+    values in it, so that no value is lost.
+
+    Args:
+        render: Add a submitterName column and convert createdOn to dates
+        syn: Synapse object, needed to render submitter names
+        identity_cache: IdentityCache of submitter names to render
+    """
+
+    def __init__(self, render=False, syn=None, identity_cache=None):
+        self.render = render
+        self.syn = syn
+        self.identity_cache = identity_cache
+        # Columns in the order they were first seen
+        self.columns = []
+        # Column name to its pandas dtype, for columns that had values
+        self.dtypes = {}
+
+    def _infer(self, column, values):
+        """Type of the values of a column in a page, None if it has none"""
+        if column in TEXT_COLUMNS:
+            return "string"
+        values = values.dropna()
+        if not len(values):
+            return None
+        numeric = pd.to_numeric(values, errors="coerce")
+        if numeric.isna().any():
+            return "string"
+        if column in INTEGER_COLUMNS and (numeric % 1 == 0).all():
+            return "Int64"
+        return "float64"
+
+    def observe(self, columns):
+        """Widen the column types to hold the values of a page
+
+        Args:
+            columns: dict of column name to values of a page
+        """
+        for column, values in columns.items():
+            if column not in self.columns:
+                self.columns.append(column)
+            dtype = self._infer(column, pd.Series(values, dtype=object))
+            if dtype is not None:
+                self.dtypes[column] = _widen(self.dtypes.get(column), dtype)
+
+    def __call__(self, columns):
+        """Type a page of query results
+
+        Args:
+            columns: dict of column name to values of a page
+
+        Returns:
+            pandas.DataFrame with every column seen so far
+        """
+        self.observe(columns)
+        frame = pd.DataFrame(columns)
+        for column in self.columns:
+            if column not in frame:
+                frame[column] = None
+            dtype = self.dtypes.get(column, "string")
+            if dtype == "string":
+                frame[column] = frame[column].astype("string")
+            else:
+                frame[column] = pd.to_numeric(frame[column]).astype(dtype)
+        frame = frame[self.columns]
+        if self.render:
+            if "submitterId" in frame:
+                frame["submitterName"] = [
+                    utils._get_submitter_name(
+                        self.syn, submitterid, identity_cache=self.identity_cache
+                    )
+                    for submitterid in frame["submitterId"]
+                ]
+            if "createdOn" in frame:
+                frame["createdOn"] = [
+                    None if pd.isna(createdon) else from_unix_epoch_time(int(createdon))
+                    for createdon in frame["createdOn"]
+                ]
+        return frame
+
+
+def _spooled(pages, typer):
+    """Spool pages to a temporary file so that the typer has seen every
+    column and value before the first page is typed
+
+    Args:
+        pages: Iterable of dict of column name to values
+        typer: PageTyper that observes each page
+
+    Yields:
+        The pages, once all of them were spooled
+    """
+    with tempfile.TemporaryFile("w+") as spool:
+        for page in pages:
+            typer.observe(page)
+            spool.write(json.dumps(page) + "\n")
+        spool.seek(0)
+        for line in spool:
+            yield json.loads(line)
+
+
+# Raised when a page doesn't fit the header or schema already written
+_SCHEMA_CHANGED = (
+    "Every page must have the same columns and types, {}.  Spool the "
+    "pages to write every column, or write JSON Lines."
+)
+
+
+def _same_columns(frames):
+    """Check that every frame has the columns of the first frame"""
+    columns = None
+    for frame in frames:
+        if columns is None:
+            columns = list(frame.columns)
+        elif list(frame.columns) != columns:
+            raise ValueError(
+                _SCHEMA_CHANGED.format(
+                    f"expected {columns} and got {list(frame.columns)}"
+                )
+            )
+        yield frame
+
+
+def _write_parquet(frames, path):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "Writing Parquet needs pyarrow: pip install challengeutils[parquet]"
+        )
+    writer = None
+    try:
+        for frame in frames:
+            table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+            try:
+                table = table.cast(writer.schema)
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError) as ex:
+                raise ValueError(_SCHEMA_CHANGED.format(ex))
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_query(frames, output_format=CSV, path=None):
+    """Write typed pages of query results as they come
+
+    Args:
+        frames: Iterable of pandas.DataFrame pages. CSV and Parquet pages
+                must all have the same columns and types, see stream_query.
+        output_format: csv, jsonl or parquet
+        path: File to write to. Default is standard out, except for
+              Parquet which must be written to a file.
+
+    Returns:
+        int: Number of rows written
+    """
+    if output_format not in FORMATS:
+        raise ValueError(f"output_format must be one of {', '.join(FORMATS)}")
+    rows = 0
+
+    def counted(frames):
+        nonlocal rows
+        for frame in frames:
+            rows += len(frame)
+            yield frame
+
+    if output_format == PARQUET:
+        if path is None:
+            raise ValueError("Parquet output must be written to a file")
+        _write_parquet(_same_columns(counted(frames)), path)
+        return rows
+    output = sys.stdout if path is None else open(path, "w", newline="")
+    try:
+        if output_format == CSV:
+            frames = _same_columns(frames)
+        for index, frame in enumerate(counted(frames)):
+            if output_format == CSV:
+                frame.to_csv(output, index=False, header=index == 0)
+            elif len(frame):
+                lines = frame.to_json(orient="records", lines=True, date_format="iso")
+                # Older pandas leave out the last newline
+                output.write(lines if lines.endswith("\n") else lines + "\n")
+    finally:
+        if path is not None:
+            output.close()
+    return rows
+
+
+def stream_query(
+    syn,
+    uri,
+    output_format=CSV,
+    path=None,
+    limit=None,
+    offset=0,
+    render=False,
+    cache=None,
+    spool=False,
+):
+    """Query an evaluation queue and write the results as pages arrive.
+
+    Args:
+        syn: Synapse object
+        uri: Evaluation queue query (select * from evaluation_12345)
+        output_format: csv, jsonl or parquet
+        path: File to write to. Default is standard out.
+        limit: Rows per request. Default adapts to the number of results.
+        offset: Row to start from
+        render: Add a submitterName column and convert createdOn to dates
+        cache: challengeutils.query_cache.QueryCache to reuse unchanged
+               results from. Only used when offset is 0.
+        spool: Write CSV and Parquet once every page was fetched, with
+               every column of the results, instead of failing when a
+               page adds a column or a type.
+
+    Returns:
+        int: Number of rows written
+
+    Raises:
+        ValueError: A CSV or Parquet page changed the header or schema
+                    and spool is False
+    """
+    identity_cache = IdentityCache() if render else None
+    typer = PageTyper(render=render, syn=syn, identity_cache=identity_cache)
+    if cache is not None and not offset:
+        pages = cache.pages(syn, uri, limit=limit)
+    else:
+        pages = utils.evaluation_queue_query(
+            syn, uri, limit=limit, offset=offset, columnar=True
+        )
+    if spool and output_format != JSONL:
+        pages = _spooled(pages, typer)
+    return write_query((typer(page) for page in pages), output_format, path)
@@ -0,0 +1,299 @@
+"""
+Client side rate limiting of Synapse REST calls.
+
+Every request made through a Synapse client takes a token from the
+bucket of its endpoint class (reads, writes, queries and file transfers)
+before it is sent.  When Synapse throttles a request with HTTP 429 or
+503, the whole class pauses for the Retry-After time, its rate is halved
+and the request is retried, except for POST and PUT requests after a 503,
+which may have been applied; the rate then creeps back up to its budget
+as requests succeed.  The limiter is shared by every client of the process,
+so threads and clients together never go over the budgets.
+
+    syn = synapseclient.login()
+    ratelimit.install(syn)
+"""
+import email.utils
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+from requests.adapters import BaseAdapter
+
+logger = logging.getLogger(__name__)
+
+READ = "read"
+WRITE = "write"
+QUERY = "query"
+FILE = "file"
+# Requests per second of each endpoint class
+DEFAULT_BUDGETS = {READ: 50, WRITE: 20, QUERY: 10, FILE: 50}
+THROTTLED_STATUS_CODES = (429, 503)
+# Requests that aren't retried after a 503, as they may have been applied
+NON_IDEMPOTENT_METHODS = ("POST", "PUT")
+MAX_BACKOFF = 60
+
+_QUERY_PATHS = ("/evaluation/submission/query", "/table/query", "/query/async")
+
+
+def retry_after_seconds(response):
+    """Seconds to wait given by the Retry-After header of a response
+
+    Args:
+        response: requests.Response
+
+    Returns:
+        float or None if the header is missing or invalid
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+class TokenBucket:
+    """Token bucket that refills at rate tokens per second up to burst.
+    Throttling halves the rate and pauses the bucket, and every success
+    raises the rate back towards its budget.
+
+    Args:
+        rate: Budget in tokens per second
+        burst: Size of the bucket. Default is one second of tokens.
+        min_rate: The rate is never lowered below this. Default is 1% of
+                  the budget.
+    """
+
+    def __init__(self, rate, burst=None, min_rate=None, clock=time.monotonic):
+        self.budget = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.min_rate = min_rate or self.budget / 100
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+        self._paused_until = 0.0
+        self.throttled = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token if one is available
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds to wait
+            before trying again
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Wait for a token and take it"""
+        wait = self.reserve()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.reserve()
+
+    def throttle(self, pause):
+        """Back off after the server throttled a request
+
+        Args:
+            pause: Seconds during which no token is handed out
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._paused_until = max(self._paused_until, now + pause)
+            # Don't release a burst once the pause is over
+            self._tokens = 0.0
+
+    def succeed(self):
+        """Raise the rate towards the budget after a successful request"""
+        with self._lock:
+            if self.rate < self.budget:
+                self.rate = min(self.budget, self.rate + self.budget / 20)
+
+
+class RateLimiter:
+    """Token buckets of each endpoint class
+
+    Args:
+        budgets: dict of endpoint class to requests per second, overriding
+                 DEFAULT_BUDGETS
+        max_retries: Number of times a throttled request is retried
+        defaults: Use DEFAULT_BUDGETS for the classes missing from
+                  budgets. Otherwise only the classes in budgets are
+                  limited.
+    """
+
+    def __init__(self, budgets=None, max_retries=5, defaults=True):
+        budgets = {**(DEFAULT_BUDGETS if defaults else {}), **(budgets or {})}
+        self.buckets = {
+            endpoint_class: TokenBucket(rate)
+            for endpoint_class, rate in budgets.items()
+        }
+        self.max_retries = max_retries
+
+    @staticmethod
+    def classify(request):
+        """Get the endpoint class of a request
+
+        Args:
+            request: requests.PreparedRequest
+
+        Returns:
+            str: read, write, query or file
+        """
+        path = urllib.parse.urlsplit(request.url).path
+        if path.startswith("/file/") or "/fileHandle" in path:
+            return FILE
+        if any(query_path in path for query_path in _QUERY_PATHS):
+            return QUERY
+        if request.method in ("GET", "HEAD", "OPTIONS"):
+            return READ
+        return WRITE
+
+    def send(self, request, send):
+        """Send a request within the budget of its class, retrying it
+        while it is throttled
+
+        Args:
+            request: requests.PreparedRequest
+            send: Function that sends the request and returns its response
+
+        Returns:
+            requests.Response
+        """
+        bucket = self.buckets.get(self.classify(request))
+        if bucket is None:
+            return send()
+        attempt = 0
+        while True:
+            bucket.acquire()
+            response = send()
+            if response.status_code not in THROTTLED_STATUS_CODES:
+                bucket.succeed()
+                return response
+            pause = retry_after_seconds(response)
+            if pause is None:
+                pause = min(MAX_BACKOFF, 2**attempt) * random.uniform(0.5, 1)
+            bucket.throttle(pause)
+            if attempt >= self.max_retries or (
+                response.status_code == 503 and request.method in NON_IDEMPOTENT_METHODS
+            ):
+                return response
+            attempt += 1
+            logger.warning(
+                f"Synapse throttled {request.method} {request.url} with "
+                f"{response.status_code}, retrying in {pause:.1f}s"
+            )
+            response.close()
+
+
+class RateLimitedAdapter(BaseAdapter):
+    """Transport adapter that sends requests through a RateLimiter
+
+    Args:
+        limiter: RateLimiter
+        adapter: Adapter that sends the requests
+        hosts: Only requests to these hosts are limited, e.g. so that
+               downloads from pre-signed S3 URLs aren't.  Default is to
+               limit every request.
+    """
+
+    def __init__(self, limiter, adapter, hosts=None):
+        super().__init__()
+        self.limiter = limiter
+        self.adapter = adapter
+        self.hosts = set(hosts) if hosts is not None else None
+
+    def send(self, request, **kwargs):
+        if (
+            self.hosts is not None
+            and urllib.parse.urlsplit(request.url).netloc not in self.hosts
+        ):
+            return self.adapter.send(request, **kwargs)
+        return self.limiter.send(request, lambda: self.adapter.send(request, **kwargs))
+
+    def close(self):
+        self.adapter.close()
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def default_limiter():
+    """Get the RateLimiter shared by the process"""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
+
+
+def install(syn, limiter=None):
+    """Send the Synapse REST calls of a client through a rate limiter.
+    Requests to other hosts, like pre-signed file URLs, aren't limited.
+
+    Args:
+        syn: Synapse object
+        limiter: RateLimiter. Default is the limiter shared by the process.
+
+    Returns:
+        The RateLimiter
+    """
+    limiter = limiter or default_limiter()
+    hosts = {
+        urllib.parse.urlsplit(endpoint).netloc
+        for endpoint in (syn.repoEndpoint, syn.authEndpoint, syn.fileHandleEndpoint)
+    }
+    session = syn._requests_session
+    for prefix in ("https://", "http://"):
+        adapter = session.get_adapter(prefix)
+        if isinstance(adapter, RateLimitedAdapter):
+            adapter = adapter.adapter
+        session.mount(prefix, RateLimitedAdapter(limiter, adapter, hosts=hosts))
+    return limiter
+
+
+def parse_budgets(values):
+    """Parse --rate-limit options
+
+    Args:
+        values: List of CLASS=RATE strings, e.g. ["read=100", "write=10"]
+
+    Returns:
+        dict of endpoint class to requests per second
+    """
+    budgets = {}
+    for value in values or []:
+        endpoint_class, _, rate = value.partition("=")
+        if endpoint_class not in DEFAULT_BUDGETS:
+            raise ValueError(
+                f"Unknown endpoint class {endpoint_class}, must be one of "
+                f"{', '.join(DEFAULT_BUDGETS)}"
+            )
+        budgets[endpoint_class] = float(rate)
+    return budgets
@@ -0,0 +1,230 @@
+"""
+Write many submission statuses with the statusBatch endpoint
+https://rest-docs.synapse.org/rest/PUT/evaluation/evalId/statusBatch.html
+"""
+import json
+import logging
+import threading
+from typing import Callable, List
+
+from synapseclient import Synapse, SubmissionStatus
+from synapseclient.core.exceptions import SynapseHTTPError
+from synapseclient.core.utils import id_of
+
+from .status_update import update_submission_status_with_retry
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of statuses Synapse accepts in one batch
+MAX_BATCH_SIZE = 500
+# Status codes returned when a batch can't be applied as a whole
+CONFLICT_STATUS_CODES = (409, 412)
+
+
+def _is_conflict(ex: SynapseHTTPError) -> bool:
+    """Check if a Synapse error was caused by conflicting updates"""
+    return getattr(ex.response, "status_code", None) in CONFLICT_STATUS_CODES
+
+
+class SubmissionStatusBatchWriter:
+    """Buffers submission statuses of one evaluation queue and stores them
+    in batches instead of one request per status.  If Synapse rejects a
+    batch because of a conflict, each status of the batch is read again
+    and stored on its own so that a single stale etag doesn't fail the
+    others.
+
+    >>> with SubmissionStatusBatchWriter(syn, 12345) as writer:
+    ...     for _, status in syn.getSubmissionBundles(12345, status="SCORED"):
+    ...         status.status = "VALIDATED"
+    ...         writer.add(status)
+
+    Args:
+        syn: Synapse object
+        evaluation: Evaluation object or id that all statuses belong to
+        batch_size: Number of statuses stored per request. Default is 500.
+        buffer_size: Number of statuses buffered before they are flushed.
+                     Default is batch_size.
+        on_flush: Called with the list of statuses that were stored
+                  after each flush.
+        refresh_etags: Read the statuses stored in a batch again, so that
+                       the statuses passed to on_flush have their new
+                       etags. Synapse only returns the token of the next
+                       batch, so this costs one request per status.
+                       Default is False.
+    """
+
+    def __init__(
+        self,
+        syn: Synapse,
+        evaluation,
+        batch_size: int = MAX_BATCH_SIZE,
+        buffer_size: int = None,
+        on_flush: Callable[[List[SubmissionStatus]], None] = None,
+        refresh_etags: bool = False,
+    ):
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}")
+        self.syn = syn
+        self.evaluationid = id_of(evaluation)
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size if buffer_size is not None else batch_size
+        self.on_flush = on_flush
+        self.refresh_etags = refresh_etags
+        # Statuses that couldn't be stored even on their own
+        self.failed = []
+        # Statuses that their merge left as they were
+        self.skipped = []
+        self._buffer = []
+        self._merges = {}
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    @property
+    def pending(self) -> int:
+        """Number of buffered statuses that weren't stored yet"""
+        with self._lock:
+            return len(self._buffer)
+
+    def add(
+        self,
+        status: SubmissionStatus,
+        merge: Callable[[SubmissionStatus], SubmissionStatus] = None,
+    ):
+        """Buffer a submission status, flushing the buffer once it is full
+
+        Args:
+            status: A synapseclient.SubmissionStatus
+            merge: Applies the change to a SubmissionStatus and returns the
+                   status to store, or None to leave it as it is. It is
+                   applied to status right away, and to a fresh read of
+                   the status if it conflicts, see
+                   update_submission_status_with_retry. Default is to
+                   store status as it is over the fresh read.
+        """
+        with self._lock:
+            if merge is not None:
+                updated = merge(status)
+                if updated is None:
+                    self.skipped.append(status)
+                    return
+                status = updated
+                self._merges[status.id] = merge
+            self._buffer.append(status)
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+    def flush(self) -> List[SubmissionStatus]:
+        """Store all buffered statuses
+
+        Returns:
+            Statuses that were stored
+        """
+        with self._lock:
+            statuses, self._buffer = self._buffer, []
+            stored = []
+            batch_token = None
+            is_first = True
+            for start in range(0, len(statuses), self.batch_size):
+                batch = statuses[start : start + self.batch_size]
+                is_last = start + self.batch_size >= len(statuses)
+                try:
+                    batch_token = self._store_batch(
+                        batch, batch_token, is_first, is_last
+                    )
+                    stored.extend(self._refresh(batch))
+                    for status in batch:
+                        self._merges.pop(status.id, None)
+                    is_first = False
+                except SynapseHTTPError as ex:
+                    if not _is_conflict(ex):
+                        raise
+                    logger.warning(
+                        f"Batch update of {len(batch)} submission statuses "
+                        f"failed ({ex}), storing them one at a time"
+                    )
+                    stored.extend(self._store_each(batch))
+                    # The remaining batches start a new chain
+                    batch_token = None
+                    is_first = True
+            if stored and self.on_flush is not None:
+                self.on_flush(stored)
+            return stored
+
+    def _store_batch(
+        self,
+        batch: List[SubmissionStatus],
+        batch_token: str,
+        is_first: bool,
+        is_last: bool,
+    ) -> str:
+        """Store one batch of statuses
+
+        Args:
+            batch: Submission statuses
+            batch_token: nextUploadToken of the previous batch of the chain
+            is_first: This is the first batch of the chain
+            is_last: This is the last batch of the chain
+
+        Returns:
+            Token for the next batch of the chain
+        """
+        request = {
+            # SubmissionStatus.json() converts submissionAnnotations to the
+            # shape Synapse expects
+            "statuses": [json.loads(status.json()) for status in batch],
+            "isFirstBatch": is_first,
+            "isLastBatch": is_last,
+        }
+        if batch_token is not None:
+            request["batchToken"] = batch_token
+        response = self.syn.restPUT(
+            f"/evaluation/{self.evaluationid}/statusBatch", json.dumps(request)
+        )
+        return response.get("nextUploadToken")
+
+    def _refresh(self, statuses: List[SubmissionStatus]) -> List[SubmissionStatus]:
+        """Update the etags of statuses that were stored in a batch"""
+        if not self.refresh_etags:
+            return statuses
+        for status in statuses:
+            fresh = self.syn.getSubmissionStatus(status.id)
+            status.etag = fresh.etag
+            status.submissionAnnotations = fresh.submissionAnnotations
+        return statuses
+
+    def _store_each(self, statuses: List[SubmissionStatus]) -> List[SubmissionStatus]:
+        """Store statuses one at a time, reading them again on conflicts and
+        keeping track of failures"""
+        stored = []
+        for status in statuses:
+            merge = self._merges.pop(status.id, None) or _replace(status)
+            try:
+                updated = update_submission_status_with_retry(
+                    self.syn, status.id, merge
+                )
+            except SynapseHTTPError as ex:
+                if not _is_conflict(ex):
+                    raise
+                logger.error(f"Unable to store submission status {status.id}: {ex}")
+                self.failed.append(status)
+                continue
+            if updated is None:
+                self.skipped.append(status)
+            else:
+                stored.append(updated)
+        return stored
+
+
+def _replace(status: SubmissionStatus) -> Callable:
+    """Merge that stores a status over whatever was stored since it was read"""
+
+    def merge(fresh):
+        status.etag = fresh.etag
+        return status
+
+    return merge
@@ -0,0 +1,231 @@
+"""
+Change the status of every submission of a queue that has a status, e.g.
+SCORED -> VALIDATED to rescore a queue
+
+The submissions to change are listed before any of them is changed, so
+that changing statuses doesn't shift the pages that are left to list.
+Statuses are then stored in batches, with conflicting ones stored on
+their own after reading them again.  Submissions that are changed are
+recorded in a checkpoint file, so that a transition that is interrupted
+can be resumed without changing a submission twice.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import threading
+import time
+from typing import List
+
+from synapseclient import Synapse, SubmissionStatus
+from synapseclient.core.exceptions import SynapseHTTPError
+from synapseclient.core.utils import id_of, printTransferProgress
+
+from .status_batch import MAX_BATCH_SIZE, SubmissionStatusBatchWriter
+
+logger = logging.getLogger(__name__)
+
+CHANGED = "changed"
+FAILED = "failed"
+
+
+class TransitionSummary:
+    """Outcome of a status transition"""
+
+    def __init__(self, total: int, resumed: int = 0):
+        self.total = total
+        # Submissions changed by an earlier, interrupted run
+        self.resumed = resumed
+        self.changed = 0
+        # Submissions whose status was changed by someone else meanwhile
+        self.moved = 0
+        self.failed = []
+        self.seconds = 0.0
+
+    @property
+    def per_second(self) -> float:
+        """Submissions changed per second"""
+        return self.changed / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"Changed {self.changed} of {self.total} submissions in "
+            f"{self.seconds:.1f}s ({self.per_second:.1f}/s), "
+            f"{self.resumed} already changed, {self.moved} moved by someone "
+            f"else, {len(self.failed)} failed"
+        )
+
+
+class TransitionCheckpoint:
+    """JSON lines file of the submissions a transition changed.  Lines are
+    fsync'd so that they survive a crash.
+
+    Args:
+        path: Path of the checkpoint file
+        evaluationid: Evaluation queue of the transition
+        from_status: Status that is changed
+        to_status: Status it is changed to
+    """
+
+    def __init__(self, path: str, evaluationid: str, from_status: str, to_status: str):
+        self.path = path
+        self.header = {
+            "evaluation": str(evaluationid),
+            "from": from_status,
+            "to": to_status,
+        }
+        self.changed = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+            self._file = open(path, "a")
+        else:
+            self._file = open(path, "a")
+            self._write(self.header)
+
+    def _load(self):
+        with open(self.path) as checkpoint:
+            lines = checkpoint.read().splitlines()
+        if not lines or json.loads(lines[0]) != self.header:
+            raise ValueError(
+                f"Checkpoint {self.path} is of another transition than "
+                f"{self.header}"
+            )
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line was cut short by a crash
+                continue
+            if entry["outcome"] == CHANGED:
+                self.changed.update(entry["ids"])
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, submissionids: List[str], outcome: str = CHANGED):
+        """Record the outcome of changing submissions
+
+        Args:
+            submissionids: Submission ids
+            outcome: changed or failed
+        """
+        with self._lock:
+            self._write({"outcome": outcome, "ids": submissionids})
+            if outcome == CHANGED:
+                self.changed.update(submissionids)
+
+    def close(self):
+        """Close the checkpoint file"""
+        self._file.close()
+
+
+def _transition(from_status, to_status):
+    """Merge that changes a status, leaving statuses that moved meanwhile"""
+
+    def merge(fresh):
+        if fresh.status != from_status:
+            return None
+        fresh.status = to_status
+        return fresh
+
+    return merge
+
+
+def transition_submission_statuses(
+    syn: Synapse,
+    evaluation,
+    from_status: str = "SCORED",
+    to_status: str = "VALIDATED",
+    checkpoint: str = None,
+    batch_size: int = MAX_BATCH_SIZE,
+    max_workers: int = 1,
+    progress: bool = True,
+) -> TransitionSummary:
+    """Change the status of every submission of a queue that has a status
+
+    Args:
+        syn: Synapse object
+        evaluation: Evaluation queue or its id
+        from_status: Submissions with this status are changed
+        to_status: Status to change them to
+        checkpoint: Path of a file recording the submissions that are
+                    changed. If the file exists, the submissions it
+                    records are skipped.
+        batch_size: Number of statuses stored per request
+        max_workers: Number of batches stored at once
+        progress: Print a progress bar
+
+    Returns:
+        TransitionSummary
+    """
+    evaluationid = id_of(evaluation)
+    start = time.time()
+    checkpoint_file = None
+    if checkpoint is not None:
+        checkpoint_file = TransitionCheckpoint(
+            checkpoint, evaluationid, from_status, to_status
+        )
+    done = checkpoint_file.changed if checkpoint_file is not None else set()
+    statuses = []
+    resumed = 0
+    for _, status in syn.getSubmissionBundles(evaluationid, status=from_status):
+        if status.id in done:
+            resumed += 1
+        else:
+            statuses.append(status)
+    summary = TransitionSummary(len(statuses) + resumed, resumed=resumed)
+    lock = threading.Lock()
+
+    def store(batch):
+        stored = []
+        failed = []
+        writer = SubmissionStatusBatchWriter(
+            syn,
+            evaluationid,
+            batch_size=batch_size,
+            on_flush=lambda flushed: stored.extend(status.id for status in flushed),
+        )
+        try:
+            for status in batch:
+                writer.add(status, merge=_transition(from_status, to_status))
+            writer.flush()
+        except SynapseHTTPError as ex:
+            logger.error(f"Unable to store {len(batch)} submission statuses: {ex}")
+            failed = [status.id for status in batch if status.id not in stored]
+        moved = len(writer.skipped)
+        skipped = {status.id for status in writer.skipped}
+        failed = [subid for subid in failed if subid not in skipped]
+        failed.extend(status.id for status in writer.failed if status.id not in failed)
+        if checkpoint_file is not None:
+            checkpoint_file.record(stored)
+            if failed:
+                checkpoint_file.record(failed, outcome=FAILED)
+        with lock:
+            summary.changed += len(stored)
+            summary.moved += moved
+            summary.failed.extend(failed)
+            if progress:
+                printTransferProgress(
+                    summary.changed + summary.moved + len(summary.failed),
+                    len(statuses),
+                    prefix="Changing statuses",
+                    isBytes=False,
+                    dt=time.time() - start,
+                )
+
+    batches = [
+        statuses[index : index + batch_size]
+        for index in range(0, len(statuses), batch_size)
+    ]
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(store, batches))
+    finally:
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+    summary.seconds = time.time() - start
+    logger.info(str(summary))
+    return summary
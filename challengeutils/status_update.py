@@ -0,0 +1,155 @@
+"""
+Read-merge-write updates of submission statuses
+
+A submission status is stored with the etag it was read with, and Synapse
+rejects it with HTTP 412 when another client, such as the workflow
+orchestrator, stored the status in between.  Instead of failing or
+overwriting the other update, update_submission_status_with_retry reads
+the status again, applies the change to it and stores it, waiting a
+jittered exponential backoff between attempts.
+
+    def add_score(status):
+        return update_single_submission_status(status, {"score": 0.9})
+
+    update_submission_status_with_retry(syn, "9876543", add_score)
+"""
+import logging
+import random
+import threading
+import time
+from typing import Callable, Union
+
+from synapseclient import Synapse, SubmissionStatus
+from synapseclient.core.exceptions import SynapseHTTPError
+from synapseclient.core.utils import id_of
+
+logger = logging.getLogger(__name__)
+
+PRECONDITION_FAILED = 412
+DEFAULT_RETRIES = 8
+# Seconds of the first backoff, doubled with every conflict
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 30
+
+
+def _is_precondition_failed(ex: SynapseHTTPError) -> bool:
+    """Check if a status wasn't stored because its etag is stale"""
+    return getattr(ex.response, "status_code", None) == PRECONDITION_FAILED
+
+
+class ConflictStats:
+    """Counts of status updates and the conflicts they ran into"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.conflicts = 0
+        self.failures = 0
+
+    def record(self, conflicts: int, failed: bool = False):
+        """Record an update
+
+        Args:
+            conflicts: Number of times the update was rejected
+            failed: The update gave up
+        """
+        with self._lock:
+            self.updates += 1
+            self.conflicts += conflicts
+            self.failures += failed
+
+    @property
+    def conflict_rate(self) -> float:
+        """Average number of conflicts per update"""
+        with self._lock:
+            return self.conflicts / self.updates if self.updates else 0.0
+
+    def summary(self) -> dict:
+        """Counts and conflict rate as a dict"""
+        with self._lock:
+            summary = {
+                "updates": self.updates,
+                "conflicts": self.conflicts,
+                "failures": self.failures,
+            }
+        summary["conflict_rate"] = self.conflict_rate
+        return summary
+
+    def reset(self):
+        """Start counting again"""
+        with self._lock:
+            self.updates = self.conflicts = self.failures = 0
+
+
+# Stats of all updates made by the process
+conflict_stats = ConflictStats()
+
+
+def update_submission_status_with_retry(
+    syn: Synapse,
+    submission: Union[str, SubmissionStatus],
+    merge: Callable[[SubmissionStatus], SubmissionStatus],
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    on_conflict: Callable[[SubmissionStatus], None] = None,
+    stats: ConflictStats = None,
+) -> SubmissionStatus:
+    """Apply a change to a submission status and store it, reading the
+    status again and reapplying the change whenever it was modified
+    concurrently (HTTP 412).
+
+    Args:
+        syn: Synapse object
+        submission: Submission id, or a SubmissionStatus that was just
+                    read which is updated without reading it again
+        merge: Applies the change to a SubmissionStatus and returns the
+               status to store, or None to leave the status as it is.
+               Called again on the fresh status after every conflict, so
+               it must not depend on an earlier read.
+        retries: Number of times the update is retried after conflicts
+        backoff: Seconds to wait after the first conflict. The wait
+                 doubles after each conflict, up to MAX_BACKOFF, and a
+                 random part of it is skipped so that writers don't
+                 retry in lockstep.
+        on_conflict: Called with the rejected status on each conflict
+        stats: ConflictStats to record the update in. Default is the
+               stats of the process.
+
+    Returns:
+        The stored synapseclient.SubmissionStatus, or None if merge left
+        it as it is
+    """
+    stats = stats if stats is not None else conflict_stats
+    if isinstance(submission, SubmissionStatus):
+        status = submission
+        submissionid = submission.id
+    else:
+        status = None
+        submissionid = id_of(submission)
+    for attempt in range(retries + 1):
+        if status is None:
+            status = syn.getSubmissionStatus(submissionid)
+        updated = merge(status)
+        if updated is None:
+            return None
+        try:
+            stored = syn.store(updated)
+        except SynapseHTTPError as ex:
+            if not _is_precondition_failed(ex):
+                raise
+            if on_conflict is not None:
+                on_conflict(updated)
+            if attempt == retries:
+                stats.record(attempt + 1, failed=True)
+                raise
+            wait = min(MAX_BACKOFF, backoff * 2**attempt)
+            wait = random.uniform(wait / 2, wait)
+            logger.info(
+                f"Submission status {submissionid} was modified concurrently, "
+                f"retrying in {wait:.1f}s"
+            )
+            time.sleep(wait)
+            status = None
+        else:
+            stats.record(attempt)
+            return stored
@@ -22,6 +22,7 @@ from . import dockertools
 from . import permissions
 from . import utils
 from . import annotations
+from .status_update import update_submission_status_with_retry
 
 WORKFLOW_LAST_UPDATED_KEY = (
     "orgSagebionetworksSynapseWorkflowOrchestratorWorkflowLastUpdated"
@@ -43,7 +44,6 @@ def append_writeup_to_main_submission(row, syn):
     if pd.isnull(row["archived"]):
         print("NO WRITEUP: " + row["submitterId"])
     else:
-        status = syn.getSubmissionStatus(row["objectId"])
         add_writeup_dict = {
             "writeUp": row["entityId"],
             "archivedWriteUp": row["archived"],
@@ -51,8 +51,11 @@ def append_writeup_to_main_submission(row, syn):
         add_writeup = to_submission_status_annotations(
             add_writeup_dict, is_private=False
         )
-        new_status = utils.update_single_submission_status(status, add_writeup)
-        syn.store(new_status)
+        update_submission_status_with_retry(
+            syn,
+            row["objectId"],
+            lambda status: utils.update_single_submission_status(status, add_writeup),
+        )
 
 
 def attach_writeup(syn, writeup_queueid, submission_queueid):
@@ -1,10 +1,13 @@
 """
 Challenge utility functions
 """
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import itertools
 import json
 import logging
-import sys
+import math
 import urllib
 
 import synapseclient
@@ -15,9 +18,24 @@ from synapseclient.annotations import (
 from synapseclient.core.exceptions import SynapseHTTPError
 from synapseclient.core.utils import id_of
 
+from .status_batch import SubmissionStatusBatchWriter
+from .status_transition import transition_submission_statuses
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Rows of the first page of an evaluation queue query when the limit adapts
+QUERY_PAGE_SIZE = 100
+# Largest page requested when the limit adapts, larger responses may be
+# truncated by the service
+MAX_QUERY_PAGE_SIZE = 1000
+# Pages of an evaluation queue query fetched at once
+QUERY_WORKERS = 4
+# Largest page of submissions Synapse returns
+SUBMISSION_PAGE_SIZE = 100
+# Evaluation queues whose contributors are read at once
+CONTRIBUTOR_WORKERS = 8
+
 
 # TODO: Deprecate once fully using submissionviews
 def _switch_annotation_permission(add_annotations, existing_annotations, force=False):
@@ -151,40 +169,105 @@ def update_single_submission_status(
     return status
 
 
+def _query_page(syn, uri, limit, offset):
+    """Get one page of an evaluation queue query"""
+    rest_uri = "/evaluation/submission/query?query=" + urllib.parse.quote_plus(
+        "{} limit {} offset {}".format(uri, limit, offset)
+    )
+    return syn.restGET(rest_uri)
+
+
+def _query_range(syn, uri, start, stop):
+    """Get the pages of the rows from start to stop of a query, asking
+    again for the rest of the range when a response is truncated
+
+    Returns:
+        list: Query pages
+    """
+    pages = []
+    while start < stop:
+        page = _query_page(syn, uri, stop - start, start)
+        if not page["rows"]:
+            break
+        pages.append(page)
+        start += len(page["rows"])
+    return pages
+
+
+def _page_results(page, columnar=False):
+    """Rows of a query page as dicts, or a dict of columns if columnar"""
+    headers = page["headers"]
+    values = [row["values"] for row in page["rows"]]
+    if columnar:
+        columns = zip(*values) if values else [()] * len(headers)
+        return {header: list(column) for header, column in zip(headers, columns)}
+    return [dict(zip(headers, row)) for row in values]
+
+
 # TODO: Deprecate once fully using submissionviews
-def evaluation_queue_query(syn, uri, limit=20, offset=0):
+def evaluation_queue_query(
+    syn, uri, limit=None, offset=0, max_workers=QUERY_WORKERS, columnar=False
+):
     """
     This is to query the evaluation queue service.
-    The limit parameter is set at 20 by default.
-    Using a larger limit results in fewer calls
+    The first page tells how many results the query has, and the rest of
+    the pages are then fetched max_workers at a time.  By default, pages
+    are sized so that each worker fetches about one, up to
+    MAX_QUERY_PAGE_SIZE rows.  Using a larger limit results in fewer calls
     to the service, but if responses are large enough to be a
     burden on the service they may be truncated.
 
     Args:
         syn:     A Synapse object
         uri:     A URI for evaluation queues (select * from evaluation_12345)
-        limit:   How many records should be returned per request
+        limit:   How many records should be returned per request.
+                 Default adapts to the number of results.
         offset:  At what record offset from the first should iteration start
+        max_workers: Number of pages fetched at once
+        columnar: Yield a dict of column name to values for each page
+                  instead of a dict for each row
 
     Yields:
         dict: A generator over some paginated results
     """
 
-    prev_num_results = sys.maxsize
-    while prev_num_results > 0:
-        rest_uri = "/evaluation/submission/query?query=" + urllib.parse.quote_plus(
-            "{} limit {} offset {}".format(uri, limit, offset)
+    def results(page):
+        if columnar:
+            return [_page_results(page, columnar=True)] if page["rows"] else []
+        return _page_results(page)
+
+    page = _query_page(syn, uri, limit or QUERY_PAGE_SIZE, offset)
+    total = page.get("totalNumberOfResults")
+    offset += len(page["rows"])
+    yield from results(page)
+    if total is None:
+        # Page one after another until the results run out
+        while page["rows"]:
+            page = _query_page(syn, uri, limit or QUERY_PAGE_SIZE, offset)
+            offset += len(page["rows"])
+            yield from results(page)
+        return
+    if offset >= total:
+        return
+
+    if limit is None:
+        limit = math.ceil((total - offset) / max_workers)
+        limit = min(MAX_QUERY_PAGE_SIZE, max(QUERY_PAGE_SIZE, limit))
+    ranges = (
+        (start, min(start + limit, total)) for start in range(offset, total, limit)
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Pages are yielded in order, with at most max_workers fetched ahead
+        pending = deque(
+            executor.submit(_query_range, syn, uri, start, stop)
+            for start, stop in itertools.islice(ranges, max_workers)
         )
-        page = syn.restGET(rest_uri)
-        # results = page['results'] if 'results' in page else page['children']
-        results = [
-            {page["headers"][index]: value for index, value in enumerate(row["values"])}
-            for row in page["rows"]
-        ]
-        prev_num_results = len(results)
-        for result in results:
-            offset += 1
-            yield result
+        while pending:
+            pages = pending.popleft().result()
+            for start, stop in itertools.islice(ranges, 1):
+                pending.append(executor.submit(_query_range, syn, uri, start, stop))
+            for page in pages:
+                yield from results(page)
 
 
 def _change_annotation_acl(annotations, key, annotation_type, is_private=True):
@@ -256,11 +339,17 @@ def update_all_submissions_annotation_acl(
     """
     status = None if status == "ALL" else status
     bundle = syn.getSubmissionBundles(evaluationid, status=status)
-    for _, status in bundle:
-        new_status = change_submission_annotation_acl(
-            status, annotations, is_private=is_private
-        )
-        syn.store(new_status)
+    with SubmissionStatusBatchWriter(syn, evaluationid) as writer:
+        for _, status in bundle:
+            writer.add(
+                status,
+                merge=lambda fresh: change_submission_annotation_acl(
+                    fresh, annotations, is_private=is_private
+                ),
+            )
+    if writer.failed:
+        failed = ", ".join(status.id for status in writer.failed)
+        raise ValueError(f"Unable to update the annotations of submissions: {failed}")
 
 
 def change_submission_status(syn, submissionid, status="RECEIVED"):
@@ -283,7 +372,13 @@ def change_submission_status(syn, submissionid, status="RECEIVED"):
 
 # TODO: Can possibly deprecate once using submissionview
 def change_all_submission_status(
-    syn, evaluationid, submission_status="SCORED", change_to_status="VALIDATED"
+    syn,
+    evaluationid,
+    submission_status="SCORED",
+    change_to_status="VALIDATED",
+    checkpoint=None,
+    max_workers=1,
+    progress=False,
 ):
     """
     Function to change submission status of all submissions in a queue
@@ -297,11 +392,45 @@ def change_all_submission_status(
                            change. Default is SCORED.
         change_to_status: Submission status to change a submission to.
                           Default is VALIDATED.
+        checkpoint: Path of a file recording the submissions that are
+                    changed, to resume an interrupted change
+        max_workers: Number of batches of statuses stored at once
+        progress: Print a progress bar
+
+    Returns:
+        challengeutils.status_transition.TransitionSummary
     """
-    submission_bundle = syn.getSubmissionBundles(evaluationid, status=submission_status)
-    for _, status in submission_bundle:
-        status.status = change_to_status
-        syn.store(status)
+    return transition_submission_statuses(
+        syn,
+        evaluationid,
+        from_status=submission_status,
+        to_status=change_to_status,
+        checkpoint=checkpoint,
+        max_workers=max_workers,
+        progress=progress,
+    )
+
+
+def _parse_datetime_bound(value):
+    """Parse a YYYY-MM-DD H:M date time bound, e.g. 2019-01-01 1:00
+
+    Returns:
+        datetime or None if there is no bound
+    """
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M")
+
+
+def _in_date_range(date_str, start_datetime, end_datetime):
+    """Check if a Synapse date string is within parsed bounds.  Both bounds
+    are inclusive and either may be None."""
+    if start_datetime is None and end_datetime is None:
+        return True
+    date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S.%fZ")
+    if start_datetime is not None and date_obj < start_datetime:
+        return False
+    return end_datetime is None or date_obj <= end_datetime
 
 
 def _check_date_range(date_str, start_datetime, end_datetime):
@@ -319,16 +448,45 @@ def _check_date_range(date_str, start_datetime, end_datetime):
     Returns:
         boolean
     """
-    result = True
-    if start_datetime is not None or end_datetime is not None:
-        date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S.%fZ")
-        if start_datetime is not None:
-            start_obj = datetime.datetime.strptime(start_datetime, "%Y-%m-%d %H:%M")
-            result = date_obj >= start_obj
-        if end_datetime is not None:
-            end_obj = datetime.datetime.strptime(end_datetime, "%Y-%m-%d %H:%M")
-            result = date_obj <= end_obj
-    return result
+    return _in_date_range(
+        date_str,
+        _parse_datetime_bound(start_datetime),
+        _parse_datetime_bound(end_datetime),
+    )
+
+
+def _get_submissions(syn, evaluationid, status=None, max_workers=QUERY_WORKERS):
+    """Get the submissions of an evaluation queue, without their statuses.
+    The first page tells how many submissions there are, and the rest of
+    the pages are then fetched max_workers at a time.
+
+    Synapse filters the status, but not the creation date: submission
+    views and evaluation queries have no contributors column, so dates
+    are filtered by the caller, see _in_date_range.
+
+    Args:
+        syn: Synapse object
+        evaluationid: evaluation id
+        status: Only get submissions with this status
+        max_workers: Number of pages fetched at once
+
+    Yields:
+        dict: Submission
+    """
+    uri = f"/evaluation/{evaluationid}/submission/all?limit={SUBMISSION_PAGE_SIZE}"
+    if status is not None:
+        uri += f"&status={status}"
+    page = syn.restGET(f"{uri}&offset=0")
+    yield from page["results"]
+    offsets = range(
+        len(page["results"]), page["totalNumberOfResults"], SUBMISSION_PAGE_SIZE
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = executor.map(
+            lambda offset: syn.restGET(f"{uri}&offset={offset}"), offsets
+        )
+        for page in pages:
+            yield from page["results"]
 
 
 def _get_contributors(syn, evaluationid, status, start_datetime, end_datetime):
@@ -341,26 +499,31 @@ def _get_contributors(syn, evaluationid, status, start_datetime, end_datetime):
         evaluationid: evaluation id
         submission_status: Submission status
         start_datetime: start date time in YYYY-MM-DD H:M format,
-                        example: 2019-01-01 23:00
+                        example: 2019-01-01 23:00, or a datetime
         end_datetime: end date time in YYYY-MM-DD H:M format,
-                      example: 2019-01-01 23:59
+                      example: 2019-01-01 23:59, or a datetime
 
     Returns:
         Set of contributors' user ids
     """
-    bundles = syn.getSubmissionBundles(evaluationid, status=status)
+    start_datetime = _parse_datetime_bound(start_datetime)
+    end_datetime = _parse_datetime_bound(end_datetime)
     contributors = set()
-    for sub, _ in bundles:
-        if _check_date_range(sub.createdOn, start_datetime, end_datetime):
-            principalids = set(
-                contributor["principalId"] for contributor in sub.contributors
+    for sub in _get_submissions(syn, evaluationid, status=status):
+        if _in_date_range(sub["createdOn"], start_datetime, end_datetime):
+            contributors.update(
+                contributor["principalId"] for contributor in sub["contributors"]
             )
-            contributors.update(principalids)
     return contributors
 
 
 def get_contributors(
-    syn, evaluationids, status="SCORED", start_datetime=None, end_datetime=None
+    syn,
+    evaluationids,
+    status="SCORED",
+    start_datetime=None,
+    end_datetime=None,
+    max_workers=CONTRIBUTOR_WORKERS,
 ):
     """
     Function to get contributors from a list of evaluation ids
@@ -371,19 +534,29 @@ def get_contributors(
         evaluationids: a list of evaluation ids
         status: Submission status. Default = SCORED
         start_datetime: start date time in YYYY-MM-DD H:M format,
-                        example: 2019-01-01 1:00
+                        example: 2019-01-01 1:00. Submissions created
+                        before it are left out.
         end_datetime: end date time in YYYY-MM-DD H:M format,
-                      example: 2019-01-01 23:59
+                      example: 2019-01-01 23:59. Submissions created
+                      after it are left out. Both bounds are inclusive
+                      and apply together.
+        max_workers: Number of evaluation queues read at once
 
     Returns:
         Set of contributors' user ids
     """
+    start_datetime = _parse_datetime_bound(start_datetime)
+    end_datetime = _parse_datetime_bound(end_datetime)
     all_contributors = set()
-    for evaluationid in evaluationids:
-        contributors = _get_contributors(
-            syn, evaluationid, status, start_datetime, end_datetime
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda evaluationid: _get_contributors(
+                syn, evaluationid, status, start_datetime, end_datetime
+            ),
+            evaluationids,
         )
-        all_contributors = all_contributors.union(contributors)
+        for contributors in results:
+            all_contributors.update(contributors)
     return all_contributors
 
 
@@ -430,24 +603,31 @@ def download_submission(syn, submissionid, download_location=None):
     return result
 
 
-def _get_submitter_name(syn, submitterid):
+def _get_submitter_name(syn, submitterid, identity_cache=None):
     """Get the Synapse team name or the username given a submitterid
 
     Args:
         syn: Synapse object
         submitterid: submitter id
+        identity_cache: IdentityCache to reuse names from. Default is to
+                        look up the name every time.
 
     Returns:
         username or teamname
     """
 
-    try:
-        user = syn.getUserProfile(submitterid)
-        submitter_name = user["userName"]
-    except SynapseHTTPError:
-        team = syn.getTeam(submitterid)
-        submitter_name = team["name"]
-    return submitter_name
+    def fetch_name():
+        try:
+            user = syn.getUserProfile(submitterid)
+            submitter_name = user["userName"]
+        except SynapseHTTPError:
+            team = syn.getTeam(submitterid)
+            submitter_name = team["name"]
+        return submitter_name
+
+    if identity_cache is None:
+        return fetch_name()
+    return identity_cache.lookup(f"submitter:{submitterid}", fetch_name)
 
 
 def delete_submission(syn, submissionid):
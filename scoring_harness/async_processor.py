@@ -0,0 +1,188 @@
+"""
+Processors that drive the submission lifecycle with asyncio, so that
+hundreds of network bound interactions can be in flight from one process
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import logging
+
+from synapseclient.core.utils import id_of
+
+from .base_processor import EvaluationQueueProcessor, _is_downloaded
+from .exceptions import SubmissionTimeout
+from .isolation import IsolatedInteraction, run_isolated
+from .journal import INTERACTED
+from .queue_scorer import EvaluationQueueScorer
+from .queue_validator import EvaluationQueueValidator
+
+logging.basicConfig(format="%(asctime)s %(message)s")
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+DEFAULT_MAX_IN_FLIGHT = 100
+
+
+class AsyncEvaluationQueueProcessor(EvaluationQueueProcessor):
+    """EvaluationQueueProcessor that processes up to max_in_flight
+    submissions at once on an asyncio event loop.  interaction_func and
+    notify have the same contract as in EvaluationQueueProcessor.
+    interaction_func may also be a coroutine function, which runs on the
+    event loop; everything else, including the Synapse calls, runs on a
+    pool of max_in_flight threads.
+
+    Use it in front of a validator or scorer so that existing
+    configurations keep working, e.g.
+    class Validate(AsyncEvaluationQueueProcessor, EvaluationQueueValidator)
+    or subclass AsyncEvaluationQueueValidator.
+
+    Args:
+        max_in_flight: Number of submissions processed at once.
+                       Default is 100.
+        **kwargs: See EvaluationQueueProcessor
+    """
+
+    def __init__(self, syn, evaluation, max_in_flight=DEFAULT_MAX_IN_FLIGHT, **kwargs):
+        super().__init__(syn, evaluation, **kwargs)
+        self.max_in_flight = max_in_flight
+        self._executor = None
+
+    def __call__(self):
+        """
+        Submission pipeline, see EvaluationQueueProcessor
+
+        Returns:
+            int: Number of submissions processed
+        """
+        return asyncio.run(self.run_async())
+
+    async def _in_executor(self, func, *args, **kwargs):
+        """Run a blocking function on the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def run_async(self):
+        """Process every submission in the queue
+
+        Returns:
+            int: Number of submissions processed
+        """
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        end = object()
+        tasks = []
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            self._executor = executor
+            try:
+                with self.processing_run() as submission_bundles:
+                    while True:
+                        # Listing bundles pages through Synapse
+                        bundle = await self._in_executor(next, submission_bundles, end)
+                        if bundle is end:
+                            break
+                        await in_flight.acquire()
+                        tasks.append(
+                            asyncio.create_task(
+                                self._process_bounded(in_flight, *bundle)
+                            )
+                        )
+                    await asyncio.gather(*tasks)
+            finally:
+                self._executor = None
+        return len(tasks)
+
+    async def _process_bounded(self, in_flight, submission, sub_status):
+        """Process a submission and free its place"""
+        try:
+            submission_info = await self.process_submission_async(
+                submission, sub_status
+            )
+            LOGGER.info(
+                f"Interacted with submission: {submission.id} "
+                f"(valid: {submission_info['valid']})"
+            )
+        finally:
+            in_flight.release()
+
+    async def process_submission_async(self, submission, sub_status):
+        """
+        Interact with, store the status of and notify about one submission
+
+        Args:
+            submission: synapse Submission object
+            sub_status: synapse Submission Status
+
+        Returns:
+            dict returned by interact_with_submission
+        """
+        try:
+            submission_info = self._journaled_result(submission)
+            if submission_info is None:
+                submission_info = await self.interact_with_submission_async(submission)
+                await self._in_executor(
+                    self._record, submission.id, INTERACTED, submission_info
+                )
+            return await self._in_executor(
+                self._complete_submission, submission, sub_status, submission_info
+            )
+        finally:
+            self._forget_download(submission)
+            if self.file_cache is not None:
+                self._release(id_of(submission))
+
+    async def interact_with_submission_async(self, submission):
+        """
+        Interact with submission function, see interact_with_submission
+
+        Args:
+            submission: synapse Submission object
+
+        Returns:
+            dict: {'valid': True,
+                   'error': None,
+                   'annotations': {},
+                   'message': 'Success!'}
+        """
+        if not _is_downloaded(submission):
+            submission = await self._in_executor(self._download_submission, submission)
+        try:
+            with self.metrics.time("interact", **self._metric_labels):
+                if asyncio.iscoroutinefunction(self.interaction_func):
+                    interaction_status = await self._await_interaction(submission)
+                elif self.isolate:
+                    interaction_status = await self._in_executor(
+                        run_isolated,
+                        IsolatedInteraction(self),
+                        args=(submission,),
+                        kwargs=self.kwargs,
+                        timeout=self.timeout,
+                        memory_limit=self.memory_limit,
+                    )
+                else:
+                    interaction_status = await self._in_executor(
+                        self.interaction_func, submission, **self.kwargs
+                    )
+            submission_info = self._interaction_info(interaction_status)
+        except Exception as ex1:
+            submission_info = self._error_info(ex1)
+        return submission_info
+
+    async def _await_interaction(self, submission):
+        """Await a coroutine interaction_func, cancelling it after timeout"""
+        try:
+            return await asyncio.wait_for(
+                self.interaction_func(submission, **self.kwargs), self.timeout
+            )
+        except asyncio.TimeoutError:
+            raise SubmissionTimeout(f"Timed out after {self.timeout} seconds")
+
+
+class AsyncEvaluationQueueValidator(
+    AsyncEvaluationQueueProcessor, EvaluationQueueValidator
+):
+    """EvaluationQueueValidator that processes submissions with asyncio"""
+
+
+class AsyncEvaluationQueueScorer(AsyncEvaluationQueueProcessor, EvaluationQueueScorer):
+    """EvaluationQueueScorer that processes submissions with asyncio"""
@@ -1,8 +1,28 @@
 """This is the baseclass for what happens to a submission"""
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import functools
 import logging
 import os
+import threading
+
+from synapseclient.core.utils import id_of
+
+from challengeutils.identity_cache import (
+    IdentityCache,
+    get_team_name,
+    get_user_name,
+)
+from challengeutils.status_batch import MAX_BATCH_SIZE, SubmissionStatusBatchWriter
+from challengeutils.status_update import update_submission_status_with_retry
 from challengeutils.utils import update_single_submission_status
+from .isolation import IsolatedInteraction, run_isolated
+from .journal import INTERACTED, NOTIFIED, STORED
+from . import metrics as harness_metrics
+from .discovery import DEFAULT_SWEEP_INTERVAL, SubmissionDiscovery
+from .scheduler import fair_order
 
 logging.basicConfig(format="%(asctime)s %(message)s")
 LOGGER = logging.getLogger(__name__)
@@ -22,20 +42,32 @@ def _remove_cached_submission(submission_file):
         pass
 
 
+def _is_downloaded(submission):
+    """Submissions returned by getSubmissionBundles don't contain the
+    entity or the file path, only submissions from getSubmission do"""
+    return "entity" in submission
+
+
 def get_admin(syn, admin):
     """Set admin user id to be person running the evaluation queue helper"""
     admin = admin if admin is not None else [syn.getUserProfile()["ownerId"]]
     return admin
 
 
-def _get_submission_submitter(syn, submission):
+def _submitter_key(bundle):
+    """Team or user that made the submission of a bundle"""
+    submission, _ = bundle
+    return submission.get("teamId") or submission.get("userId")
+
+
+def _get_submission_submitter(syn, submission, identity_cache=None):
     """Get submitter id and name from a submission object"""
     submitterid = submission.get("teamId")
     if submitterid is not None:
-        submitter_name = syn.getTeam(submitterid)["name"]
+        submitter_name = get_team_name(syn, submitterid, cache=identity_cache)
     else:
         submitterid = submission.userId
-        submitter_name = syn.getUserProfile(submitterid)["userName"]
+        submitter_name = get_user_name(syn, submitterid, cache=identity_cache)
     return {"submitterid": submitterid, "submitter_name": submitter_name}
 
 
@@ -49,6 +81,17 @@ class EvaluationQueueProcessor(metaclass=ABCMeta):
             running the processor.
         dry_run: Do not update Synapse. Default is False.
         remove_cache: Removes submission file from cache. Default is False.
+            Use file_cache to bound the size of the cache instead.
+        max_workers: Number of submissions processed at once. Default is 1.
+        prefetch: Number of submissions downloaded ahead of the submission
+            being processed. Default is 0.
+        status_batch_size: Number of submission statuses stored per
+            request. Default is None, one request per status.
+        identity_cache: IdentityCache of submitter names.
+        journal: ProcessingJournal of the submissions processed.
+        metrics: HarnessMetrics of the time spent in each stage.
+        isolate: Run interaction_func in a child process with a timeout
+            and memory limit. Default is False.
     """
 
     # Status of submissions to process
@@ -65,6 +108,21 @@ class EvaluationQueueProcessor(metaclass=ABCMeta):
         remove_cache=False,
         send_messages=False,
         notifications=True,
+        max_workers=1,
+        prefetch=0,
+        status_batch_size=None,
+        identity_cache=None,
+        outbox=None,
+        isolate=False,
+        timeout=None,
+        memory_limit=None,
+        journal=None,
+        metrics=None,
+        watermarks=None,
+        submission_view=None,
+        sweep_interval=DEFAULT_SWEEP_INTERVAL,
+        submitter_fairness=False,
+        file_cache=None,
         **kwargs,
     ):
         """Init EvaluationQueueProcessor
@@ -81,6 +139,63 @@ class EvaluationQueueProcessor(metaclass=ABCMeta):
                            Default is False
             notifications: Send messages to admins
                            Default is True
+            max_workers: Number of submissions to interact with, store
+                         and notify at once.  interaction_func must be
+                         thread-safe if this is greater than 1.
+                         Default is 1.
+            prefetch: Number of submissions to download in the background
+                      while the current submission is processed.
+                      Default is 0.
+            status_batch_size: Buffer this many submission statuses and
+                               store them with the statusBatch endpoint.
+                               Submitters are notified once the status
+                               of their submission is stored.
+                               Default is None, one request per status.
+            identity_cache: IdentityCache of submitter names, which can be
+                            shared by several processors.  Default is a
+                            new in-memory cache.
+            outbox: MessageOutbox that queues messages to be sent in the
+                    background.  Default is None, messages are sent
+                    before the next submission is processed.
+            isolate: Run interaction_func in a child process, so that
+                     submissions are processed on several cores when
+                     max_workers is greater than 1.  The processor
+                     class must be importable or defined in a
+                     configuration loaded by runqueue.py, and kwargs
+                     picklable.  Default is False.
+            timeout: Seconds interaction_func may run for when isolated
+                     before the submission is marked INVALID.
+                     Default is no limit.
+            memory_limit: Bytes of memory interaction_func may use when
+                          isolated before the submission is marked
+                          INVALID.  Default is no limit.
+            journal: ProcessingJournal to record the progress of each
+                     submission in, so that results and notifications
+                     are picked up after a crash.  Default is None.
+            metrics: HarnessMetrics to record the time spent in each stage
+                     and counts of the processed submissions in, which can
+                     be shared by several processors.  Default is new
+                     metrics.
+            watermarks: WatermarkStore of the latest submission seen in
+                        the queue.  Only submissions modified since are
+                        asked for, with a full sweep every sweep_interval.
+                        Default is None, list every bundle on every run.
+            submission_view: Submission view of the queue to find new
+                             submissions with.  Default is the evaluation
+                             query service.  Requires watermarks.
+            sweep_interval: timedelta between full sweeps of the queue
+                            when using watermarks.  Default is one hour.
+            submitter_fairness: Take turns between submitters, so that a
+                                team with many submissions in the queue
+                                doesn't hold up everyone else.
+                                Default is False, process submissions in
+                                the order they are listed.
+            file_cache: SubmissionFileCache to download submissions to,
+                        which can be shared by the validator and scorer of
+                        a queue so that files are downloaded once.
+                        Submissions are pinned in the cache while they are
+                        processed.  Default is None, download to the
+                        Synapse cache.
         """
         self.syn = syn
         self.evaluation = syn.getEvaluation(evaluation)
@@ -89,7 +204,55 @@ class EvaluationQueueProcessor(metaclass=ABCMeta):
         self.remove_cache = remove_cache
         self.send_messages = send_messages
         self.notifications = notifications
+        self.max_workers = max_workers
+        self.prefetch = prefetch
+        self.status_batch_size = status_batch_size
+        self.identity_cache = (
+            identity_cache if identity_cache is not None else IdentityCache()
+        )
+        self.outbox = outbox
+        self.isolate = isolate
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.journal = journal
+        # Validators and scorers of the same queue journal separately
+        self._journal_scope = f"{self.evaluation.id}:{type(self).__name__}"
+        self.metrics = (
+            metrics if metrics is not None else harness_metrics.HarnessMetrics()
+        )
+        self.submitter_fairness = submitter_fairness
+        self.file_cache = file_cache
+        # Submissions this processor pinned in the file cache
+        self._pinned = set()
+        self._pinned_lock = threading.Lock()
+        # Submission id to the path of the file downloaded for it, to
+        # remove once it was processed
+        self._downloaded_paths = {}
+        self._downloaded_lock = threading.Lock()
+        self._found = 0
+        self.discovery = None
+        if watermarks is not None:
+            self.discovery = SubmissionDiscovery(
+                syn,
+                self.evaluation,
+                self._status,
+                watermarks,
+                submission_view=submission_view,
+                sweep_interval=sweep_interval,
+            )
+        self._metric_labels = {
+            "queue": self.evaluation.id,
+            "processor": type(self).__name__,
+        }
         self.kwargs = kwargs
+        self._status_writer = None
+        # Notifications waiting for their submission status to be stored
+        self._pending_notifications = {}
+        self._pending_lock = threading.Lock()
+        # Statuses stored by the batch writer whose submitters weren't
+        # notified yet
+        self._flushed_statuses = []
+        self._flush_lock = threading.Lock()
 
     def __call__(self):
         """
@@ -98,30 +261,362 @@ class EvaluationQueueProcessor(metaclass=ABCMeta):
         - Interact with the submission
         - Store the submission status
         - Notify submitter or admin about submission status
+
+        Returns:
+            int: Number of submissions processed
+        """
+        with self.processing_run() as submission_bundles:
+            if self.max_workers > 1:
+                processed = self._process_concurrently(submission_bundles)
+            else:
+                processed = 0
+                for submission, sub_status in submission_bundles:
+                    LOGGER.info(f"Interacting with submission: {submission.id}")
+                    self.process_submission(submission, sub_status)
+                    processed += 1
+        return processed
+
+    @contextmanager
+    def processing_run(self):
+        """Set up a run over the submissions in the queue.  Statuses are
+        flushed when the run ends, and the watermark only moves if every
+        submission was processed.  Used by __call__ and by schedulers that
+        interleave the submissions of several queues.
+
+        Yields:
+            Iterator of (Submission, SubmissionStatus) to pass to
+            process_submission
         """
         LOGGER.info("-" * 20)
         LOGGER.info(f"Evaluating {self.evaluation.name} " f"({self.evaluation.id})")
-        submission_bundles = self.syn.getSubmissionBundles(
-            self.evaluation, status=self._status
+        if self.journal is not None and not self.dry_run:
+            self._resend_notifications()
+        self._found = 0
+        submission_bundles = self._count_found(
+            self.metrics.timed_iter(
+                self._get_submission_bundles(),
+                "get_bundles",
+                **self._metric_labels,
+            )
+        )
+        if self.submitter_fairness:
+            submission_bundles = fair_order(submission_bundles, _submitter_key)
+        if self.prefetch > 0:
+            submission_bundles = self._prefetch_submissions(submission_bundles)
+        if self.status_batch_size and not self.dry_run:
+            self._status_writer = SubmissionStatusBatchWriter(
+                self.syn,
+                self.evaluation,
+                batch_size=min(self.status_batch_size, MAX_BATCH_SIZE),
+                buffer_size=self.status_batch_size,
+                on_flush=self._notify_stored,
+            )
+        try:
+            yield submission_bundles
+        finally:
+            if self._status_writer is not None:
+                if self._status_writer.pending:
+                    with self.metrics.time("store", **self._metric_labels):
+                        self._status_writer.flush()
+                self._status_writer = None
+                self._notify_flushed()
+                for submissionid in self._pending_notifications:
+                    LOGGER.error(
+                        f"Status of submission {submissionid} wasn't stored, "
+                        "not sending notifications"
+                    )
+                self._pending_notifications = {}
+
+        if self.discovery is not None and not self.dry_run:
+            # Every submission found was processed
+            self.discovery.commit()
+        self.metrics.set_gauge(
+            harness_metrics.QUEUE_DEPTH, self._found, **self._metric_labels
+        )
+        LOGGER.info("-" * 20)
+
+    def _count_found(self, submission_bundles):
+        """Count the submissions found in the queue"""
+        for bundle in submission_bundles:
+            self._found += 1
+            yield bundle
+
+    def _get_submission_bundles(self):
+        """Get the bundles of the submissions to process
+
+        Returns:
+            Iterable of (Submission, SubmissionStatus)
+        """
+        if self.discovery is not None:
+            return self.discovery.bundles()
+        return self.syn.getSubmissionBundles(self.evaluation, status=self._status)
+
+    def _notify_stored(self, statuses):
+        """Queue the notifications of submissions whose status was stored
+        by the batch writer.  They are sent by _notify_flushed, so that
+        notifying isn't timed as part of storing.
+
+        Args:
+            statuses: List of stored Synapse Submission Statuses
+        """
+        with self._pending_lock:
+            self._flushed_statuses.extend(statuses)
+
+    def _notify_flushed(self):
+        """Send the notifications of submissions whose status was stored
+        by the batch writer"""
+        with self._pending_lock:
+            statuses, self._flushed_statuses = self._flushed_statuses, []
+            pending = [
+                (status, self._pending_notifications.pop(status.id, None))
+                for status in statuses
+            ]
+        for status, notification in pending:
+            if notification is not None:
+                self._record(status.id, STORED)
+                self._notify_and_record(*notification)
+
+    def _notify_and_record(self, submission, submission_info):
+        """Notify about a submission and journal that it was notified.
+        Messages queued in an in-memory outbox are lost on a crash, so
+        the submission is only journaled as notified once they are sent.
+        """
+        if self.journal is None or self.outbox is None or self.outbox.durable:
+            self._timed_notify(submission, submission_info)
+            self._record(submission.id, NOTIFIED)
+            return
+        with self.outbox.capture() as messageids:
+            self._timed_notify(submission, submission_info)
+        self.outbox.when_sent(
+            messageids, functools.partial(self._record, submission.id, NOTIFIED)
+        )
+
+    def _timed_notify(self, submission, submission_info):
+        """Notify submitter or admin and record how long it took"""
+        with self.metrics.time("notify", **self._metric_labels):
+            self.notify(submission, submission_info)
+
+    def _record(self, submissionid, stage, submission_info=None):
+        """Record the progress of a submission in the journal"""
+        if self.journal is not None and not self.dry_run:
+            self.journal.record(
+                self._journal_scope, submissionid, stage, submission_info
+            )
+
+    def _resend_notifications(self):
+        """Send the notifications that weren't sent before the last run
+        stopped"""
+        for submissionid in self.journal.unacknowledged(self._journal_scope):
+            _, submission_info = self.journal.get(self._journal_scope, submissionid)
+            LOGGER.info(f"Resending notifications of submission {submissionid}")
+            try:
+                submission = self.syn.getSubmission(submissionid, downloadFile=False)
+                self._notify_and_record(submission, submission_info)
+            except Exception as ex:
+                LOGGER.error(f"Unable to notify about submission {submissionid}: {ex}")
+
+    def _download_submission(self, submission):
+        """Get the submission with its entity and downloaded file
+
+        Args:
+            submission: synapse Submission object or id
+
+        Returns:
+            synapse Submission object
+        """
+        submissionid = id_of(submission)
+        submission = self._fetch_submission(submission)
+        with self._downloaded_lock:
+            self._downloaded_paths[submissionid] = (
+                submission.get("filePath") if isinstance(submission, dict) else None
+            )
+        return submission
+
+    def _fetch_submission(self, submission):
+        """See _download_submission"""
+        if self.file_cache is None:
+            with self.metrics.time("download", **self._metric_labels):
+                return self.syn.getSubmission(submission)
+        submissionid = id_of(submission)
+        self._pin(submissionid)
+        try:
+            with self.metrics.time("download", **self._metric_labels):
+                # Already downloaded files are reused by the Synapse client
+                submission = self.syn.getSubmission(
+                    submission,
+                    downloadLocation=self.file_cache.download_location(submissionid),
+                )
+        except Exception:
+            self._release(submissionid)
+            raise
+        self.file_cache.record(submissionid)
+        return submission
+
+    def _forget_download(self, submission):
+        """Stop tracking the file downloaded for a submission
+
+        Returns:
+            Path of the downloaded file, None if it wasn't downloaded
+        """
+        with self._downloaded_lock:
+            return self._downloaded_paths.pop(id_of(submission), None)
+
+    def _pin(self, submissionid):
+        """Pin a submission in the file cache while it is processed"""
+        with self._pinned_lock:
+            if submissionid in self._pinned:
+                return
+            self._pinned.add(submissionid)
+        self.file_cache.pin(submissionid)
+
+    def _release(self, submissionid):
+        """Release a submission this processor pinned in the file cache"""
+        with self._pinned_lock:
+            if submissionid not in self._pinned:
+                return
+            self._pinned.discard(submissionid)
+        self.file_cache.release(submissionid)
+
+    def _prefetch_submissions(self, submission_bundles):
+        """Download the next prefetch submissions in the background so
+        that network time overlaps with processing.
+
+        Args:
+            submission_bundles: Iterable of (Submission, SubmissionStatus)
+
+        Yields:
+            (downloaded Submission, SubmissionStatus)
+        """
+        with ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+            pending = deque()
+            for submission, sub_status in submission_bundles:
+                pending.append(
+                    (executor.submit(self._download_submission, submission), sub_status)
+                )
+                if len(pending) > self.prefetch:
+                    future, status = pending.popleft()
+                    yield future.result(), status
+            while pending:
+                future, status = pending.popleft()
+                yield future.result(), status
+
+    def _process_concurrently(self, submission_bundles):
+        """Process submissions on a pool of max_workers threads.  Results
+        are logged in the order the submissions were returned by Synapse.
+
+        Args:
+            submission_bundles: Iterable of (Submission, SubmissionStatus)
+
+        Returns:
+            int: Number of submissions processed
+        """
+        processed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Only submit a few submissions more than there are workers, so
+            # that the backlog isn't held in memory and prefetching stays
+            # ahead of processing by at most prefetch submissions
+            pending = deque()
+            for submission, sub_status in submission_bundles:
+                pending.append(
+                    (
+                        submission,
+                        executor.submit(
+                            self.process_submission, submission, sub_status
+                        ),
+                    )
+                )
+                if len(pending) >= self.max_workers:
+                    self._log_processed(*pending.popleft())
+                    processed += 1
+            while pending:
+                self._log_processed(*pending.popleft())
+                processed += 1
+        return processed
+
+    @staticmethod
+    def _log_processed(submission, future):
+        """Wait for a submission processed by _process_concurrently"""
+        submission_info = future.result()
+        LOGGER.info(
+            f"Interacted with submission: {submission.id} "
+            f"(valid: {submission_info['valid']})"
         )
-        for submission, sub_status in submission_bundles:
-            LOGGER.info(f"Interacting with submission: {submission.id}")
-            # refetch the submission so that we get the file path
-            # to be later replaced by a "downloadFiles" flag on
-            # getSubmissionBundles
+
+    def process_submission(self, submission, sub_status):
+        """
+        Interact with, store the status of and notify about one submission
+
+        Args:
+            submission: synapse Submission object
+            sub_status: synapse Submission Status
+
+        Returns:
+            dict returned by interact_with_submission
+        """
+        try:
+            return self._process_submission(submission, sub_status)
+        finally:
+            self._forget_download(submission)
+            if self.file_cache is not None:
+                self._release(id_of(submission))
+
+    def _process_submission(self, submission, sub_status):
+        """See process_submission"""
+        submission_info = self._journaled_result(submission)
+        if submission_info is None:
             submission_info = self.interact_with_submission(submission)
+            self._record(submission.id, INTERACTED, submission_info)
+        return self._complete_submission(submission, sub_status, submission_info)
 
-            self.store_submission_status(sub_status, submission_info)
+    def _journaled_result(self, submission):
+        """Get the result of a submission whose status wasn't stored
+        before the last run stopped
 
-            # Remove submission file if cache clearing is requested.
-            if self.remove_cache:
-                _remove_cached_submission(submission.filePath)
+        Returns:
+            dict returned by interact_with_submission or None
+        """
+        if self.journal is None or self.dry_run:
+            return None
+        journaled = self.journal.get(self._journal_scope, submission.id)
+        if journaled is None or journaled[1] is None:
+            return None
+        LOGGER.info(f"Reusing journaled result of submission {submission.id}")
+        return journaled[1]
 
-            # Notify submitter
-            if not self.dry_run:
-                self.notify(submission, submission_info)
+    def _complete_submission(self, submission, sub_status, submission_info):
+        """Store the status of and notify about a submission that was
+        interacted with
 
-        LOGGER.info("-" * 20)
+        Returns:
+            submission_info
+        """
+        self.metrics.inc(harness_metrics.PROCESSED, **self._metric_labels)
+        if not submission_info["valid"]:
+            self.metrics.inc(harness_metrics.INVALID, **self._metric_labels)
+
+        batched = self._status_writer is not None
+        if batched:
+            # Notify once the batch writer has stored the status
+            with self._pending_lock:
+                self._pending_notifications[sub_status.id] = (
+                    submission,
+                    submission_info,
+                )
+        self.store_submission_status(sub_status, submission_info)
+
+        # Remove submission file if cache clearing is requested.
+        if self.remove_cache:
+            # Submissions that weren't prefetched were downloaded by
+            # interact_with_submission
+            _remove_cached_submission(
+                self._forget_download(submission) or submission.get("filePath")
+            )
+
+        # Notify submitter
+        if not self.dry_run and not batched:
+            self._record(submission.id, STORED)
+            self._notify_and_record(submission, submission_info)
+        return submission_info
 
     @abstractmethod
     def interaction_func(self, submission, **kwargs):
@@ -133,7 +628,8 @@ class EvaluationQueueProcessor(metaclass=ABCMeta):
         Interact with submission function
 
         Args:
-            submission: synapse Submission object
+            submission: synapse Submission object.  It is downloaded
+                        unless it already was (see prefetch).
 
         Returns:
             dict: {'valid': True,
@@ -141,34 +637,66 @@ class EvaluationQueueProcessor(metaclass=ABCMeta):
                    'annotations': {},
                    'message': 'Success!'}
         """
-        # raise NotImplementedError
-        submission = self.syn.getSubmission(submission)
+        # getSubmissionBundles doesn't return the file path, so fetch the
+        # submission if it wasn't already prefetched
+        if not _is_downloaded(submission):
+            submission = self._download_submission(submission)
         try:
-            interaction_status = self.interaction_func(submission, **self.kwargs)
-            is_valid = interaction_status["valid"]
-            annotations = interaction_status["annotations"]
-            validation_error = None
-            validation_message = interaction_status["message"]
+            with self.metrics.time("interact", **self._metric_labels):
+                if self.isolate:
+                    interaction_status = run_isolated(
+                        IsolatedInteraction(self),
+                        args=(submission,),
+                        kwargs=self.kwargs,
+                        timeout=self.timeout,
+                        memory_limit=self.memory_limit,
+                    )
+                else:
+                    interaction_status = self.interaction_func(
+                        submission, **self.kwargs
+                    )
+            submission_info = self._interaction_info(interaction_status)
         except Exception as ex1:
-            LOGGER.error(
-                "Exception during validation: " f"{type(ex1)} {ex1} {str(ex1)}"
-            )
             # ex1 only happens in this scope in python3,
             # so must store validation_error as a variable
-            is_valid = False
-            # TODO: allow for annotations to be added even if error
-            annotations = {}
-            validation_error = ex1
-            validation_message = str(ex1)
-
-        submission_info = {
-            "valid": is_valid,
-            "error": validation_error,
-            "annotations": annotations,
-            "message": validation_message,
-        }
+            submission_info = self._error_info(ex1)
         return submission_info
 
+    def _interaction_info(self, interaction_status):
+        """Submission info of an interaction that finished
+
+        Args:
+            interaction_status: dict returned by interaction_func
+
+        Returns:
+            dict: see interact_with_submission
+        """
+        return {
+            "valid": interaction_status["valid"],
+            "error": None,
+            "annotations": interaction_status["annotations"],
+            "message": interaction_status["message"],
+        }
+
+    def _error_info(self, error):
+        """Submission info of an interaction that raised an exception
+
+        Args:
+            error: Exception raised by interaction_func
+
+        Returns:
+            dict: see interact_with_submission
+        """
+        LOGGER.error(f"Exception during validation: {type(error)} {error} {str(error)}")
+        self.metrics.inc(harness_metrics.ERRORS, **self._metric_labels)
+        # TODO: allow for annotations to be added even if error
+        return {
+            "valid": False,
+            "error": error,
+            "annotations": {},
+            "message": str(error),
+        }
+
     def store_submission_status(self, sub_status, submission_info):
         """Store submission status
 
@@ -177,16 +705,43 @@ class EvaluationQueueProcessor(metaclass=ABCMeta):
             submission_info: dict returned by interact_with_submission
         """
         annotations = submission_info["annotations"]
-        sub_status = update_single_submission_status(
-            sub_status, annotations, is_private=False
-        )
         is_valid = submission_info["valid"]
-        sub_status.status = self._success_status if is_valid else "INVALID"
+        new_status = self._success_status if is_valid else "INVALID"
+
+        def merge(status):
+            status = update_single_submission_status(
+                status, annotations, is_private=False
+            )
+            status.status = new_status
+            return status
+
+        def on_conflict(status):
+            self.metrics.inc(harness_metrics.STATUS_CONFLICTS, **self._metric_labels)
 
-        if not self.dry_run:
-            sub_status = self.syn.store(sub_status)
+        if self.dry_run:
+            LOGGER.debug(merge(sub_status))
+        elif self._status_writer is not None:
+            self._add_to_batch(sub_status, merge)
         else:
-            LOGGER.debug(sub_status)
+            with self.metrics.time("store", **self._metric_labels):
+                # Annotations added by others since the submission
+                # was listed, e.g. by the workflow orchestrator, are
+                # kept instead of failing the store
+                update_submission_status_with_retry(
+                    self.syn, sub_status, merge, on_conflict=on_conflict
+                )
+
+    def _add_to_batch(self, status, merge):
+        """Buffer a status in the batch writer.  Only adding the status that
+        fills the buffer is timed, as it stores the batch."""
+        writer = self._status_writer
+        with self._flush_lock:
+            if writer.pending + 1 >= writer.buffer_size:
+                with self.metrics.time("store", **self._metric_labels):
+                    writer.add(status, merge=merge)
+            else:
+                writer.add(status, merge=merge)
+        self._notify_flushed()
 
     @abstractmethod
     def notify(self, submission, submission_info):
@@ -0,0 +1,133 @@
+"""Keep polling evaluation queues with one long running process"""
+import logging
+import signal
+import threading
+import time
+
+logging.basicConfig(format="%(asctime)s %(message)s")
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+DEFAULT_MIN_INTERVAL = 5
+DEFAULT_MAX_INTERVAL = 300
+
+
+class AdaptiveInterval:
+    """Poll interval that is short while submissions are arriving and
+    backs off exponentially while a queue is idle.
+
+    Args:
+        min_interval: Seconds to wait after submissions were processed
+        max_interval: Longest wait in seconds for an idle queue
+        backoff: Factor the interval grows by after each idle poll
+    """
+
+    def __init__(
+        self,
+        min_interval=DEFAULT_MIN_INTERVAL,
+        max_interval=DEFAULT_MAX_INTERVAL,
+        backoff=2,
+    ):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("Must have 0 < min_interval <= max_interval")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+
+    def next(self, active):
+        """Get the number of seconds to wait before the next poll
+
+        Args:
+            active: Submissions were processed during the last poll
+
+        Returns:
+            float: seconds
+        """
+        if active:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+
+class QueueDaemon:
+    """Runs the processors of each evaluation queue whenever the queue is
+    due, until stop is called or SIGTERM / SIGINT is received.  Every queue
+    has its own AdaptiveInterval.
+
+    Args:
+        queue_processors: dict of evaluation id to a list of processors
+                          (callables returning the number of submissions
+                          they processed) run in order every poll
+        min_interval: See AdaptiveInterval
+        max_interval: See AdaptiveInterval
+        on_poll: Called after every poll, e.g. to refresh locks
+    """
+
+    def __init__(
+        self,
+        queue_processors,
+        min_interval=DEFAULT_MIN_INTERVAL,
+        max_interval=DEFAULT_MAX_INTERVAL,
+        on_poll=None,
+    ):
+        self.queue_processors = queue_processors
+        self.intervals = {
+            queueid: AdaptiveInterval(min_interval, max_interval)
+            for queueid in queue_processors
+        }
+        self.on_poll = on_poll
+        self._stop = threading.Event()
+
+    def install_signal_handlers(self):
+        """Stop polling on SIGTERM and SIGINT"""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        LOGGER.info(f"Received signal {signum}, shutting down")
+        self.stop()
+
+    def stop(self):
+        """Finish the poll in progress and stop"""
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        """The daemon was asked to stop"""
+        return self._stop.is_set()
+
+    def poll(self, queueid):
+        """Run all processors of a queue once
+
+        Args:
+            queueid: Evaluation id
+
+        Returns:
+            int: Number of submissions processed
+        """
+        processed = 0
+        for processor in self.queue_processors[queueid]:
+            if self.stopped:
+                break
+            try:
+                processed += processor() or 0
+            except Exception as ex:
+                LOGGER.error(f"Error processing queue {queueid}: {ex}")
+        return processed
+
+    def run(self):
+        """Poll each queue when it is due until stopped"""
+        next_poll = {queueid: time.monotonic() for queueid in self.queue_processors}
+        while not self.stopped and next_poll:
+            queueid = min(next_poll, key=next_poll.get)
+            wait = next_poll[queueid] - time.monotonic()
+            if wait > 0 and self._stop.wait(wait):
+                break
+            processed = self.poll(queueid)
+            interval = self.intervals[queueid].next(processed > 0)
+            next_poll[queueid] = time.monotonic() + interval
+            LOGGER.debug(f"Polling queue {queueid} again in {interval} seconds")
+            if self.on_poll is not None:
+                self.on_poll()
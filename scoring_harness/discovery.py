@@ -0,0 +1,198 @@
+"""
+Find new submissions of an evaluation queue without listing every bundle
+on every poll.  Each queue keeps a watermark of the latest status
+modification it has seen and only asks for submissions modified after it,
+with a periodic full sweep to pick up anything the watermark missed.
+"""
+from datetime import timedelta
+import json
+import logging
+import os
+import threading
+import time
+
+import synapseclient
+from synapseclient.core.utils import id_of, iso_to_datetime, to_unix_epoch_time
+
+from challengeutils.utils import evaluation_queue_query
+
+logging.basicConfig(format="%(asctime)s %(message)s")
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+DEFAULT_SWEEP_INTERVAL = timedelta(hours=1)
+# Submission views and the evaluation query service are eventually
+# consistent, so look back this far before the watermark
+DEFAULT_OVERLAP = timedelta(minutes=5)
+
+
+def _modified_on(sub_status):
+    """Modification time of a submission status in ms since the epoch"""
+    return to_unix_epoch_time(iso_to_datetime(sub_status.modifiedOn))
+
+
+class WatermarkStore:
+    """JSON file of the watermark and last full sweep of each queue
+
+    Args:
+        path: Path of the JSON file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, scope):
+        """Get the state of a queue
+
+        Args:
+            scope: Evaluation id and status of the queue
+
+        Returns:
+            dict with the watermark (ms) and last_sweep (seconds since
+            the epoch), empty if the queue was never swept
+        """
+        with self._lock:
+            return self._read().get(scope, {})
+
+    def set(self, scope, watermark, last_sweep):
+        """Store the state of a queue
+
+        Args:
+            scope: Evaluation id and status of the queue
+            watermark: Latest status modification seen in ms
+            last_sweep: Time of the last full sweep in seconds
+        """
+        with self._lock:
+            # Reread so that queues processed by other harnesses keep
+            # their state
+            state = self._read()
+            state[scope] = {"watermark": watermark, "last_sweep": last_sweep}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as state_file:
+                json.dump(state, state_file, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+class SubmissionDiscovery:
+    """Get the bundles of an evaluation queue that are in a status,
+    asking only for submissions modified after the watermark.  A full
+    sweep with getSubmissionBundles is done on the first run and every
+    sweep_interval.
+
+    Args:
+        syn: Synapse object
+        evaluation: synapseclient.Evaluation object
+        status: Status of the submissions to get
+        store: WatermarkStore
+        submission_view: Submission view of the queue to query.  Default
+                         is to use the evaluation query service.
+        sweep_interval: Time between full sweeps
+        overlap: Time before the watermark to look back
+    """
+
+    def __init__(
+        self,
+        syn,
+        evaluation,
+        status,
+        store,
+        submission_view=None,
+        sweep_interval=DEFAULT_SWEEP_INTERVAL,
+        overlap=DEFAULT_OVERLAP,
+    ):
+        self.syn = syn
+        self.evaluation = evaluation
+        self.status = status
+        self.store = store
+        self.submission_view = submission_view
+        self.sweep_interval = sweep_interval.total_seconds()
+        self.overlap = int(overlap.total_seconds() * 1000)
+        self.scope = f"{evaluation.id}:{status}"
+        # State to store once the bundles were processed
+        self._pending_state = None
+
+    def _query_modified(self, since):
+        """Get the ids and modification times of the submissions in status
+        that were modified after since
+
+        Args:
+            since: ms since the epoch
+
+        Returns:
+            list of (submission id, modifiedOn in ms)
+        """
+        if self.submission_view is not None:
+            view_query = self.syn.tableQuery(
+                f"select id, modifiedOn from {id_of(self.submission_view)} "
+                f"where evaluationid = {self.evaluation.id} and "
+                f"status = '{self.status}' and modifiedOn > {since}"
+            )
+            view_querydf = view_query.asDataFrame()
+            return [
+                (str(submissionid), int(modified_on))
+                for submissionid, modified_on in zip(
+                    view_querydf["id"], view_querydf["modifiedOn"]
+                )
+            ]
+        query = (
+            f"select objectId, modifiedOn from evaluation_{self.evaluation.id} "
+            f"where status == '{self.status}' and modifiedOn > {since}"
+        )
+        return [
+            (row["objectId"], int(row["modifiedOn"]))
+            for row in evaluation_queue_query(self.syn, query, limit=500)
+        ]
+
+    def _sweep(self, watermark):
+        """Get every bundle in status and the latest modification seen"""
+        LOGGER.info(f"Sweeping {self.evaluation.id} for {self.status} submissions")
+        for submission, sub_status in self.syn.getSubmissionBundles(
+            self.evaluation, status=self.status
+        ):
+            watermark = max(watermark, _modified_on(sub_status))
+            yield submission, sub_status
+        self._pending_state = (watermark, time.time())
+
+    def _incremental(self, watermark, last_sweep):
+        """Get the bundles in status modified after the watermark"""
+        modified = self._query_modified(watermark - self.overlap)
+        for submissionid, modified_on in sorted(modified, key=lambda row: row[1]):
+            # The query results may be stale, the status is authoritative
+            sub_status = self.syn.getSubmissionStatus(submissionid)
+            if sub_status.status != self.status:
+                continue
+            submission = synapseclient.Submission(
+                **self.syn.restGET(f"/evaluation/submission/{submissionid}")
+            )
+            watermark = max(watermark, modified_on)
+            yield submission, sub_status
+        self._pending_state = (watermark, last_sweep)
+
+    def bundles(self):
+        """Get the bundles of the queue in status
+
+        Returns:
+            Generator of (Submission, SubmissionStatus)
+        """
+        state = self.store.get(self.scope)
+        watermark = state.get("watermark", 0)
+        last_sweep = state.get("last_sweep")
+        if last_sweep is None or time.time() - last_sweep >= self.sweep_interval:
+            return self._sweep(watermark)
+        return self._incremental(watermark, last_sweep)
+
+    def commit(self):
+        """Store the watermark once all bundles were processed.  If the
+        harness fails before then, the same submissions are asked for on
+        the next run."""
+        if self._pending_state is not None:
+            self.store.set(self.scope, *self._pending_state)
+            self._pending_state = None
@@ -13,3 +13,15 @@ class InvalidSubmission(Error):
     """Raised when the submission is invalid"""
 
     pass
+
+
+class SubmissionTimeout(InvalidSubmission):
+    """Raised when processing a submission takes longer than allowed"""
+
+    pass
+
+
+class SubmissionMemoryError(InvalidSubmission):
+    """Raised when processing a submission uses more memory than allowed"""
+
+    pass
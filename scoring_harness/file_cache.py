@@ -0,0 +1,237 @@
+"""
+Cache of downloaded submission files with a size budget, shared by the
+processors of a harness so that a scorer reuses the file its validator
+downloaded.  Several harness processes can share one cache directory.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import fcntl
+import logging
+import os
+import shutil
+import socket
+import threading
+import uuid
+
+logging.basicConfig(format="%(asctime)s %(message)s")
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+DEFAULT_MAX_BYTES = 10 * 1024**3
+# Pin markers and lock file of the processes sharing a cache directory
+PINS_DIRECTORY = ".pins"
+LOCK_FILE = ".lock"
+
+
+def _directory_size(path):
+    """Total size in bytes of the files under a directory"""
+    size = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                size += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return size
+
+
+def _is_running(pid):
+    """Check if a process of this host is running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        pass
+    return True
+
+
+def _remove(path):
+    """Remove a file that may already be gone"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SubmissionFileCache:
+    """Each submission is downloaded to its own directory under the cache
+    directory.  When the cache grows over its budget, the directories of
+    the least recently used submissions are removed, except for the
+    submissions that are pinned because they are being processed.  The
+    modification time of each directory records when it was last used,
+    so the cache survives harness restarts.
+
+    Pins are also recorded as marker files under the .pins directory, so
+    that a process sharing the cache directory doesn't evict a submission
+    another process is processing.  Markers of processes on this host that
+    exited are ignored.  Pinning and evicting take a lock file, so that a
+    submission can't be pinned while another process evicts it.
+
+    Args:
+        directory: Directory to download submissions to
+        max_bytes: Size budget of the cache. Default is 10 GiB.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Submission id to size in bytes, least recently used first
+        self._sizes = OrderedDict()
+        self._pins = {}
+        # Name of the pin markers of this cache
+        self._marker_name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(directory, PINS_DIRECTORY), exist_ok=True)
+        entries = [
+            entry
+            for entry in os.scandir(directory)
+            if entry.is_dir() and not entry.name.startswith(".")
+        ]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self._sizes[entry.name] = _directory_size(entry.path)
+
+    @property
+    def size(self):
+        """Bytes used by the cached submissions"""
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def __contains__(self, submissionid):
+        with self._lock:
+            return str(submissionid) in self._sizes
+
+    def download_location(self, submissionid):
+        """Get the directory a submission is downloaded to"""
+        return os.path.join(self.directory, str(submissionid))
+
+    @contextmanager
+    def _directory_lock(self):
+        """Lock the cache directory against the other processes using it"""
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _marker(self, submissionid):
+        """Path of the pin marker of a submission"""
+        return os.path.join(
+            self.directory, PINS_DIRECTORY, submissionid, self._marker_name
+        )
+
+    def _pinned_elsewhere(self, submissionid):
+        """Check if another cache, e.g. of another process, pinned a
+        submission.  Markers of exited processes on this host are removed.
+        """
+        pins_path = os.path.dirname(self._marker(submissionid))
+        try:
+            markers = os.listdir(pins_path)
+        except FileNotFoundError:
+            return False
+        host = socket.gethostname()
+        for marker in markers:
+            if marker == self._marker_name:
+                continue
+            marker_host, pid, _ = marker.rsplit(":", 2)
+            if marker_host == host and not _is_running(int(pid)):
+                LOGGER.info(f"Removing pin of {submissionid} by exited process {pid}")
+                _remove(os.path.join(pins_path, marker))
+                continue
+            return True
+        return False
+
+    def pin(self, submissionid):
+        """Keep a submission in the cache until it is released.  A
+        submission can be pinned several times, e.g. by a validator and a
+        scorer running at once.
+
+        Args:
+            submissionid: Synapse submission id
+        """
+        submissionid = str(submissionid)
+        with self._lock:
+            self._pins[submissionid] = self._pins.get(submissionid, 0) + 1
+            if self._pins[submissionid] == 1:
+                marker = self._marker(submissionid)
+                with self._directory_lock():
+                    os.makedirs(os.path.dirname(marker), exist_ok=True)
+                    open(marker, "w").close()
+
+    def release(self, submissionid):
+        """Unpin a submission and evict submissions if the cache is over
+        its budget
+
+        Args:
+            submissionid: Synapse submission id
+        """
+        submissionid = str(submissionid)
+        with self._lock:
+            pins = self._pins.get(submissionid, 0) - 1
+            if pins > 0:
+                self._pins[submissionid] = pins
+            elif self._pins.pop(submissionid, None) is not None:
+                marker = self._marker(submissionid)
+                with self._directory_lock():
+                    _remove(marker)
+                    try:
+                        os.rmdir(os.path.dirname(marker))
+                    except OSError:
+                        # Other processes pinned it too
+                        pass
+        self.evict()
+
+    def record(self, submissionid):
+        """Record that a submission was downloaded or reused, making it
+        the most recently used
+
+        Args:
+            submissionid: Synapse submission id
+        """
+        submissionid = str(submissionid)
+        path = self.download_location(submissionid)
+        size = _directory_size(path)
+        with self._lock:
+            self._sizes[submissionid] = size
+            self._sizes.move_to_end(submissionid)
+        if os.path.exists(path):
+            os.utime(path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used submissions that aren't pinned
+        until the cache is within its budget
+
+        Returns:
+            list of evicted submission ids
+        """
+        evicted = []
+        with self._lock:
+            total = sum(self._sizes.values())
+            if total <= self.max_bytes:
+                return evicted
+            with self._directory_lock():
+                for submissionid in list(self._sizes):
+                    if total <= self.max_bytes:
+                        break
+                    if submissionid in self._pins or self._pinned_elsewhere(
+                        submissionid
+                    ):
+                        continue
+                    total -= self._sizes.pop(submissionid)
+                    evicted.append(submissionid)
+                # Remove while holding the locks so that an evicted
+                # submission can't be pinned and downloaded again in the
+                # meantime
+                for submissionid in evicted:
+                    shutil.rmtree(
+                        self.download_location(submissionid), ignore_errors=True
+                    )
+        if total > self.max_bytes:
+            LOGGER.warning(
+                f"Submission cache uses {total} bytes, more than its "
+                f"budget of {self.max_bytes}, because of pinned submissions"
+            )
+        return evicted
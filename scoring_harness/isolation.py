@@ -0,0 +1,224 @@
+"""
+Run interaction functions in a child process so that a submission that
+hangs or uses too much memory can't take down the harness
+
+Each submission runs in a new child process, so that submissions don't
+share memory or state and the memory limit applies to one submission.
+The children are forked from a single-threaded fork server that has
+synapseclient imported, rather than from the harness, which runs worker,
+outbox, lock heartbeat and metrics threads.  A child forked from it could
+inherit a lock held by one of those threads, such as a logging or sqlite
+lock, and hang.  Functions and their arguments are pickled, so processors
+are passed as an IsolatedInteraction.
+"""
+import functools
+import importlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import pickle
+import resource
+import sys
+
+import synapseclient
+
+from .exceptions import InvalidSubmission, SubmissionMemoryError, SubmissionTimeout
+
+logging.basicConfig(format="%(asctime)s %(message)s")
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+_CONTEXT = multiprocessing.get_context(_START_METHOD)
+if _START_METHOD == "forkserver":
+    # Children start with the Synapse client already imported
+    _CONTEXT.set_forkserver_preload(["synapseclient", "scoring_harness.isolation"])
+
+
+class _ClassReference:
+    """Picklable reference to a class, including classes of challenge
+    configurations that runqueue.py loads from a file
+
+    Args:
+        cls: Class
+    """
+
+    def __init__(self, cls):
+        self.module = cls.__module__
+        self.qualname = cls.__qualname__
+        self.path = getattr(sys.modules.get(self.module), "__file__", None)
+
+    def _import(self):
+        """Import the module of the class, from its file if it can't be
+        imported by name or the name is of another module"""
+        try:
+            module = importlib.import_module(self.module)
+        except ImportError:
+            module = None
+        if self.path is None or (
+            module is not None
+            and os.path.realpath(getattr(module, "__file__", None) or "")
+            == os.path.realpath(self.path)
+        ):
+            return module
+        spec = importlib.util.spec_from_file_location(self.module, self.path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[self.module] = module
+        spec.loader.exec_module(module)
+        return module
+
+    def resolve(self):
+        """Get the class in this process"""
+        module = sys.modules.get(self.module) or self._import()
+        return functools.reduce(getattr, self.qualname.split("."), module)
+
+
+# Attributes of processors that belong to the harness rather than to the
+# interaction, and aren't copied to the child
+_HARNESS_STATE = frozenset(
+    (
+        "syn",
+        "journal",
+        "outbox",
+        "metrics",
+        "identity_cache",
+        "file_cache",
+        "discovery",
+        "_status_writer",
+        "_pending_notifications",
+        "_flushed_statuses",
+        "_downloaded_paths",
+        "_pinned",
+        "_executor",
+    )
+)
+
+
+def _picklable(name, value):
+    """Check if an attribute of a processor can be copied to a child"""
+    try:
+        pickle.dumps(value)
+    except Exception as ex:
+        LOGGER.debug(f"Not copying {name} to the isolated process: {ex}")
+        return False
+    return True
+
+
+class IsolatedInteraction:
+    """Picklable call of the interaction_func of a processor.  The child
+    process gets a copy of the processor's attributes with its own Synapse
+    client, logged in with the same credentials, and without the state of
+    the harness such as its journal, outbox, metrics and locks.
+
+    Args:
+        processor: EvaluationQueueProcessor
+    """
+
+    def __init__(self, processor):
+        self.processor_class = _ClassReference(type(processor))
+        self.attributes = {
+            name: value
+            for name, value in vars(processor).items()
+            if name not in _HARNESS_STATE and _picklable(name, value)
+        }
+        syn = processor.syn
+        self.endpoints = {
+            "repoEndpoint": syn.repoEndpoint,
+            "authEndpoint": syn.authEndpoint,
+            "fileHandleEndpoint": syn.fileHandleEndpoint,
+            "portalEndpoint": syn.portalEndpoint,
+        }
+        self.cache_root_dir = syn.cache.cache_root_dir
+        self.credentials = syn.credentials
+
+    def __call__(self, submission, **kwargs):
+        processor = object.__new__(self.processor_class.resolve())
+        vars(processor).update(self.attributes)
+        processor.syn = synapseclient.Synapse(
+            skip_checks=True,
+            cache_root_dir=self.cache_root_dir,
+            silent=True,
+            **self.endpoints,
+        )
+        processor.syn.credentials = self.credentials
+        return processor.interaction_func(submission, **kwargs)
+
+
+def _run_child(conn, func, args, kwargs, memory_limit):
+    """Call func in the child process and send back its outcome"""
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    try:
+        outcome = ("result", func(*args, **kwargs))
+    except MemoryError:
+        outcome = ("memory", None)
+    except Exception as ex:
+        outcome = ("error", ex)
+    try:
+        conn.send(outcome)
+    except Exception as ex:
+        # The result or exception can't be pickled
+        conn.send(("error", InvalidSubmission(f"{type(ex).__name__}: {ex}")))
+    finally:
+        conn.close()
+
+
+def run_isolated(func, args=(), kwargs=None, timeout=None, memory_limit=None):
+    """Call a function in a child process with a wall clock and address
+    space limit.  The child is killed if it runs past the timeout.
+
+    Args:
+        func: Function to call. It and its arguments must be picklable,
+              use IsolatedInteraction to call the interaction_func of a
+              processor.
+        args: Positional arguments of func
+        kwargs: Keyword arguments of func
+        timeout: Seconds func may run for. Default is no limit.
+        memory_limit: Bytes of address space the child may use.
+                      Default is no limit.
+
+    Returns:
+        Value returned by func
+
+    Raises:
+        SubmissionTimeout: func ran for longer than timeout
+        SubmissionMemoryError: func ran out of memory
+        InvalidSubmission: The child process died without a result
+        Exception: Any exception raised by func
+    """
+    parent_conn, child_conn = _CONTEXT.Pipe(duplex=False)
+    process = _CONTEXT.Process(
+        target=_run_child,
+        args=(child_conn, func, args, kwargs or {}, memory_limit),
+    )
+    process.start()
+    # Only the child writes to the pipe, so reading from it raises
+    # EOFError as soon as the child exits
+    child_conn.close()
+    try:
+        if not parent_conn.poll(timeout):
+            process.kill()
+            raise SubmissionTimeout(f"Timed out after {timeout} seconds")
+        try:
+            kind, value = parent_conn.recv()
+        except EOFError:
+            process.join()
+            if memory_limit is not None:
+                raise SubmissionMemoryError(
+                    f"Exited with code {process.exitcode}, the memory limit "
+                    f"is {memory_limit} bytes"
+                )
+            raise InvalidSubmission(f"Exited with code {process.exitcode}")
+    finally:
+        parent_conn.close()
+        process.join()
+    if kind == "memory":
+        raise SubmissionMemoryError(
+            f"Ran out of memory, the memory limit is {memory_limit} bytes"
+        )
+    if kind == "error":
+        raise value
+    return value
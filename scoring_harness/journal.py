@@ -0,0 +1,167 @@
+"""
+Write-ahead journal of the work the harness has done on each submission,
+so that a harness that dies part way through can pick up where it left off
+"""
+import builtins
+import json
+import os
+import threading
+import time
+
+from .exceptions import InvalidSubmission
+
+# Stages of a submission in the order they happen
+INTERACTED = "interacted"
+STORED = "stored"
+NOTIFIED = "notified"
+
+
+def _dump_error(error):
+    """Exceptions aren't JSON serializable, keep their type and message"""
+    if error is None:
+        return None
+    return {"type": type(error).__name__, "message": str(error)}
+
+
+def _load_error(error):
+    """Recreate a journaled exception.  Built-in exception types, such as
+    the AssertionError raised by validation, keep their type."""
+    if error is None:
+        return None
+    error_type = getattr(builtins, error["type"], None)
+    if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+        error_type = InvalidSubmission
+    return error_type(error["message"])
+
+
+class ProcessingJournal:
+    """Append-only journal of the stages each submission went through.
+    Every entry is flushed and fsync'd before the harness moves on, and
+    submissions that were completely processed are dropped from the
+    journal when it is opened.
+
+    Args:
+        path: Path of the JSON lines journal file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # (scope, submission id) to (stage, submission_info)
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path) as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The harness died while writing this entry
+                        continue
+                    self._apply(entry)
+        self._compact()
+        self._file = open(path, "a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _apply(self, entry):
+        key = (entry["scope"], entry["submission"])
+        if entry["stage"] == NOTIFIED:
+            self._entries.pop(key, None)
+            return
+        info = entry.get("info")
+        if info is None and key in self._entries:
+            info = self._entries[key][1]
+        self._entries[key] = (entry["stage"], info)
+
+    def _compact(self):
+        """Rewrite the journal with only the unfinished submissions"""
+        compact_path = f"{self.path}.compact"
+        with open(compact_path, "w") as journal_file:
+            for (scope, submissionid), (stage, info) in self._entries.items():
+                journal_file.write(
+                    json.dumps(
+                        {
+                            "scope": scope,
+                            "submission": submissionid,
+                            "stage": stage,
+                            "info": info,
+                        }
+                    )
+                    + "\n"
+                )
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(compact_path, self.path)
+
+    def record(self, scope, submissionid, stage, submission_info=None):
+        """Durably record that a submission reached a stage
+
+        Args:
+            scope: Evaluation queue and processor the stage belongs to
+            submissionid: Synapse submission id
+            stage: INTERACTED, STORED or NOTIFIED
+            submission_info: dict returned by interact_with_submission.
+                             Only needed for INTERACTED.
+        """
+        entry = {
+            "scope": scope,
+            "submission": str(submissionid),
+            "stage": stage,
+            "time": time.time(),
+        }
+        if submission_info is not None:
+            entry["info"] = dict(
+                submission_info, error=_dump_error(submission_info["error"])
+            )
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._apply(entry)
+
+    def get(self, scope, submissionid):
+        """Get the last stage of a submission
+
+        Args:
+            scope: Evaluation queue and processor the stage belongs to
+            submissionid: Synapse submission id
+
+        Returns:
+            (stage, submission_info) or None if the submission isn't
+            journaled
+        """
+        with self._lock:
+            entry = self._entries.get((scope, str(submissionid)))
+        if entry is None:
+            return None
+        stage, info = entry
+        if info is not None:
+            info = dict(info, error=_load_error(info["error"]))
+        return stage, info
+
+    def unacknowledged(self, scope):
+        """Get the submissions whose status was stored but whose
+        notifications weren't sent
+
+        Args:
+            scope: Evaluation queue and processor the stages belong to
+
+        Returns:
+            list of submission ids
+        """
+        with self._lock:
+            return [
+                submissionid
+                for (entry_scope, submissionid), (stage, _) in self._entries.items()
+                if entry_scope == scope and stage == STORED
+            ]
+
+    def close(self):
+        """Close the journal file"""
+        with self._lock:
+            self._file.close()
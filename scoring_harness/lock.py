@@ -5,13 +5,18 @@ Creates and tracks a lock file
 import errno
 
 # import inspect
+import json
 import os
 import shutil
+import socket
 import sys
+import threading
 import time
+import uuid
 from datetime import timedelta
 
 LOCK_DEFAULT_MAX_AGE = timedelta(hours=2)
+LOCK_DEFAULT_LEASE = timedelta(seconds=30)
 
 
 class LockedException(Exception):
@@ -22,15 +27,25 @@ class LockedException(Exception):
     pass
 
 
-def acquire_lock_or_fail(name, max_age=LOCK_DEFAULT_MAX_AGE):
+def acquire_lock_or_fail(
+    name, max_age=LOCK_DEFAULT_MAX_AGE, directory=None, lease=None
+):
     """
     Acquire lock file or determine that lock file exists
 
     Args:
         name: Name of lock file
         max_age: The amount of time the lock file will live
+        directory: Directory of the lock file.  Defaults to the directory
+                   of this module.
+        lease: Use a LeaseLock that is kept alive by a heartbeat and
+               expires this long after the last heartbeat.  max_age is
+               ignored if this is specified.
     """
-    lock = Lock(name, max_age=max_age)
+    if lease is not None:
+        lock = LeaseLock(name, directory=directory, lease=lease)
+    else:
+        lock = Lock(name, directory=directory, max_age=max_age)
     if lock.acquire():
         return lock
     raise LockedException(f"A lock exists named {name} who's age is: {lock.get_age()}")
@@ -94,6 +109,228 @@ class Lock:
                     raise
 
 
+class LeaseLock(Lock):
+    """
+    Lock that is kept alive by a heartbeat from the process holding it.
+    The holder's PID and host are recorded in the lock directory, and the
+    lock is broken as soon as its lease expires without a heartbeat or,
+    on the same host, as soon as the holding process has exited.
+    """
+
+    HOLDER_FILE = "holder.json"
+
+    def __init__(
+        self, name, directory=None, lease=LOCK_DEFAULT_LEASE, heartbeat_interval=None
+    ):
+        super().__init__(name, directory=directory, max_age=lease)
+        self.lease = lease
+        self.heartbeat_interval = (
+            heartbeat_interval if heartbeat_interval is not None else lease / 3
+        )
+        self.holder_path = os.path.join(self.lock_dir_path, LeaseLock.HOLDER_FILE)
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat_thread = None
+        # What this process wrote in the holder file
+        self._holder = None
+        # Set once another process broke and took the lock
+        self.lost = False
+
+    def _lease_state(self, lock_dir_path=None):
+        """Get the holder and time of the last heartbeat of a lock directory
+
+        Args:
+            lock_dir_path: Lock directory. Default is the lock's.
+
+        Returns:
+            (holder dict or None, heartbeat time)
+        """
+        lock_dir_path = lock_dir_path or self.lock_dir_path
+        holder_path = os.path.join(lock_dir_path, LeaseLock.HOLDER_FILE)
+        try:
+            heartbeat = os.path.getmtime(holder_path)
+        except FileNotFoundError:
+            # The holder may not have written its information yet
+            heartbeat = os.path.getmtime(lock_dir_path)
+        try:
+            with open(holder_path) as holder_file:
+                holder = json.load(holder_file)
+        except (FileNotFoundError, ValueError):
+            holder = None
+        return holder, heartbeat
+
+    def get_age(self):
+        """
+        Get amount of time since the last heartbeat of the holder
+        """
+        _, heartbeat = self._lease_state()
+        return timedelta(seconds=time.time() - heartbeat)
+
+    def get_holder(self):
+        """Get the pid and host of the process holding the lock or None"""
+        return self._lease_state()[0]
+
+    def _holder_is_dead(self, state):
+        """Check if the lock expired or the holder on this host exited
+
+        Args:
+            state: (holder, heartbeat) of the lock
+        """
+        holder, heartbeat = state
+        if timedelta(seconds=time.time() - heartbeat) > self.lease:
+            return True
+        if holder is None or holder["host"] != socket.gethostname():
+            return False
+        try:
+            os.kill(holder["pid"], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            # The process exists but belongs to another user
+            pass
+        return False
+
+    def acquire(self, break_old_locks=True):
+        """Try to acquire lock. Return True on success or False otherwise"""
+        try:
+            os.makedirs(self.lock_dir_path)
+        except OSError as err:
+            if err.errno != errno.EEXIST and err.errno != errno.EACCES:
+                raise
+            if not break_old_locks:
+                return False
+            try:
+                stale = self._lease_state()
+            except FileNotFoundError:
+                # The lock was released meanwhile
+                return False
+            if not self._holder_is_dead(stale):
+                return False
+            sys.stderr.write(
+                f"Breaking lock of {stale[0]} whose last heartbeat was "
+                f"{timedelta(seconds=time.time() - stale[1])} ago\n"
+            )
+            if not self._break(stale):
+                return False
+            try:
+                os.makedirs(self.lock_dir_path)
+            except OSError:
+                return False
+        self.held = True
+        self.lost = False
+        self._holder = {
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "acquired": time.time(),
+        }
+        with open(self.holder_path, "w") as holder_file:
+            json.dump(self._holder, holder_file)
+        self._stop_heartbeat.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._heartbeat_thread.start()
+        return True
+
+    def _break(self, stale):
+        """Move a lock that was judged stale out of the way.  Another
+        process may have broken and taken the lock in the meantime, so the
+        lock that was moved is checked to be the stale one, and put back
+        otherwise.
+
+        Args:
+            stale: (holder, heartbeat) of the lock that was judged stale
+
+        Returns:
+            bool: True if the stale lock was removed
+        """
+        broken_path = f"{self.lock_dir_path}.{uuid.uuid4().hex}.broken"
+        try:
+            os.rename(self.lock_dir_path, broken_path)
+        except OSError:
+            # Another process moved it first
+            return False
+        try:
+            moved = self._lease_state(broken_path)
+        except FileNotFoundError:
+            moved = None
+        if moved != stale:
+            sys.stderr.write(f"Lock {self.name} was taken meanwhile, putting it back\n")
+            try:
+                os.rename(broken_path, self.lock_dir_path)
+            except OSError:
+                sys.stderr.write(
+                    f"Unable to put back lock {self.name}, it is at {broken_path}\n"
+                )
+            return False
+        shutil.rmtree(broken_path, ignore_errors=True)
+        return True
+
+    def _is_ours(self, lock_dir_path=None):
+        """Check that a lock directory was written by this lock
+
+        Args:
+            lock_dir_path: Lock directory. Default is the lock's.
+        """
+        try:
+            holder, _ = self._lease_state(lock_dir_path)
+        except FileNotFoundError:
+            return False
+        return holder is not None and all(
+            holder.get(key) == self._holder[key] for key in ("pid", "host", "acquired")
+        )
+
+    def _heartbeat(self):
+        """Refresh the lease until the lock is released or lost"""
+        interval = self.heartbeat_interval.total_seconds()
+        failing_since = None
+        while not self._stop_heartbeat.wait(interval):
+            try:
+                if not self._is_ours() and os.path.exists(self.holder_path):
+                    # Another process broke and took the lock
+                    self.lost = True
+                else:
+                    os.utime(self.holder_path)
+                    failing_since = None
+            except OSError:
+                # The lock is briefly moved while another process checks
+                # that it is stale, see _break
+                failing_since = failing_since or time.time()
+                if time.time() - failing_since > self.lease.total_seconds():
+                    self.lost = True
+            if self.lost:
+                sys.stderr.write(f"Lost lock {self.name}, stopping heartbeat\n")
+                return
+
+    def release(self):
+        """Release lock or do nothing if lock is not held.  A lock that
+        another process broke and took is left in place."""
+        if self._heartbeat_thread is not None:
+            self._stop_heartbeat.set()
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+        if not self.held:
+            return
+        self.held = False
+        if self.lost:
+            return
+        # Move the lock aside before checking it, so that it can't be
+        # taken between the check and the removal
+        released_path = f"{self.lock_dir_path}.{uuid.uuid4().hex}.released"
+        try:
+            os.rename(self.lock_dir_path, released_path)
+        except OSError:
+            return
+        if self._is_ours(released_path):
+            shutil.rmtree(released_path, ignore_errors=True)
+            return
+        self.lost = True
+        sys.stderr.write(f"Lock {self.name} is held by another process, keeping it\n")
+        try:
+            os.rename(released_path, self.lock_dir_path)
+        except OSError:
+            sys.stderr.write(
+                f"Unable to put back lock {self.name}, it is at {released_path}\n"
+            )
+
+
 # def _sleep(seconds=0):
 #     print("sleeping", seconds, "seconds")
 #     for _ in range(seconds):
@@ -111,9 +111,12 @@ class DefaultFormatter(dict):
 # ---------------------------------------------------------
 # functions for sending various types of messages
 # ---------------------------------------------------------
-def send_message(syn, userids, subject_template, message_template, dry_run, kwargs):
+def send_message(
+    syn, userids, subject_template, message_template, dry_run, kwargs, outbox=None
+):
     """
-    Sends emails to participants
+    Sends emails to participants.  If an outbox is given, the message is
+    queued and sent in the background instead.
     """
     subject = subject_template.format_map(DefaultFormatter(DEFAULTS))
     subject = subject.format_map(DefaultFormatter(kwargs))
@@ -125,6 +128,9 @@ def send_message(syn, userids, subject_template, message_template, dry_run, kwar
         print("-" * 60)
         print(message)
         return None
+    if outbox is not None:
+        outbox.enqueue(userids, subject, message, content_type="text/html")
+        return None
     response = syn.sendMessage(
         userIds=userids,
         messageSubject=subject,
@@ -135,7 +141,7 @@ def send_message(syn, userids, subject_template, message_template, dry_run, kwar
     return response
 
 
-def validation_failed(syn, userids, send_messages, dry_run, **kwargs):
+def validation_failed(syn, userids, send_messages, dry_run, outbox=None, **kwargs):
     """
     Helper function to send validation failed email
     """
@@ -147,10 +153,11 @@ def validation_failed(syn, userids, send_messages, dry_run, **kwargs):
             message_template=VALIDATION_FAILED_TEMPLATE,
             dry_run=dry_run,
             kwargs=kwargs,
+            outbox=outbox,
         )
 
 
-def scoring_error(syn, userids, send_messages, dry_run, **kwargs):
+def scoring_error(syn, userids, send_messages, dry_run, outbox=None, **kwargs):
     """
     Helper function to send scoring error email
     """
@@ -162,10 +169,13 @@ def scoring_error(syn, userids, send_messages, dry_run, **kwargs):
             message_template=SCORING_ERROR_TEMPLATE,
             dry_run=dry_run,
             kwargs=kwargs,
+            outbox=outbox,
         )
 
 
-def validation_passed(syn, userids, acknowledge_receipt, dry_run, **kwargs):
+def validation_passed(
+    syn, userids, acknowledge_receipt, dry_run, outbox=None, **kwargs
+):
     """
     Helper function to send validation passed email
     """
@@ -177,10 +187,11 @@ def validation_passed(syn, userids, acknowledge_receipt, dry_run, **kwargs):
             message_template=VALIDATION_PASSED_TEMPLATE,
             dry_run=dry_run,
             kwargs=kwargs,
+            outbox=outbox,
         )
 
 
-def scoring_succeeded(syn, userids, send_messages, dry_run, **kwargs):
+def scoring_succeeded(syn, userids, send_messages, dry_run, outbox=None, **kwargs):
     """
     Helper function to send scoring succeeded emails
     """
@@ -192,10 +203,13 @@ def scoring_succeeded(syn, userids, send_messages, dry_run, **kwargs):
             message_template=SCORING_SUCEEDED_TEMPLATE,
             dry_run=dry_run,
             kwargs=kwargs,
+            outbox=outbox,
         )
 
 
-def error_notification(syn, userids, send_notifications, dry_run, **kwargs):
+def error_notification(
+    syn, userids, send_notifications, dry_run, outbox=None, **kwargs
+):
     """
     Helper function to send error notification emails
     """
@@ -207,4 +221,5 @@ def error_notification(syn, userids, send_notifications, dry_run, **kwargs):
             message_template=ERROR_NOTIFICATION_TEMPLATE,
             dry_run=dry_run,
             kwargs=kwargs,
+            outbox=outbox,
         )
@@ -0,0 +1,274 @@
+"""
+Timing and counters of the harness, exported in the Prometheus text format
+"""
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+STAGE_SECONDS = "harness_stage_seconds"
+PROCESSED = "harness_submissions_processed_total"
+INVALID = "harness_submissions_invalid_total"
+ERRORS = "harness_errors_total"
+STATUS_CONFLICTS = "harness_status_conflicts_total"
+QUEUE_DEPTH = "harness_queue_depth"
+
+_HELP = {
+    STAGE_SECONDS: "Time spent in each stage of processing submissions",
+    PROCESSED: "Submissions processed",
+    INVALID: "Submissions that were marked INVALID",
+    ERRORS: "Exceptions raised while interacting with submissions",
+    STATUS_CONFLICTS: "Submission statuses that were modified concurrently "
+    "and stored again",
+    QUEUE_DEPTH: "Submissions found in the queue by the last poll",
+}
+
+
+def _format_labels(labels):
+    """Format label pairs as {name="value",...}"""
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    """Cumulative histogram of observed values
+
+    Args:
+        buckets: Sorted upper bounds of the buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Add a value to the histogram"""
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class HarnessMetrics:
+    """Thread-safe registry of latency histograms, counters and gauges
+    labelled by evaluation queue, processor and stage.
+
+    Args:
+        buckets: Upper bounds in seconds of the latency histogram buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._server = None
+
+    @contextmanager
+    def time(self, stage, **labels):
+        """Time a stage of processing
+
+        Args:
+            stage: Name of the stage, e.g. download or interact
+            **labels: Labels of the measurement
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def observe(self, stage, seconds, **labels):
+        """Record the time a stage took
+
+        Args:
+            stage: Name of the stage
+            seconds: Time the stage took
+            **labels: Labels of the measurement
+        """
+        key = (STAGE_SECONDS, tuple(sorted(dict(labels, stage=stage).items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(self.buckets)
+            self._histograms[key].observe(seconds)
+
+    def timed_iter(self, iterable, stage, **labels):
+        """Time how long each item of an iterable takes to be produced,
+        e.g. the paging of getSubmissionBundles
+
+        Args:
+            iterable: Iterable to time
+            stage: Name of the stage
+            **labels: Labels of the measurement
+
+        Yields:
+            Items of the iterable
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.time(stage, **labels):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter
+
+        Args:
+            name: Name of the counter
+            value: Amount to increment by
+            **labels: Labels of the counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge
+
+        Args:
+            name: Name of the gauge
+            value: Value of the gauge
+            **labels: Labels of the gauge
+        """
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def to_prometheus(self):
+        """Get the metrics in the Prometheus text exposition format
+
+        Returns:
+            str
+        """
+        lines = []
+        described = set()
+
+        def describe(name, metric_type):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                describe(name, "histogram")
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    bucket_labels = _format_labels(labels + (("le", bound),))
+                    lines.append(f"{name}_bucket{bucket_labels} {count}")
+                bucket_labels = _format_labels(labels + (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{bucket_labels} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                describe(name, "counter")
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                describe(name, "gauge")
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Summarize the metrics
+
+        Returns:
+            dict with the stages, counters and gauges, each a list of
+            dicts of labels and values
+        """
+        with self._lock:
+            stages = [
+                dict(
+                    labels,
+                    count=histogram.count,
+                    total_seconds=histogram.sum,
+                    mean_seconds=histogram.sum / histogram.count,
+                    max_seconds=histogram.max,
+                )
+                for (_, labels), histogram in sorted(self._histograms.items())
+            ]
+            counters = [
+                dict(labels, name=name, value=value)
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            gauges = [
+                dict(labels, name=name, value=value)
+                for (name, labels), value in sorted(self._gauges.items())
+            ]
+        return {"stages": stages, "counters": counters, "gauges": gauges}
+
+    def write_prometheus(self, path):
+        """Write the metrics to a file, e.g. for the node exporter's
+        textfile collector.  The file is replaced atomically.
+
+        Args:
+            path: Path of the file
+        """
+        _write_atomically(path, self.to_prometheus())
+
+    def write_summary(self, path):
+        """Write the summary of the metrics to a JSON file
+
+        Args:
+            path: Path of the file
+        """
+        _write_atomically(path, json.dumps(self.summary(), indent=2))
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve the metrics over HTTP in a background thread
+
+        Args:
+            port: Port to listen on.  0 picks a free port.
+            host: Address to listen on. Default is localhost only.
+
+        Returns:
+            int: Port the metrics are served on
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        """Stop serving the metrics"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _write_atomically(path, text):
+    """Replace a file so that readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as out_file:
+        out_file.write(text)
+    os.replace(tmp_path, path)
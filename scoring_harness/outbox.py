@@ -0,0 +1,379 @@
+"""
+Durable queue of messages that are sent in the background so that
+validation and scoring never wait on email
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logging.basicConfig(format="%(asctime)s %(message)s")
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+class MessageOutbox:
+    """
+    Messages are written to a SQLite queue and sent by a background
+    thread.  Queued messages with the same subject and body are sent as
+    one message to all of their recipients.  Messages that fail to send
+    are retried with exponential backoff, and messages left in the queue
+    when the harness stops are sent the next time the outbox is started.
+    Messages that were given up on are logged and removed from the queue
+    when the outbox is started and closed, see purge_failed.
+
+    Attributes:
+        syn: Synapse object
+        path: SQLite file of the queue. Default is an in-memory queue.
+        max_workers: Maximum number of messages sent at once
+        retries: Number of attempts before a message is given up on
+        wait: Seconds to wait before the first retry
+        max_wait: Longest wait in seconds between retries
+    """
+
+    def __init__(self, syn, path=None, max_workers=4, retries=5, wait=1, max_wait=60):
+        self.syn = syn
+        self.max_workers = max_workers
+        self.retries = retries
+        self.wait = wait
+        self.max_wait = max_wait
+        self.path = path or ":memory:"
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "userids TEXT, subject TEXT, body TEXT, content_type TEXT, "
+            "attempts INTEGER DEFAULT 0, next_attempt REAL DEFAULT 0, "
+            "failed INTEGER DEFAULT 0)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Ids of messages currently being sent
+        self._sending = set()
+        # Number of sendMessage calls in progress
+        self._in_flight = 0
+        self._stopping = False
+        self._abandon = False
+        self._executor = None
+        self._thread = None
+        # Ids of messages captured by each thread, see capture
+        self._local = threading.local()
+        # (ids of unsent messages, callback) of when_sent
+        self._waiters = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def enqueue(self, userids, subject, body, content_type="text/html"):
+        """Queue a message
+
+        Args:
+            userids: List of Synapse user or team ids
+            subject: Subject of the message
+            body: Body of the message
+            content_type: text/html or text/plain
+
+        Returns:
+            int: Id of the queued message
+        """
+        with self._wakeup:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (userids, subject, body, content_type) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    json.dumps([str(userid) for userid in userids]),
+                    subject,
+                    body,
+                    content_type,
+                ),
+            )
+            self._db.commit()
+            self._wakeup.notify()
+        captured = getattr(self._local, "captured", None)
+        if captured is not None:
+            captured.append(cursor.lastrowid)
+        return cursor.lastrowid
+
+    @property
+    def durable(self):
+        """Queued messages survive a crash"""
+        return self.path != ":memory:"
+
+    @contextmanager
+    def capture(self):
+        """Collect the ids of the messages queued by this thread
+
+        Yields:
+            list of message ids, filled in as messages are queued
+        """
+        previous = getattr(self._local, "captured", None)
+        self._local.captured = []
+        try:
+            yield self._local.captured
+        finally:
+            self._local.captured = previous
+
+    def when_sent(self, messageids, callback):
+        """Call a function once messages were sent.  It is never called if
+        one of them is given up on or is still queued when the outbox is
+        closed.
+
+        Args:
+            messageids: Ids of queued messages
+            callback: Function without arguments, called right away if
+                      the messages were already sent
+        """
+        if not messageids:
+            callback()
+            return
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, failed FROM outbox WHERE id IN "
+                f"({', '.join('?' * len(messageids))})",
+                list(messageids),
+            ).fetchall()
+            if any(failed for _, failed in rows):
+                return
+            unsent = {messageid for messageid, _ in rows}
+            if unsent:
+                self._waiters.append((unsent, callback))
+                return
+        callback()
+
+    def _acknowledge(self, messageids, sent):
+        """Update the waiters of messages that were sent or given up on
+
+        Returns:
+            callbacks whose messages were all sent
+        """
+        ready = []
+        for waiter in list(self._waiters):
+            unsent, callback = waiter
+            if unsent.isdisjoint(messageids):
+                continue
+            if not sent:
+                self._waiters.remove(waiter)
+                continue
+            unsent.difference_update(messageids)
+            if not unsent:
+                self._waiters.remove(waiter)
+                ready.append(callback)
+        return ready
+
+    def pending(self):
+        """Number of messages that still have to be sent"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE failed = 0"
+            ).fetchone()[0]
+
+    def failed_messages(self):
+        """Messages that were given up on and not purged yet
+
+        Returns:
+            list of dict with the id, userids, subject and attempts of
+            each message
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, userids, subject, attempts FROM outbox "
+                "WHERE failed = 1 ORDER BY id"
+            ).fetchall()
+        return [
+            {
+                "id": messageid,
+                "userids": json.loads(userids),
+                "subject": subject,
+                "attempts": attempts,
+            }
+            for messageid, userids, subject, attempts in rows
+        ]
+
+    def purge_failed(self):
+        """Log the messages that were given up on and remove them from the
+        queue, so that they aren't kept forever
+
+        Returns:
+            list of the purged messages, see failed_messages
+        """
+        failed = self.failed_messages()
+        for message in failed:
+            LOGGER.error(
+                f"Message {message['subject']!r} to {message['userids']} was "
+                f"not sent after {message['attempts']} attempts"
+            )
+        if failed:
+            with self._lock:
+                self._db.execute(
+                    f"DELETE FROM outbox WHERE id IN "
+                    f"({', '.join('?' * len(failed))})",
+                    [message["id"] for message in failed],
+                )
+                self._db.commit()
+        return failed
+
+    def start(self):
+        """Start sending messages in the background"""
+        if self._thread is not None:
+            return
+        self.purge_failed()
+        self._stopping = False
+        self._abandon = False
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=None):
+        """Send all queued messages, then stop the background sender
+
+        Args:
+            timeout: Seconds to wait for the queue to drain. Default is to
+                     wait until every message is sent or given up on.
+                     Messages that aren't sent by then stay queued.
+        """
+        if self._thread is not None:
+            with self._wakeup:
+                self._stopping = True
+                self._wakeup.notify()
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                LOGGER.warning(f"Leaving {self.pending()} messages in the outbox")
+                with self._wakeup:
+                    self._abandon = True
+                    self._wakeup.notify()
+                self._thread.join()
+            self._executor.shutdown(wait=True)
+            self._thread = None
+        self.purge_failed()
+        with self._lock:
+            self._db.close()
+
+    def _next_batch(self):
+        """Group the messages that are due by subject and body
+
+        Returns:
+            list of (message ids, recipients, subject, body, content_type)
+            and the seconds until the next message is due
+        """
+        now = time.time()
+        rows = self._db.execute(
+            "SELECT id, userids, subject, body, content_type, next_attempt "
+            "FROM outbox WHERE failed = 0 ORDER BY id"
+        ).fetchall()
+        groups = {}
+        next_due = None
+        for messageid, userids, subject, body, content_type, next_attempt in rows:
+            if messageid in self._sending:
+                continue
+            if next_attempt > now:
+                wait = next_attempt - now
+                next_due = wait if next_due is None else min(next_due, wait)
+                continue
+            group = groups.setdefault((subject, body, content_type), ([], []))
+            group[0].append(messageid)
+            for userid in json.loads(userids):
+                if userid not in group[1]:
+                    group[1].append(userid)
+        batch = [
+            (messageids, recipients, subject, body, content_type)
+            for (subject, body, content_type), (
+                messageids,
+                recipients,
+            ) in groups.items()
+        ]
+        return batch, next_due
+
+    def _drain(self):
+        """Send queued messages until the outbox is closed and empty"""
+        while True:
+            with self._wakeup:
+                if self._abandon:
+                    return
+                # Messages queued while every worker is busy are grouped
+                # together once a worker is free
+                free_workers = self.max_workers - self._in_flight
+                batch, next_due = [], None
+                if free_workers > 0:
+                    batch, next_due = self._next_batch()
+                    batch = batch[:free_workers]
+                if not batch:
+                    if self._stopping and not self._in_flight and next_due is None:
+                        return
+                    self._wakeup.wait(next_due)
+                    continue
+                for messageids, *_ in batch:
+                    self._sending.update(messageids)
+                self._in_flight += len(batch)
+            for message in batch:
+                self._executor.submit(self._send, *message)
+
+    def _send(self, messageids, recipients, subject, body, content_type):
+        """Send one message and record the outcome of its queue entries"""
+        try:
+            response = self.syn.sendMessage(
+                userIds=recipients,
+                messageSubject=subject,
+                messageBody=body,
+                contentType=content_type,
+            )
+            LOGGER.info(f"sent: {response}")
+            error = None
+        except Exception as ex:
+            error = ex
+        ready = []
+        with self._wakeup:
+            placeholders = ", ".join("?" * len(messageids))
+            if error is None:
+                self._db.execute(
+                    f"DELETE FROM outbox WHERE id IN ({placeholders})", messageids
+                )
+                ready = self._acknowledge(messageids, sent=True)
+            else:
+                given_up = self._record_failure(messageids, recipients, error)
+                self._acknowledge(given_up, sent=False)
+            self._db.commit()
+            self._sending.difference_update(messageids)
+            self._in_flight -= 1
+            self._wakeup.notify()
+        for callback in ready:
+            try:
+                callback()
+            except Exception as ex:
+                LOGGER.error(f"Error after sending message to {recipients}: {ex}")
+
+    def _record_failure(self, messageids, recipients, error):
+        """Schedule a retry or give up on messages that couldn't be sent
+
+        Returns:
+            Ids of the messages that were given up on
+        """
+        given_up = []
+        for messageid in messageids:
+            (attempts,) = self._db.execute(
+                "SELECT attempts FROM outbox WHERE id = ?", (messageid,)
+            ).fetchone()
+            attempts += 1
+            failed = attempts >= self.retries
+            next_attempt = time.time() + min(
+                self.wait * 2 ** (attempts - 1), self.max_wait
+            )
+            self._db.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt = ?, failed = ? "
+                "WHERE id = ?",
+                (attempts, next_attempt, int(failed), messageid),
+            )
+            if failed:
+                given_up.append(messageid)
+        if given_up:
+            LOGGER.error(f"Giving up on message to {recipients}: {error}")
+        else:
+            LOGGER.warning(f"Unable to send message to {recipients}: {error}")
+        return given_up
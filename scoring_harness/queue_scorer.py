@@ -23,7 +23,9 @@ class EvaluationQueueScorer(EvaluationQueueProcessor):
         is_valid = submission_info["valid"]
         message = submission_info["message"]
 
-        submitter_info = _get_submission_submitter(self.syn, submission)
+        submitter_info = _get_submission_submitter(
+            self.syn, submission, identity_cache=self.identity_cache
+        )
         submitterid = submitter_info["submitterid"]
         submitter_name = submitter_info["submitter_name"]
         if is_valid:
@@ -32,6 +34,7 @@ class EvaluationQueueScorer(EvaluationQueueProcessor):
                 userids=[submitterid],
                 send_messages=self.send_messages,
                 dry_run=self.dry_run,
+                outbox=self.outbox,
                 message=message,
                 username=submitter_name,
                 queue_name=self.evaluation.name,
@@ -45,6 +48,7 @@ class EvaluationQueueScorer(EvaluationQueueProcessor):
                 userids=self.admin_user_ids,
                 send_messages=self.send_messages,
                 dry_run=self.dry_run,
+                outbox=self.outbox,
                 message=message,
                 username="Challenge Administrator",
                 queue_name=self.evaluation.name,
@@ -28,7 +28,9 @@ class EvaluationQueueValidator(EvaluationQueueProcessor):
         error = submission_info["error"]
         message = submission_info["message"]
 
-        submitter_info = _get_submission_submitter(self.syn, submission)
+        submitter_info = _get_submission_submitter(
+            self.syn, submission, identity_cache=self.identity_cache
+        )
         submitterid_list = [submitter_info["submitterid"]]
         submitter_name = submitter_info["submitter_name"]
         if is_valid:
@@ -37,6 +39,7 @@ class EvaluationQueueValidator(EvaluationQueueProcessor):
                 userids=submitterid_list,
                 acknowledge_receipt=self.acknowledge_receipt,  # noqa pylint: disable=line-too-long
                 dry_run=self.dry_run,
+                outbox=self.outbox,
                 username=submitter_name,
                 queue_name=self.evaluation.name,
                 submission_id=submission.id,
@@ -52,6 +55,7 @@ class EvaluationQueueValidator(EvaluationQueueProcessor):
                 userids=submitterid_list,
                 send_messages=self.send_messages,
                 dry_run=self.dry_run,
+                outbox=self.outbox,
                 username=submitter_name,
                 queue_name=self.evaluation.name,
                 submission_id=submission.id,
@@ -0,0 +1,119 @@
+"""
+Share the harness fairly between evaluation queues and between the
+submitters of each queue
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+import logging
+
+logging.basicConfig(format="%(asctime)s %(message)s")
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+def fair_order(items, key):
+    """Reorder items so that each key takes a turn, e.g. so that a team
+    with many submissions doesn't hold up everyone else.  Items with the
+    same key keep their order.
+
+    Args:
+        items: Iterable of items
+        key: Function returning the key of an item
+
+    Yields:
+        Items in round-robin order of their keys
+    """
+    groups = OrderedDict()
+    for item in items:
+        groups.setdefault(key(item), deque()).append(item)
+    while groups:
+        for group_key in list(groups):
+            group = groups[group_key]
+            yield group.popleft()
+            if not group:
+                del groups[group_key]
+
+
+def interleave(queues, weights=None, priorities=None):
+    """Take items from several iterables by smooth weighted round-robin.
+    A queue with weight 3 gets three turns for every turn of a queue with
+    weight 1, spread out rather than in a burst.  Queues with a higher
+    priority are always taken from first while they have items.
+
+    Args:
+        queues: dict of name to iterable
+        weights: dict of name to weight. Default is 1.
+        priorities: dict of name to priority. Default is 0.
+
+    Yields:
+        (name, item)
+    """
+    weights = weights or {}
+    priorities = priorities or {}
+    active = {name: iter(items) for name, items in queues.items()}
+    current = {name: 0 for name in queues}
+    while active:
+        top = max(priorities.get(name, 0) for name in active)
+        candidates = [name for name in active if priorities.get(name, 0) == top]
+        total = sum(weights.get(name, 1) for name in candidates)
+        for name in candidates:
+            current[name] += weights.get(name, 1)
+        name = max(candidates, key=current.get)
+        current[name] -= total
+        try:
+            item = next(active[name])
+        except StopIteration:
+            del active[name]
+            continue
+        yield name, item
+
+
+def run_interleaved(processors, weights=None, priorities=None, max_workers=1):
+    """Process the submissions of several EvaluationQueueProcessors in one
+    interleaved stream instead of one queue after another
+
+    Args:
+        processors: dict of name to EvaluationQueueProcessor
+        weights: dict of name to weight. Default is 1.
+        priorities: dict of name to priority. Default is 0.
+        max_workers: Number of submissions processed at once
+
+    Returns:
+        dict of name to number of submissions processed
+    """
+    processed = {name: 0 for name in processors}
+    with ExitStack() as stack:
+        queues = {
+            name: stack.enter_context(processor.processing_run())
+            for name, processor in processors.items()
+        }
+        scheduled = interleave(queues, weights=weights, priorities=priorities)
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # Keep at most max_workers submissions in flight, see
+                # EvaluationQueueProcessor._process_concurrently
+                pending = deque()
+                for name, bundle in scheduled:
+                    pending.append(
+                        (
+                            name,
+                            executor.submit(
+                                processors[name].process_submission, *bundle
+                            ),
+                        )
+                    )
+                    if len(pending) >= max_workers:
+                        name, future = pending.popleft()
+                        future.result()
+                        processed[name] += 1
+                while pending:
+                    name, future = pending.popleft()
+                    future.result()
+                    processed[name] += 1
+        else:
+            for name, (submission, sub_status) in scheduled:
+                LOGGER.info(f"Interacting with submission: {submission.id}")
+                processors[name].process_submission(submission, sub_status)
+                processed[name] += 1
+    return processed
@@ -0,0 +1,119 @@
+"""
+Test the asyncio scoring harness
+"""
+import asyncio
+import time
+from unittest import mock
+from unittest.mock import patch
+
+import synapseclient
+
+from scoring_harness.async_processor import AsyncEvaluationQueueProcessor
+from scoring_harness.exceptions import SubmissionTimeout
+
+SYN = mock.create_autospec(synapseclient.Synapse)
+EVALUATION = synapseclient.Evaluation(name="foo", id="222", contentSource="syn1234")
+
+
+def _bundles(count):
+    return [
+        (
+            synapseclient.Submission(
+                name="foo",
+                entityId="syn123",
+                evaluationId=2,
+                versionNumber=1,
+                id=str(index),
+                filePath="foo",
+                userId="222",
+            ),
+            synapseclient.SubmissionStatus(status="RECEIVED", id=str(index), etag="1"),
+        )
+        for index in range(count)
+    ]
+
+
+class AsyncProcessor(AsyncEvaluationQueueProcessor):
+    """Processor with a coroutine interaction_func"""
+
+    _success_status = "VALIDATED"
+    delay = 0.2
+
+    async def interaction_func(self, submission, **kwargs):
+        await asyncio.sleep(self.delay)
+        return {"valid": True, "annotations": {"id": submission.id}, "message": ""}
+
+    def notify(self, submission, submission_info):
+        pass
+
+
+class SyncProcessor(AsyncProcessor):
+    """Processor with a blocking interaction_func"""
+
+    def interaction_func(self, submission, **kwargs):
+        time.sleep(self.delay)
+        return {"valid": True, "annotations": kwargs, "message": ""}
+
+
+def _processor(cls, **kwargs):
+    with patch.object(SYN, "getEvaluation", return_value=EVALUATION):
+        return cls(SYN, EVALUATION, admin_user_ids=[1], **kwargs)
+
+
+def test_call_coroutine_interaction_concurrently():
+    """Coroutine interactions are awaited at once and every status stored"""
+    proc = _processor(AsyncProcessor, max_in_flight=10)
+    bundles = _bundles(10)
+    with patch.object(SYN, "getSubmissionBundles", return_value=bundles), patch.object(
+        SYN, "store"
+    ) as patch_store, patch.object(proc, "notify") as patch_notify:
+        start = time.time()
+        assert proc() == 10
+        assert time.time() - start < 10 * proc.delay
+    assert patch_store.call_count == 10
+    assert patch_notify.call_count == 10
+    stored = patch_store.call_args_list[0][0][0]
+    assert stored.status == "VALIDATED"
+
+
+def test_call_sync_interaction_in_executor():
+    """Blocking interactions run on the thread pool with the kwargs"""
+    proc = _processor(SyncProcessor, max_in_flight=5, foo="bar")
+    assert proc.kwargs == {"foo": "bar"}
+    with patch.object(
+        SYN, "getSubmissionBundles", return_value=_bundles(5)
+    ), patch.object(SYN, "store") as patch_store:
+        start = time.time()
+        assert proc() == 5
+        assert time.time() - start < 5 * proc.delay
+    assert patch_store.call_count == 5
+
+
+def test_interact_coroutine_timeout():
+    """A coroutine interaction that runs over the timeout is invalid"""
+    proc = _processor(AsyncProcessor, timeout=0.05)
+    submission, _ = _bundles(1)[0]
+    submission_info = asyncio.run(proc.interact_with_submission_async(submission))
+    assert not submission_info["valid"]
+    assert isinstance(submission_info["error"], SubmissionTimeout)
+
+
+def test_call_max_in_flight():
+    """No more than max_in_flight interactions run at once"""
+    proc = _processor(AsyncProcessor, max_in_flight=2)
+    running = []
+    peak = []
+
+    async def interaction_func(submission, **kwargs):
+        running.append(submission.id)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(submission.id)
+        return {"valid": True, "annotations": {}, "message": ""}
+
+    proc.interaction_func = interaction_func
+    with patch.object(
+        SYN, "getSubmissionBundles", return_value=_bundles(6)
+    ), patch.object(SYN, "store"):
+        assert proc() == 6
+    assert max(peak) == 2
@@ -0,0 +1,84 @@
+"""
+Test recording and replaying Synapse requests
+"""
+# pylint: disable=redefined-outer-name
+import gzip
+
+import pytest
+import synapseclient
+
+from benchmarks.fake_synapse import FakeSynapseServer, seed
+from challengeutils import cassette
+from challengeutils.cassette import Cassette, CassetteError
+
+
+def _client(server, session, tmpdir, token):
+    syn = synapseclient.Synapse(
+        skip_checks=True,
+        requests_session=session,
+        cache_root_dir=str(tmpdir),
+        **server.endpoints(),
+    )
+    syn.login(authToken=token, silent=True)
+    return syn
+
+
+@pytest.fixture
+def recording(tmpdir):
+    """Record listing and downloading the submissions of a queue"""
+    path = str(tmpdir / "cassette.jsonl.gz")
+    with FakeSynapseServer() as server:
+        evaluationid = seed(server.synapse, submissions=3)["evaluations"][0]
+        recorder = Cassette(path)
+        syn = _client(server, recorder.session(), tmpdir / "record", "secret")
+        submissions = [
+            syn.getSubmission(submission.id)
+            for submission, _ in syn.getSubmissionBundles(evaluationid)
+        ]
+        recorder.close()
+    return server, path, evaluationid, submissions
+
+
+def test_redact_url():
+    """Signatures are redacted and other parameters kept"""
+    url = "https://s3.aws/file?X-Amz-Signature=abc&X-Amz-Expires=30&Signature=d"
+    assert cassette.redact_url(url) == (
+        "https://s3.aws/file?X-Amz-Signature=REDACTED&X-Amz-Expires=30"
+        "&Signature=REDACTED"
+    )
+
+
+def test_record_redacts_credentials(recording):
+    """The auth token isn't written to the cassette"""
+    _, path, _, _ = recording
+    with gzip.open(path, "rt") as cassette_file:
+        recorded = cassette_file.read()
+    assert "secret" not in recorded
+    assert "Bearer" not in recorded
+
+
+def test_replay(recording, tmpdir):
+    """Requests are served from the cassette once the server is gone"""
+    server, path, evaluationid, submissions = recording
+    player = Cassette(path, mode=cassette.REPLAY)
+    syn = _client(
+        server, player.session(), tmpdir / "replay", cassette.REPLAY_AUTH_TOKEN
+    )
+    replayed = [
+        syn.getSubmission(submission.id)
+        for submission, _ in syn.getSubmissionBundles(evaluationid)
+    ]
+    assert [submission.id for submission in replayed] == [
+        submission.id for submission in submissions
+    ]
+    with open(replayed[0].filePath) as prediction:
+        assert prediction.read() == "prediction"
+    with pytest.raises(CassetteError):
+        syn.restPOST("/entity", body="{}")
+
+
+def test_open_cassette(tmpdir):
+    """Only one of record and replay can be given"""
+    assert cassette.open_cassette() is None
+    with pytest.raises(ValueError):
+        cassette.open_cassette(record="a", replay="b")
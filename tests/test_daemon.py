@@ -0,0 +1,54 @@
+"""Test the harness daemon"""
+from unittest.mock import Mock
+
+import pytest
+
+from scoring_harness.daemon import AdaptiveInterval, QueueDaemon
+
+
+def test_invalid_interval():
+    """Minimum interval can't be larger than the maximum"""
+    with pytest.raises(ValueError, match="min_interval <= max_interval"):
+        AdaptiveInterval(min_interval=10, max_interval=5)
+
+
+def test_adaptive_interval():
+    """Interval backs off while idle and resets on activity"""
+    interval = AdaptiveInterval(min_interval=1, max_interval=5, backoff=2)
+    assert interval.next(False) == 2
+    assert interval.next(False) == 4
+    assert interval.next(False) == 5
+    assert interval.next(True) == 1
+
+
+def test_poll():
+    """Processors of a queue run in order and errors don't stop the poll"""
+    validate = Mock(return_value=2)
+    score = Mock(side_effect=ValueError("foo"))
+    other = Mock(return_value=3)
+    queue_daemon = QueueDaemon({"1": [validate, score], "2": [other]})
+    assert queue_daemon.poll("1") == 2
+    validate.assert_called_once_with()
+    score.assert_called_once_with()
+    other.assert_not_called()
+
+
+def test_run_until_stopped():
+    """Run polls every queue until stop is called"""
+    processor = Mock(return_value=0)
+    polls = []
+
+    def on_poll():
+        polls.append(1)
+        if len(polls) == 3:
+            queue_daemon.stop()
+
+    queue_daemon = QueueDaemon(
+        {"1": [processor], "2": [processor]},
+        min_interval=0.01,
+        max_interval=0.02,
+        on_poll=on_poll,
+    )
+    queue_daemon.run()
+    assert queue_daemon.stopped
+    assert processor.call_count == 3
@@ -0,0 +1,129 @@
+"""Test watermark based submission discovery"""
+from datetime import timedelta
+from unittest import mock
+from unittest.mock import Mock, patch
+
+import pandas as pd
+import synapseclient
+
+from scoring_harness import discovery
+from scoring_harness.discovery import SubmissionDiscovery, WatermarkStore
+
+SYN = mock.create_autospec(synapseclient.Synapse)
+EVALUATION = synapseclient.Evaluation(name="foo", id="222", contentSource="syn1")
+SUBMISSION = synapseclient.Submission(
+    name="foo", entityId="syn123", evaluationId="222", versionNumber=1, id="111"
+)
+STATUS = synapseclient.SubmissionStatus(
+    id="111", status="RECEIVED", etag="1", modifiedOn="2020-01-01T00:00:00.000Z"
+)
+MODIFIED_ON = 1577836800000
+
+
+def _discovery(tmpdir, **kwargs):
+    store = WatermarkStore(str(tmpdir.join("watermarks.json")))
+    return SubmissionDiscovery(SYN, EVALUATION, "RECEIVED", store, **kwargs)
+
+
+def test_store(tmpdir):
+    """The state of each queue is kept"""
+    path = str(tmpdir.join("watermarks.json"))
+    WatermarkStore(path).set("222:RECEIVED", 10, 20)
+    WatermarkStore(path).set("222:VALIDATED", 30, 40)
+    store = WatermarkStore(path)
+    assert store.get("222:RECEIVED") == {"watermark": 10, "last_sweep": 20}
+    assert store.get("222:VALIDATED") == {"watermark": 30, "last_sweep": 40}
+    assert store.get("333:RECEIVED") == {}
+
+
+def test_first_run_sweeps(tmpdir):
+    """Every bundle is listed the first time and sets the watermark"""
+    queue = _discovery(tmpdir)
+    with patch.object(
+        SYN, "getSubmissionBundles", return_value=[(SUBMISSION, STATUS)]
+    ) as patch_bundles, patch.object(discovery.time, "time", return_value=100):
+        assert list(queue.bundles()) == [(SUBMISSION, STATUS)]
+        queue.commit()
+    patch_bundles.assert_called_once_with(EVALUATION, status="RECEIVED")
+    assert queue.store.get(queue.scope) == {
+        "watermark": MODIFIED_ON,
+        "last_sweep": 100,
+    }
+
+
+def test_incremental(tmpdir):
+    """Only submissions modified after the watermark are asked for"""
+    queue = _discovery(tmpdir, overlap=timedelta(0))
+    queue.store.set(queue.scope, 5, discovery.time.time())
+    rows = [
+        {"objectId": "112", "modifiedOn": "9"},
+        {"objectId": "111", "modifiedOn": "7"},
+    ]
+    validated = synapseclient.SubmissionStatus(
+        id="112", status="VALIDATED", etag="1"
+    )
+    with patch.object(
+        discovery, "evaluation_queue_query", return_value=rows
+    ) as patch_query, patch.object(
+        SYN, "getSubmissionStatus", side_effect=[STATUS, validated]
+    ), patch.object(
+        SYN, "restGET", return_value=dict(SUBMISSION)
+    ), patch.object(
+        SYN, "getSubmissionBundles"
+    ) as patch_bundles:
+        bundles = list(queue.bundles())
+        queue.commit()
+    patch_bundles.assert_not_called()
+    patch_query.assert_called_once_with(
+        SYN,
+        "select objectId, modifiedOn from evaluation_222 "
+        "where status == 'RECEIVED' and modifiedOn > 5",
+        limit=500,
+    )
+    # Submissions whose status already changed are skipped
+    assert [submission.id for submission, _ in bundles] == ["111"]
+    assert queue.store.get(queue.scope)["watermark"] == 7
+
+
+def test_submission_view(tmpdir):
+    """Submission views are queried with a server side filter"""
+    queue = _discovery(tmpdir, submission_view="syn999", overlap=timedelta(0))
+    queue.store.set(queue.scope, 5, discovery.time.time())
+    view_query = Mock()
+    view_query.asDataFrame.return_value = pd.DataFrame(
+        {"id": [111], "modifiedOn": [7]}
+    )
+    with patch.object(
+        SYN, "tableQuery", return_value=view_query
+    ) as patch_query, patch.object(
+        SYN, "getSubmissionStatus", return_value=STATUS
+    ), patch.object(
+        SYN, "restGET", return_value=dict(SUBMISSION)
+    ):
+        assert len(list(queue.bundles())) == 1
+    patch_query.assert_called_once_with(
+        "select id, modifiedOn from syn999 where evaluationid = 222 and "
+        "status = 'RECEIVED' and modifiedOn > 5"
+    )
+
+
+def test_sweep_interval(tmpdir):
+    """Queues are fully listed again once the sweep interval passed"""
+    queue = _discovery(tmpdir, sweep_interval=timedelta(seconds=10))
+    queue.store.set(queue.scope, 5, 100)
+    with patch.object(
+        SYN, "getSubmissionBundles", return_value=[]
+    ) as patch_bundles, patch.object(discovery.time, "time", return_value=111):
+        list(queue.bundles())
+    patch_bundles.assert_called_once()
+
+
+def test_unfinished_run_not_committed(tmpdir):
+    """The watermark only moves once every bundle was processed"""
+    queue = _discovery(tmpdir)
+    with patch.object(
+        SYN, "getSubmissionBundles", return_value=[(SUBMISSION, STATUS)]
+    ):
+        next(queue.bundles())
+        queue.commit()
+    assert queue.store.get(queue.scope) == {}
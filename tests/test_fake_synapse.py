@@ -0,0 +1,103 @@
+"""
+Test the fake Synapse server used for benchmarking
+"""
+# pylint: disable=redefined-outer-name
+import json
+import time
+
+import pytest
+from synapseclient.core.exceptions import SynapseHTTPError
+
+from benchmarks.fake_synapse import FakeSynapseServer, _parse_query, seed
+from challengeutils import discussion, utils
+from scoring_harness.queue_validator import EvaluationQueueValidator
+
+
+@pytest.fixture
+def server():
+    with FakeSynapseServer() as fake_server:
+        yield fake_server
+
+
+@pytest.fixture
+def syn(server, tmpdir):
+    return server.client(cache_root_dir=str(tmpdir))
+
+
+class Validate(EvaluationQueueValidator):
+    """Validator that checks the downloaded file"""
+
+    def interaction_func(self, submission, **kwargs):
+        with open(submission.filePath) as prediction:
+            valid = prediction.read() == "prediction"
+        return {"valid": valid, "annotations": {"checked": 1}, "message": ""}
+
+
+def test_parse_query():
+    """Select, where, limit and offset are parsed"""
+    assert _parse_query(
+        "select objectId from evaluation_9 where status == 'VALIDATED' "
+        "and modifiedOn > 5 limit 20 offset 40"
+    ) == (
+        ["objectId"],
+        "9",
+        [("status", "==", "VALIDATED"), ("modifiedOn", ">", "5")],
+        20,
+        40,
+    )
+
+
+def test_validate_queue(server, syn):
+    """The harness downloads, validates and annotates submissions"""
+    evaluationid = seed(server.synapse, submissions=5)["evaluations"][0]
+    validate = Validate(syn, evaluationid)
+    assert validate() == 5
+    rows = list(
+        utils.evaluation_queue_query(
+            syn,
+            f"select objectId, checked from evaluation_{evaluationid} "
+            "where status == 'VALIDATED'",
+        )
+    )
+    assert len(rows) == 5
+    assert all(row["checked"] == "1" for row in rows)
+
+
+def test_store_stale_status(server, syn):
+    """Storing a status with an old etag is a conflict"""
+    evaluationid = seed(server.synapse, submissions=1)["evaluations"][0]
+    _, status = next(syn.getSubmissionBundles(evaluationid))
+    status.status = "SCORED"
+    syn.store(status)
+    with pytest.raises(SynapseHTTPError, match="412"):
+        syn.store(status)
+
+
+def test_reject_flat_annotations(server, syn):
+    """Submission annotations must be in the shape Synapse expects"""
+    evaluationid = seed(server.synapse, submissions=1)["evaluations"][0]
+    _, status = next(syn.getSubmissionBundles(evaluationid))
+    status.submissionAnnotations = {"foo": ["bar"]}
+    batch = {"statuses": [status], "isFirstBatch": True, "isLastBatch": True}
+    with pytest.raises(SynapseHTTPError, match="400"):
+        syn.restPUT(f"/evaluation/{evaluationid}/statusBatch", json.dumps(batch))
+
+
+def test_forum_and_messages(server, syn):
+    """Threads and messages keep their text"""
+    projectid = seed(server.synapse, submissions=0, threads=2)["project"]
+    threads = list(discussion.get_forum_threads(syn, projectid))
+    assert [thread.title for thread in threads] == ["thread 0", "thread 1"]
+    assert discussion.get_thread_text(syn, threads[1].id) == "question 1"
+    syn.sendMessage(["1"], "subject", "body")
+    assert server.synapse.messages[-1]["body"] == "body"
+
+
+def test_latency(server, syn):
+    """Requests are counted and delayed"""
+    server.route_latency = {"current_user": 0.2}
+    server.requests.clear()
+    start = time.time()
+    syn.getUserProfile(refresh=True)
+    assert time.time() - start >= 0.2
+    assert server.requests["current_user"] == 1
@@ -0,0 +1,99 @@
+"""Test the submission file cache"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from scoring_harness.file_cache import SubmissionFileCache
+
+
+def _download(cache, submissionid, size):
+    """Write a file of size bytes where the submission is downloaded"""
+    path = cache.download_location(submissionid)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "prediction.csv"), "wb") as prediction:
+        prediction.write(b"0" * size)
+    cache.record(submissionid)
+
+
+def test_lru_eviction(tmpdir):
+    """The least recently used submissions are removed when over budget"""
+    cache = SubmissionFileCache(str(tmpdir), max_bytes=250)
+    _download(cache, "1", 100)
+    _download(cache, "2", 100)
+    # Reuse 1 so that 2 is the least recently used
+    cache.record("1")
+    _download(cache, "3", 100)
+    assert "2" not in cache
+    assert not os.path.exists(cache.download_location("2"))
+    assert "1" in cache and "3" in cache
+    assert cache.size == 200
+
+
+def test_pinned_not_evicted(tmpdir):
+    """Submissions being processed are kept until they are released"""
+    cache = SubmissionFileCache(str(tmpdir), max_bytes=150)
+    cache.pin("1")
+    _download(cache, "1", 100)
+    _download(cache, "2", 100)
+    assert "1" in cache
+    assert "2" not in cache
+    cache.pin("3")
+    _download(cache, "3", 100)
+    # Both are pinned, so the cache is over budget
+    assert cache.size == 200
+    cache.release("1")
+    assert "1" not in cache
+    assert "3" in cache
+
+
+def test_pinned_twice(tmpdir):
+    """A submission stays pinned until every pin is released"""
+    cache = SubmissionFileCache(str(tmpdir), max_bytes=50)
+    cache.pin("1")
+    cache.pin("1")
+    _download(cache, "1", 100)
+    cache.release("1")
+    assert "1" in cache
+    cache.release("1")
+    assert "1" not in cache
+
+
+def test_restart(tmpdir):
+    """Cached submissions are found again in least recently used order"""
+    cache = SubmissionFileCache(str(tmpdir), max_bytes=1000)
+    _download(cache, "1", 100)
+    _download(cache, "2", 100)
+    old = time.time() - 100
+    os.utime(cache.download_location("2"), (old, old))
+    cache = SubmissionFileCache(str(tmpdir), max_bytes=150)
+    assert cache.size == 200
+    cache.evict()
+    assert "2" not in cache
+    assert "1" in cache
+
+
+def test_pinned_by_other_process(tmpdir):
+    """Submissions pinned by another process sharing the directory are
+    kept, unless that process exited"""
+    other = SubmissionFileCache(str(tmpdir), max_bytes=1000)
+    other.pin("1")
+    _download(other, "1", 100)
+    cache = SubmissionFileCache(str(tmpdir), max_bytes=50)
+    assert cache.size == 100
+    cache.evict()
+    assert os.path.exists(cache.download_location("1"))
+    other.release("1")
+    cache.evict()
+    assert not os.path.exists(cache.download_location("1"))
+    # Pins of processes of this host that exited are ignored
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    _download(other, "2", 100)
+    pins = tmpdir / ".pins" / "2"
+    pins.mkdir()
+    (pins / f"{socket.gethostname()}:{process.pid}:dead").write("")
+    cache = SubmissionFileCache(str(tmpdir), max_bytes=50)
+    cache.evict()
+    assert not os.path.exists(cache.download_location("2"))
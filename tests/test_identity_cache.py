@@ -0,0 +1,78 @@
+"""Test the submitter identity cache"""
+from datetime import timedelta
+from unittest import mock
+from unittest.mock import Mock, patch
+
+import synapseclient
+
+from challengeutils import identity_cache
+from challengeutils.identity_cache import IdentityCache
+
+SYN = mock.create_autospec(synapseclient.Synapse)
+
+
+def test_lookup_fetches_once():
+    """Values are only fetched when they aren't cached"""
+    cache = IdentityCache()
+    fetch = Mock(return_value="foo")
+    assert cache.lookup("user:1", fetch) == "foo"
+    assert cache.lookup("user:1", fetch) == "foo"
+    fetch.assert_called_once_with()
+
+
+def test_expired_entries():
+    """Entries older than the time to live are refetched"""
+    cache = IdentityCache(ttl=timedelta(seconds=10))
+    with patch.object(identity_cache.time, "time", return_value=100):
+        cache.set("user:1", "foo")
+    with patch.object(identity_cache.time, "time", return_value=105):
+        assert cache.get("user:1") == "foo"
+    with patch.object(identity_cache.time, "time", return_value=111):
+        assert cache.get("user:1") is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    """The least recently used entry is evicted when the cache is full"""
+    cache = IdentityCache(max_size=2)
+    cache.set("user:1", "one")
+    cache.set("user:2", "two")
+    cache.get("user:1")
+    cache.set("user:3", "three")
+    assert cache.get("user:2") is None
+    assert cache.get("user:1") == "one"
+    assert cache.get("user:3") == "three"
+
+
+def test_persisted_entries(tmp_path):
+    """Entries are reloaded from the SQLite file"""
+    path = str(tmp_path / "identities.db")
+    cache = IdentityCache(path=path, max_size=2)
+    cache.set("user:1", "one")
+    cache.set("user:2", "two")
+    cache.set("user:3", "three")
+    cache.close()
+    reloaded = IdentityCache(path=path)
+    assert reloaded.get("user:1") is None
+    assert reloaded.get("user:2") == "two"
+    assert reloaded.get("user:3") == "three"
+    reloaded.close()
+
+
+def test_get_team_name():
+    """Team names are looked up once per cache"""
+    cache = IdentityCache()
+    with patch.object(SYN, "getTeam", return_value={"name": "foo"}) as patch_team:
+        assert identity_cache.get_team_name(SYN, "1", cache=cache) == "foo"
+        assert identity_cache.get_team_name(SYN, "1", cache=cache) == "foo"
+        patch_team.assert_called_once_with("1")
+
+
+def test_get_user_name_no_cache():
+    """User names are looked up every time without a cache"""
+    with patch.object(
+        SYN, "getUserProfile", return_value={"userName": "foo"}
+    ) as patch_user:
+        assert identity_cache.get_user_name(SYN, "1") == "foo"
+        assert identity_cache.get_user_name(SYN, "1") == "foo"
+        assert patch_user.call_count == 2
@@ -0,0 +1,86 @@
+"""Test running interaction functions in a child process"""
+import importlib.util
+import os
+import sys
+import time
+
+import pytest
+
+from scoring_harness.exceptions import (
+    InvalidSubmission,
+    SubmissionMemoryError,
+    SubmissionTimeout,
+)
+from scoring_harness.isolation import _ClassReference, run_isolated
+
+
+def _score(submission, offset=0):
+    return {"valid": True, "annotations": {"pid": os.getpid()}, "offset": offset}
+
+
+def _fail(submission):
+    raise AssertionError("bad format")
+
+
+def _hang(submission):
+    time.sleep(60)
+
+
+def _allocate(submission):
+    return len(bytearray(512 * 1024**2))
+
+
+def _exit(submission):
+    os._exit(3)
+
+
+def _class_name(reference):
+    return reference.resolve().__qualname__
+
+
+def test_result():
+    """The value returned by the function is returned"""
+    result = run_isolated(_score, args=("sub",), kwargs={"offset": 2})
+    assert result["offset"] == 2
+    assert result["annotations"]["pid"] != os.getpid()
+
+
+def test_exception():
+    """Exceptions raised by the function are raised with their type"""
+    with pytest.raises(AssertionError, match="bad format"):
+        run_isolated(_fail, args=("sub",))
+
+
+def test_timeout():
+    """The child is killed once it runs past the timeout"""
+    start = time.monotonic()
+    with pytest.raises(SubmissionTimeout):
+        run_isolated(_hang, args=("sub",), timeout=0.5)
+    assert time.monotonic() - start < 10
+
+
+def test_memory_limit():
+    """Running out of memory raises SubmissionMemoryError"""
+    with pytest.raises(SubmissionMemoryError):
+        run_isolated(_allocate, args=("sub",), memory_limit=256 * 1024**2)
+
+
+def test_child_exits():
+    """A child that dies without a result makes the submission invalid"""
+    with pytest.raises(InvalidSubmission, match="code 3"):
+        run_isolated(_exit, args=("sub",))
+
+
+def test_class_of_configuration(tmpdir):
+    """Classes of configurations loaded from a file are found in the child"""
+    path = tmpdir.join("challenge.py")
+    path.write("class Score:\n    pass\n")
+    spec = importlib.util.spec_from_file_location("isolated_config", str(path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    try:
+        spec.loader.exec_module(module)
+        reference = _ClassReference(module.Score)
+        assert run_isolated(_class_name, args=(reference,)) == "Score"
+    finally:
+        del sys.modules[spec.name]
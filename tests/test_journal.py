@@ -0,0 +1,66 @@
+"""Test the processing journal"""
+from scoring_harness import journal
+from scoring_harness.exceptions import InvalidSubmission
+from scoring_harness.journal import ProcessingJournal
+
+SCOPE = "2:Validate"
+SUB_INFO = {
+    "valid": True,
+    "annotations": {"score": 0.5},
+    "error": None,
+    "message": "Passed",
+}
+
+
+def test_reopen(tmpdir):
+    """Stages are read back when the journal is opened again"""
+    path = str(tmpdir.join("journal"))
+    with ProcessingJournal(path) as processing:
+        processing.record(SCOPE, "1", journal.INTERACTED, SUB_INFO)
+        processing.record(SCOPE, "2", journal.INTERACTED, SUB_INFO)
+        processing.record(SCOPE, "2", journal.STORED)
+    with ProcessingJournal(path) as processing:
+        assert processing.get(SCOPE, "1") == (journal.INTERACTED, SUB_INFO)
+        assert processing.get(SCOPE, "2") == (journal.STORED, SUB_INFO)
+        assert processing.get("2:Score", "1") is None
+        assert processing.unacknowledged(SCOPE) == ["2"]
+
+
+def test_compaction(tmpdir):
+    """Notified submissions are dropped when the journal is opened"""
+    path = tmpdir.join("journal")
+    with ProcessingJournal(str(path)) as processing:
+        processing.record(SCOPE, "1", journal.INTERACTED, SUB_INFO)
+        processing.record(SCOPE, "1", journal.STORED)
+        processing.record(SCOPE, "1", journal.NOTIFIED)
+        processing.record(SCOPE, "2", journal.INTERACTED, SUB_INFO)
+        assert processing.get(SCOPE, "1") is None
+    ProcessingJournal(str(path)).close()
+    assert len(path.readlines()) == 1
+
+
+def test_torn_write(tmpdir):
+    """A partially written last entry is ignored"""
+    path = tmpdir.join("journal")
+    with ProcessingJournal(str(path)) as processing:
+        processing.record(SCOPE, "1", journal.INTERACTED, SUB_INFO)
+    path.write('{"scope": "2:Valid', mode="a")
+    with ProcessingJournal(str(path)) as processing:
+        assert processing.get(SCOPE, "1") == (journal.INTERACTED, SUB_INFO)
+
+
+def test_errors(tmpdir):
+    """Built-in exception types are kept, others become InvalidSubmission"""
+    path = str(tmpdir.join("journal"))
+    with ProcessingJournal(path) as processing:
+        processing.record(
+            SCOPE, "1", journal.INTERACTED, dict(SUB_INFO, error=AssertionError("bad"))
+        )
+        processing.record(
+            SCOPE, "2", journal.INTERACTED, dict(SUB_INFO, error=InvalidSubmission("x"))
+        )
+        _, info = processing.get(SCOPE, "1")
+        assert isinstance(info["error"], AssertionError)
+        assert str(info["error"]) == "bad"
+        _, info = processing.get(SCOPE, "2")
+        assert isinstance(info["error"], InvalidSubmission)
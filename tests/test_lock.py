@@ -0,0 +1,138 @@
+"""Test scoring harness locks"""
+from datetime import timedelta
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from scoring_harness import lock
+
+
+def test_acquire_lock_or_fail(tmp_path):
+    """Locks are created in the given directory and can't be taken twice"""
+    queue_lock = lock.acquire_lock_or_fail("challenge_1", directory=str(tmp_path))
+    assert (tmp_path / "challenge_1.lock").is_dir()
+    with pytest.raises(lock.LockedException, match="challenge_1"):
+        lock.acquire_lock_or_fail("challenge_1", directory=str(tmp_path))
+    # Locks of other queues are independent
+    other_lock = lock.acquire_lock_or_fail("challenge_2", directory=str(tmp_path))
+    queue_lock.release()
+    other_lock.release()
+    assert not (tmp_path / "challenge_1.lock").exists()
+
+
+def test_lease_lock_records_holder(tmp_path):
+    """The holder's pid and host are recorded and refreshed by a heartbeat"""
+    lease_lock = lock.acquire_lock_or_fail(
+        "challenge_1", directory=str(tmp_path), lease=timedelta(seconds=30)
+    )
+    assert isinstance(lease_lock, lock.LeaseLock)
+    assert lease_lock.get_holder()["pid"] == os.getpid()
+    assert lease_lock.get_holder()["host"] == socket.gethostname()
+    with pytest.raises(lock.LockedException):
+        lock.acquire_lock_or_fail(
+            "challenge_1", directory=str(tmp_path), lease=timedelta(seconds=30)
+        )
+    lease_lock.release()
+    assert not (tmp_path / "challenge_1.lock").exists()
+
+
+def test_lease_lock_heartbeat(tmp_path):
+    """The heartbeat keeps the lease from expiring"""
+    lease_lock = lock.LeaseLock(
+        "challenge_1",
+        directory=str(tmp_path),
+        lease=timedelta(seconds=0.5),
+        heartbeat_interval=timedelta(seconds=0.05),
+    )
+    assert lease_lock.acquire()
+    time.sleep(0.7)
+    other = lock.LeaseLock(
+        "challenge_1", directory=str(tmp_path), lease=timedelta(seconds=0.5)
+    )
+    assert not other.acquire()
+    lease_lock.release()
+
+
+def test_lease_lock_expired(tmp_path):
+    """A lock whose lease expired is broken"""
+    lock_dir = tmp_path / "challenge_1.lock"
+    lock_dir.mkdir()
+    holder = lock_dir / "holder.json"
+    holder.write_text(json.dumps({"pid": 1, "host": "elsewhere"}))
+    past = time.time() - 60
+    os.utime(holder, (past, past))
+    lease_lock = lock.LeaseLock(
+        "challenge_1", directory=str(tmp_path), lease=timedelta(seconds=30)
+    )
+    assert lease_lock.acquire()
+    assert lease_lock.get_holder()["pid"] == os.getpid()
+    lease_lock.release()
+
+
+def test_lease_lock_dead_holder(tmp_path):
+    """A lock held by a process that exited on this host is broken"""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    lock_dir = tmp_path / "challenge_1.lock"
+    lock_dir.mkdir()
+    (lock_dir / "holder.json").write_text(
+        json.dumps({"pid": process.pid, "host": socket.gethostname()})
+    )
+    lease_lock = lock.LeaseLock(
+        "challenge_1", directory=str(tmp_path), lease=timedelta(hours=1)
+    )
+    assert lease_lock.acquire()
+    lease_lock.release()
+
+
+def test_lease_lock_taken_while_breaking(tmp_path, monkeypatch):
+    """A lock that another process broke and took after it was judged
+    stale is put back instead of being broken again"""
+    lock_dir = tmp_path / "challenge_1.lock"
+    lock_dir.mkdir()
+    holder = lock_dir / "holder.json"
+    holder.write_text(json.dumps({"pid": 1, "host": "elsewhere"}))
+    past = time.time() - 60
+    os.utime(holder, (past, past))
+    lease_lock = lock.LeaseLock(
+        "challenge_1", directory=str(tmp_path), lease=timedelta(seconds=30)
+    )
+    holder_is_dead = lease_lock._holder_is_dead
+
+    def taken_meanwhile(state):
+        dead = holder_is_dead(state)
+        holder.write_text(json.dumps({"pid": 2, "host": "other"}))
+        return dead
+
+    monkeypatch.setattr(lease_lock, "_holder_is_dead", taken_meanwhile)
+    assert not lease_lock.acquire()
+    assert lease_lock.get_holder() == {"pid": 2, "host": "other"}
+    assert [path.name for path in tmp_path.iterdir()] == ["challenge_1.lock"]
+
+
+@pytest.mark.parametrize("heartbeat_interval", [0.05, 60])
+def test_lease_lock_lost_then_reacquired(tmp_path, heartbeat_interval):
+    """A lock that another process broke and took isn't removed on release,
+    whether or not the heartbeat noticed it first"""
+    lease_lock = lock.LeaseLock(
+        "challenge_1",
+        directory=str(tmp_path),
+        lease=timedelta(seconds=30),
+        heartbeat_interval=timedelta(seconds=heartbeat_interval),
+    )
+    assert lease_lock.acquire()
+    lock_dir = tmp_path / "challenge_1.lock"
+    other_holder = {"pid": 2, "host": "other", "acquired": time.time()}
+    (lock_dir / "holder.json").write_text(json.dumps(other_holder))
+    time.sleep(0.2)
+    assert lease_lock.lost == (heartbeat_interval < 1)
+    lease_lock.release()
+    assert lease_lock.lost
+    assert not lease_lock.held
+    assert lease_lock.get_holder() == other_holder
+    assert [path.name for path in tmp_path.iterdir()] == ["challenge_1.lock"]
@@ -0,0 +1,82 @@
+"""Test the harness metrics"""
+import json
+import urllib.request
+
+import pytest
+
+from scoring_harness import metrics
+from scoring_harness.metrics import HarnessMetrics
+
+
+def test_histogram():
+    """Values are counted in every bucket they fit in"""
+    histogram = metrics.Histogram(buckets=(1, 5))
+    for value in (0.5, 2, 10):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2]
+    assert histogram.count == 3
+    assert histogram.sum == 12.5
+    assert histogram.max == 10
+
+
+def test_time():
+    """Stages are timed even if they raise"""
+    harness_metrics = HarnessMetrics()
+    with pytest.raises(ValueError):
+        with harness_metrics.time("interact", queue="1"):
+            raise ValueError("test")
+    (stage,) = harness_metrics.summary()["stages"]
+    assert stage["stage"] == "interact"
+    assert stage["queue"] == "1"
+    assert stage["count"] == 1
+
+
+def test_timed_iter():
+    """Every item of an iterable is timed"""
+    harness_metrics = HarnessMetrics()
+    assert list(harness_metrics.timed_iter([1, 2], "get_bundles")) == [1, 2]
+    (stage,) = harness_metrics.summary()["stages"]
+    # Including the call that finds the end of the iterable
+    assert stage["count"] == 3
+
+
+def test_to_prometheus():
+    """Metrics are formatted in the Prometheus text format"""
+    harness_metrics = HarnessMetrics(buckets=(1,))
+    harness_metrics.observe("store", 0.5, queue="1")
+    harness_metrics.inc(metrics.PROCESSED, queue="1")
+    harness_metrics.inc(metrics.PROCESSED, queue="1")
+    harness_metrics.set_gauge(metrics.QUEUE_DEPTH, 4, queue='a"b')
+    text = harness_metrics.to_prometheus()
+    assert "# TYPE harness_stage_seconds histogram" in text
+    assert 'harness_stage_seconds_bucket{queue="1",stage="store",le="1"} 1' in text
+    assert 'harness_stage_seconds_bucket{queue="1",stage="store",le="+Inf"} 1' in text
+    assert 'harness_stage_seconds_count{queue="1",stage="store"} 1' in text
+    assert 'harness_submissions_processed_total{queue="1"} 2' in text
+    assert 'harness_queue_depth{queue="a\\"b"} 4' in text
+
+
+def test_write(tmpdir):
+    """Metrics are written as Prometheus text and a JSON summary"""
+    harness_metrics = HarnessMetrics()
+    harness_metrics.inc(metrics.ERRORS, queue="1")
+    prometheus_path = tmpdir.join("metrics.prom")
+    summary_path = tmpdir.join("summary.json")
+    harness_metrics.write_prometheus(str(prometheus_path))
+    harness_metrics.write_summary(str(summary_path))
+    assert prometheus_path.read() == harness_metrics.to_prometheus()
+    assert json.loads(summary_path.read())["counters"] == [
+        {"queue": "1", "name": metrics.ERRORS, "value": 1}
+    ]
+
+
+def test_serve():
+    """Metrics are served over HTTP"""
+    harness_metrics = HarnessMetrics()
+    harness_metrics.inc(metrics.PROCESSED, queue="1")
+    port = harness_metrics.serve(0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.read().decode() == harness_metrics.to_prometheus()
+    finally:
+        harness_metrics.close()
@@ -0,0 +1,150 @@
+"""Test the background message outbox"""
+import threading
+from unittest import mock
+from unittest.mock import Mock
+
+import synapseclient
+
+from scoring_harness import messages
+from scoring_harness.outbox import MessageOutbox
+
+
+def _syn(side_effect=None):
+    syn = mock.create_autospec(synapseclient.Synapse)
+    syn.sendMessage.side_effect = side_effect
+    return syn
+
+
+def test_same_body_sent_once():
+    """Queued messages with the same subject and body are merged"""
+    syn = _syn()
+    outbox = MessageOutbox(syn)
+    outbox.enqueue(["1"], "subject", "body")
+    outbox.enqueue(["2", "1"], "subject", "body")
+    outbox.enqueue(["3"], "subject", "other")
+    outbox.start()
+    outbox.close()
+    assert syn.sendMessage.call_count == 2
+    syn.sendMessage.assert_any_call(
+        userIds=["1", "2"],
+        messageSubject="subject",
+        messageBody="body",
+        contentType="text/html",
+    )
+    syn.sendMessage.assert_any_call(
+        userIds=["3"],
+        messageSubject="subject",
+        messageBody="other",
+        contentType="text/html",
+    )
+
+
+def test_enqueue_does_not_wait():
+    """Enqueuing returns while the sender is busy"""
+    release = threading.Event()
+    syn = _syn(side_effect=lambda **kwargs: release.wait())
+    outbox = MessageOutbox(syn, max_workers=1)
+    outbox.start()
+    outbox.enqueue(["1"], "subject", "first")
+    outbox.enqueue(["2"], "subject", "second")
+    outbox.enqueue(["3"], "subject", "second")
+    assert outbox.pending() == 3
+    release.set()
+    outbox.close()
+    # Both "second" messages were queued while the sender was busy
+    assert syn.sendMessage.call_count == 2
+
+
+def test_retry_then_send():
+    """Messages that fail to send are retried"""
+    syn = _syn(side_effect=[Exception("timeout"), {"id": "1"}])
+    outbox = MessageOutbox(syn, wait=0)
+    outbox.enqueue(["1"], "subject", "body")
+    outbox.start()
+    outbox.close()
+    assert syn.sendMessage.call_count == 2
+
+
+def test_give_up(tmpdir):
+    """Messages are given up on after the number of retries"""
+    path = str(tmpdir.join("outbox.db"))
+    syn = _syn(side_effect=Exception("timeout"))
+    outbox = MessageOutbox(syn, path=path, retries=3, wait=0)
+    outbox.enqueue(["1"], "subject", "body")
+    outbox.start()
+    outbox.close()
+    assert syn.sendMessage.call_count == 3
+    outbox = MessageOutbox(syn, path=path)
+    assert outbox.pending() == 0
+    outbox.close()
+
+
+def test_when_sent():
+    """Callbacks are called once their messages are sent, and never for
+    messages that are given up on"""
+    syn = _syn(side_effect=[{"id": "1"}, Exception("down")])
+    outbox = MessageOutbox(syn, max_workers=1, retries=1, wait=0)
+    sent, given_up = Mock(), Mock()
+    with outbox.capture() as messageids:
+        outbox.enqueue(["1"], "subject", "first")
+    outbox.when_sent(messageids, sent)
+    outbox.when_sent([outbox.enqueue(["2"], "subject", "second")], given_up)
+    sent.assert_not_called()
+    outbox.start()
+    outbox.close()
+    sent.assert_called_once_with()
+    given_up.assert_not_called()
+    assert not outbox.durable
+
+
+def test_failed_messages_purged(tmpdir, caplog):
+    """Messages that were given up on are logged and removed"""
+    path = str(tmpdir.join("outbox.db"))
+    outbox = MessageOutbox(_syn(side_effect=Exception("down")), path=path, retries=1)
+    outbox.enqueue(["1"], "subject", "body")
+    outbox.start()
+    outbox.close()
+    assert "'subject' to ['1'] was not sent after 1 attempts" in caplog.text
+    outbox = MessageOutbox(_syn(), path=path)
+    assert outbox.failed_messages() == []
+    assert outbox.pending() == 0
+    outbox.close()
+
+
+def test_queue_survives_restart(tmpdir):
+    """Messages left in the queue are sent the next time"""
+    path = str(tmpdir.join("outbox.db"))
+    outbox = MessageOutbox(_syn(), path=path)
+    outbox.enqueue(["1"], "subject", "body")
+    outbox.close()
+    syn = _syn()
+    outbox = MessageOutbox(syn, path=path)
+    assert outbox.pending() == 1
+    outbox.start()
+    outbox.close()
+    syn.sendMessage.assert_called_once_with(
+        userIds=["1"],
+        messageSubject="subject",
+        messageBody="body",
+        contentType="text/html",
+    )
+
+
+def test_send_message_enqueues():
+    """send_message queues the rendered message in the outbox"""
+    syn = _syn()
+    outbox = Mock()
+    response = messages.send_message(
+        syn,
+        userids=["1"],
+        subject_template="Hi {username}",
+        message_template="Hello {username}",
+        dry_run=False,
+        kwargs={"username": "foo"},
+        outbox=outbox,
+    )
+    assert response is None
+    outbox.enqueue.assert_called_once_with(
+        ["1"], "Hi foo", "Hello foo", content_type="text/html"
+    )
+    syn.sendMessage.assert_not_called()
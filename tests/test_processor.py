@@ -2,16 +2,24 @@
 Test scoring harness functions
 """
 # pylint: disable=redefined-outer-name
+import contextlib
 import copy
 import os
+import time
 from unittest import mock
 from unittest.mock import patch
 
 import pytest
 import synapseclient
+from synapseclient.core.credentials.cred_data import SynapseAuthTokenCredentials
 
 import scoring_harness.base_processor
 from scoring_harness.base_processor import EvaluationQueueProcessor
+from scoring_harness import journal
+from scoring_harness.exceptions import SubmissionTimeout
+from scoring_harness.file_cache import SubmissionFileCache
+from scoring_harness.journal import ProcessingJournal
+from scoring_harness.outbox import MessageOutbox
 
 SYN = mock.create_autospec(synapseclient.Synapse)
 ANNOTATIONS = {"foo": "bar"}
@@ -261,6 +269,38 @@ def test_removecache_call(processor):
         patch_notify.assert_called_once_with(SUBMISSION, SUB_INFO)
 
 
+def test_removecache_downloaded_call(processor):
+    """The file downloaded to interact with a submission is removed when
+    it wasn't prefetched"""
+    processor.remove_cache = True
+    submission = synapseclient.Submission(
+        name="foo",
+        entityId="syn123",
+        evaluationId=2,
+        versionNumber=1,
+        id="syn222",
+        userId="222",
+    )
+    downloaded = copy.deepcopy(submission)
+    downloaded["entity"] = {"id": "syn123"}
+    downloaded["filePath"] = "downloaded"
+    with patch.object(
+        SYN, "getSubmissionBundles", return_value=[(submission, SUBMISSION_STATUS)]
+    ), patch.object(SYN, "getSubmission", return_value=downloaded), patch.object(
+        processor, "interaction_func", return_value=SUB_INFO
+    ) as patch_interact, patch.object(
+        processor, "store_submission_status"
+    ), patch.object(
+        scoring_harness.base_processor, "_remove_cached_submission"
+    ) as patch_remove, patch.object(
+        processor, "notify"
+    ):
+        processor()
+        patch_interact.assert_called_once_with(downloaded)
+        patch_remove.assert_called_once_with("downloaded")
+    assert processor._downloaded_paths == {}
+
+
 def test_dryrun_call(processor):
     """Test dryrun call
     - get bundles
@@ -293,3 +333,371 @@ def test_file_remove_cached_submission(valid_input):
     with patch.object(os, "unlink") as patch_unlink:
         scoring_harness.base_processor._remove_cached_submission(valid_input)
         patch_unlink.assert_called_once_with(valid_input)
+
+
+def test_concurrent_call(processor):
+    """Test call with a pool of workers processes every submission"""
+    processor.max_workers = 4
+    submission2 = copy.deepcopy(SUBMISSION)
+    submission2.id = "syn333"
+    bundle = [(SUBMISSION, SUBMISSION_STATUS), (submission2, SUBMISSION_STATUS)]
+    with patch.object(
+        SYN, "getSubmissionBundles", return_value=bundle
+    ) as patch_get_bundles, patch.object(
+        processor, "interact_with_submission", return_value=SUB_INFO
+    ) as patch_interact, patch.object(
+        processor, "store_submission_status"
+    ) as patch_store, patch.object(
+        processor, "notify"
+    ) as patch_notify:
+        processor()
+        patch_get_bundles.assert_called_once_with(EVALUATION, status="RECEIVED")
+        assert patch_interact.call_count == 2
+        patch_interact.assert_any_call(submission2)
+        assert patch_store.call_count == 2
+        patch_notify.assert_any_call(SUBMISSION, SUB_INFO)
+        patch_notify.assert_any_call(submission2, SUB_INFO)
+
+
+def test_concurrent_call_bounded(processor):
+    """Only about max_workers submissions are taken from Synapse ahead of
+    those that were processed"""
+    processor.max_workers = 2
+    notified = []
+    in_flight = []
+
+    def bundles(*args, **kwargs):
+        for subid in range(6):
+            submission = copy.deepcopy(SUBMISSION)
+            submission.id = str(subid)
+            in_flight.append(subid + 1 - len(notified))
+            yield submission, SUBMISSION_STATUS
+
+    with patch.object(SYN, "getSubmissionBundles", side_effect=bundles), patch.object(
+        processor, "interact_with_submission", return_value=SUB_INFO
+    ), patch.object(processor, "store_submission_status"), patch.object(
+        processor, "notify", side_effect=lambda *args: notified.append(args)
+    ):
+        processor()
+    assert len(notified) == 6
+    assert max(in_flight) <= 2
+
+
+def test_concurrent_call_raises(processor):
+    """Errors raised while processing a submission are not swallowed"""
+    processor.max_workers = 2
+    with patch.object(SYN, "getSubmissionBundles", return_value=BUNDLE), patch.object(
+        processor, "interact_with_submission", return_value=SUB_INFO
+    ), patch.object(
+        processor, "store_submission_status", side_effect=ValueError("store")
+    ), pytest.raises(
+        ValueError, match="store"
+    ):
+        processor()
+
+
+def test_downloaded_interact_with_submission(processor):
+    """Submissions that were already downloaded aren't fetched again"""
+    submission = copy.deepcopy(SUBMISSION)
+    submission["entity"] = {"id": "syn123"}
+    with patch.object(SYN, "getSubmission") as patch_get_sub, patch.object(
+        processor, "interaction_func", return_value=SUB_INFO
+    ) as patch_interact:
+        processor.interact_with_submission(submission)
+        patch_get_sub.assert_not_called()
+        patch_interact.assert_called_once_with(submission)
+
+
+def test_prefetch_call(processor):
+    """Test call downloads submissions ahead and processes them in order"""
+    processor.prefetch = 2
+    submissions = []
+    for subid in ["1", "2", "3"]:
+        submission = copy.deepcopy(SUBMISSION)
+        submission.id = subid
+        submissions.append(submission)
+    bundle = [(submission, SUBMISSION_STATUS) for submission in submissions]
+    downloaded = {}
+    for submission in submissions:
+        downloaded[submission.id] = copy.deepcopy(submission)
+        downloaded[submission.id]["entity"] = {"id": "syn123"}
+    with patch.object(SYN, "getSubmissionBundles", return_value=bundle), patch.object(
+        SYN, "getSubmission", side_effect=lambda sub: downloaded[sub.id]
+    ) as patch_get_sub, patch.object(
+        processor, "interact_with_submission", return_value=SUB_INFO
+    ) as patch_interact, patch.object(
+        processor, "store_submission_status"
+    ), patch.object(
+        processor, "notify"
+    ):
+        processor()
+        assert patch_get_sub.call_count == 3
+        assert patch_interact.call_args_list == [
+            mock.call(downloaded[subid]) for subid in ["1", "2", "3"]
+        ]
+
+
+def test_batched_call(processor):
+    """Statuses are stored in batches and submitters are notified after"""
+    processor.status_batch_size = 10
+    status = synapseclient.SubmissionStatus(status="RECEIVED", id="111", etag="222")
+    with patch.object(
+        SYN, "getSubmissionBundles", return_value=[(SUBMISSION, status)]
+    ), patch.object(
+        processor, "interact_with_submission", return_value=SUB_INFO
+    ), patch.object(
+        scoring_harness.base_processor,
+        "update_single_submission_status",
+        return_value=status,
+    ), patch.object(
+        SYN, "restPUT", return_value={}
+    ) as patch_put, patch.object(
+        SYN, "store"
+    ) as patch_store, patch.object(
+        processor, "notify"
+    ) as patch_notify:
+        processor()
+        patch_store.assert_not_called()
+        patch_put.assert_called_once()
+        assert patch_put.call_args[0][0] == "/evaluation/222/statusBatch"
+        patch_notify.assert_called_once_with(SUBMISSION, SUB_INFO)
+
+
+def test_metrics_batched_call(processor):
+    """Batched statuses are timed once per flush, apart from notifying"""
+    processor.status_batch_size = 2
+    bundles = [
+        (
+            synapseclient.Submission(
+                name="foo",
+                entityId="syn123",
+                evaluationId=2,
+                versionNumber=1,
+                id=subid,
+                userId="1",
+            ),
+            synapseclient.SubmissionStatus(status="RECEIVED", id=subid, etag="222"),
+        )
+        for subid in ["111", "112", "113"]
+    ]
+    timing = []
+    time_stage = processor.metrics.time
+
+    @contextlib.contextmanager
+    def track(stage, **labels):
+        timing.append(stage)
+        try:
+            with time_stage(stage, **labels):
+                yield
+        finally:
+            timing.remove(stage)
+
+    def notify(submission, submission_info):
+        assert "store" not in timing
+
+    with patch.object(SYN, "getSubmissionBundles", return_value=bundles), patch.object(
+        processor, "interact_with_submission", return_value=SUB_INFO
+    ), patch.object(SYN, "restPUT", return_value={}) as patch_put, patch.object(
+        processor, "notify", side_effect=notify
+    ):
+        processor()
+    assert patch_put.call_count == 2
+    summary = processor.metrics.summary()
+    counts = {stage["stage"]: stage["count"] for stage in summary["stages"]}
+    assert counts["store"] == 2
+    assert counts["notify"] == 3
+
+
+class SlowProcessor(Processor):
+    """Processor whose interaction runs past the timeout"""
+
+    def interaction_func(self, submission, **kwargs):
+        time.sleep(10)
+
+
+class ChildProcessor(Processor):
+    """Processor that reports what its interaction sees"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = 0.5
+
+    def interaction_func(self, submission, **kwargs):
+        return {
+            "valid": True,
+            "annotations": {
+                "pid": os.getpid(),
+                "threshold": self.threshold,
+                "endpoint": self.syn.repoEndpoint,
+                "username": self.syn.credentials.username,
+                **kwargs,
+            },
+            "message": self.evaluation.name,
+        }
+
+
+def _isolated_processor(processor_class, **kwargs):
+    """Isolated processor with a Synapse client that can be copied to the
+    child process"""
+    syn = synapseclient.Synapse(skip_checks=True, repoEndpoint="http://repo")
+    syn.credentials = SynapseAuthTokenCredentials("token", username="admin")
+    with patch.object(syn, "getEvaluation", return_value=EVALUATION):
+        return processor_class(
+            syn, EVALUATION, admin_user_ids=["1"], isolate=True, **kwargs
+        )
+
+
+def test_isolated_interact_with_submission():
+    """Isolated submissions run in a child process with its own Synapse
+    client"""
+    submission = copy.deepcopy(SUBMISSION)
+    submission["entity"] = {"id": "syn123"}
+    processor = _isolated_processor(ChildProcessor, goldstandard="gold")
+    submission_info = processor.interact_with_submission(submission)
+    annotations = submission_info["annotations"]
+    assert annotations["pid"] != os.getpid()
+    assert annotations["endpoint"] == "http://repo"
+    assert annotations["username"] == "admin"
+    assert annotations["goldstandard"] == "gold"
+    assert annotations["threshold"] == 0.5
+    assert submission_info["message"] == EVALUATION.name
+
+
+def test_isolated_timeout_interact_with_submission():
+    """Isolated submissions that run past the timeout are invalid"""
+    submission = copy.deepcopy(SUBMISSION)
+    submission["entity"] = {"id": "syn123"}
+    processor = _isolated_processor(SlowProcessor, timeout=0.5)
+    submission_info = processor.interact_with_submission(submission)
+    assert not submission_info["valid"]
+    assert isinstance(submission_info["error"], SubmissionTimeout)
+    assert submission_info["annotations"] == {}
+
+
+def test_journaled_call(processor, tmpdir):
+    """Results that weren't stored before a crash aren't recomputed"""
+    processor.journal = ProcessingJournal(str(tmpdir.join("journal")))
+    processor.journal.record(
+        processor._journal_scope, SUBMISSION.id, journal.INTERACTED, SUB_INFO
+    )
+    with patch.object(SYN, "getSubmissionBundles", return_value=BUNDLE), patch.object(
+        processor, "interact_with_submission"
+    ) as patch_interact, patch.object(
+        processor, "store_submission_status"
+    ) as patch_store, patch.object(
+        processor, "notify"
+    ) as patch_notify:
+        processor()
+        patch_interact.assert_not_called()
+        patch_store.assert_called_once_with(SUBMISSION_STATUS, SUB_INFO)
+        patch_notify.assert_called_once_with(SUBMISSION, SUB_INFO)
+    assert processor.journal.get(processor._journal_scope, SUBMISSION.id) is None
+
+
+def test_journaled_resend_notifications(processor, tmpdir):
+    """Notifications that weren't sent before a crash are resent"""
+    processor.journal = ProcessingJournal(str(tmpdir.join("journal")))
+    processor.journal.record(
+        processor._journal_scope, SUBMISSION.id, journal.INTERACTED, SUB_INFO
+    )
+    processor.journal.record(processor._journal_scope, SUBMISSION.id, journal.STORED)
+    with patch.object(SYN, "getSubmissionBundles", return_value=[]), patch.object(
+        SYN, "getSubmission", return_value=SUBMISSION
+    ), patch.object(processor, "notify") as patch_notify:
+        processor()
+        patch_notify.assert_called_once_with(SUBMISSION, SUB_INFO)
+    assert processor.journal.unacknowledged(processor._journal_scope) == []
+
+
+def test_journaled_notified_once_sent(processor, tmpdir):
+    """Submissions notified through an in-memory outbox are journaled as
+    notified once their messages are sent"""
+    processor.journal = ProcessingJournal(str(tmpdir.join("journal")))
+    processor.outbox = MessageOutbox(SYN)
+
+    def notify(submission, submission_info):
+        processor.outbox.enqueue(["1"], "subject", "body")
+
+    with patch.object(SYN, "getSubmissionBundles", return_value=BUNDLE), patch.object(
+        processor, "interact_with_submission", return_value=SUB_INFO
+    ), patch.object(processor, "store_submission_status"), patch.object(
+        processor, "notify", side_effect=notify
+    ), patch.object(
+        SYN, "sendMessage"
+    ):
+        processor()
+        assert processor.journal.unacknowledged(processor._journal_scope) == [
+            SUBMISSION.id
+        ]
+        processor.outbox.start()
+        processor.outbox.close()
+    assert processor.journal.get(processor._journal_scope, SUBMISSION.id) is None
+
+
+def test_metrics_call(processor):
+    """Stages, processed and invalid submissions are recorded"""
+    invalid_info = dict(SUB_INFO, valid=False)
+    with patch.object(SYN, "getSubmissionBundles", return_value=BUNDLE), patch.object(
+        processor, "interact_with_submission", return_value=invalid_info
+    ), patch.object(SYN, "store"), patch.object(processor, "notify"):
+        processor()
+    summary = processor.metrics.summary()
+    stages = {stage["stage"]: stage["count"] for stage in summary["stages"]}
+    assert stages == {"get_bundles": 2, "store": 1, "notify": 1}
+    counters = {counter["name"]: counter["value"] for counter in summary["counters"]}
+    assert counters == {
+        "harness_submissions_processed_total": 1,
+        "harness_submissions_invalid_total": 1,
+    }
+    (gauge,) = summary["gauges"]
+    assert gauge["value"] == 1
+
+
+def test_submitter_fairness_call(processor):
+    """Submitters take turns"""
+    bundles = [
+        (
+            synapseclient.Submission(
+                name="foo",
+                entityId="syn123",
+                evaluationId=2,
+                versionNumber=1,
+                id=subid,
+                userId=userid,
+            ),
+            SUBMISSION_STATUS,
+        )
+        for subid, userid in [("1", "a"), ("2", "a"), ("3", "b")]
+    ]
+    processor.submitter_fairness = True
+    with patch.object(SYN, "getSubmissionBundles", return_value=bundles), patch.object(
+        processor, "process_submission"
+    ) as patch_process:
+        assert processor() == 3
+    order = [call.args[0].id for call in patch_process.call_args_list]
+    assert order == ["1", "3", "2"]
+
+
+def test_file_cache_interact_with_submission(processor, tmpdir):
+    """Submissions are downloaded to the file cache and pinned while they
+    are processed"""
+    processor.file_cache = SubmissionFileCache(str(tmpdir), max_bytes=0)
+
+    def interact(submission):
+        assert processor.file_cache._pins == {"syn222": 1}
+        return SUB_INFO
+
+    with patch.object(
+        SYN, "getSubmission", return_value=SUBMISSION
+    ) as patch_get_sub, patch.object(
+        processor, "interaction_func", side_effect=interact
+    ), patch.object(
+        processor, "store_submission_status"
+    ), patch.object(
+        processor, "notify"
+    ):
+        processor.process_submission(SUBMISSION, SUBMISSION_STATUS)
+        patch_get_sub.assert_called_once_with(
+            SUBMISSION, downloadLocation=str(tmpdir.join("syn222"))
+        )
+    assert processor.file_cache._pins == {}
@@ -0,0 +1,103 @@
+"""Test the evaluation queue query cache"""
+# pylint: disable=redefined-outer-name
+from datetime import timedelta
+from unittest import mock
+from unittest.mock import patch
+
+import pytest
+import synapseclient
+
+from benchmarks.fake_synapse import FakeSynapseServer, seed
+from challengeutils import utils
+from challengeutils.query_cache import CachedQuery, QueryCache
+
+SYN = mock.create_autospec(synapseclient.Synapse)
+
+
+@pytest.fixture
+def queue():
+    """Fake Synapse with a queue of 5 submissions"""
+    with FakeSynapseServer() as server:
+        evaluationid = seed(server.synapse, submissions=5)["evaluations"][0]
+        yield server, server.client(), evaluationid
+
+
+def test_cached_query():
+    """Queries are normalized and modifiedOn is fetched to revalidate"""
+    query = CachedQuery(
+        "SELECT objectId,status FROM evaluation_1   where status == 'SCORED'"
+    )
+    assert query.key == (
+        "select objectId, status from evaluation_1 where status == 'SCORED'"
+    )
+    assert query.fetch_columns == ["objectId", "status", "modifiedOn"]
+    with pytest.raises(ValueError, match="Can't cache query"):
+        CachedQuery("select * from submissions")
+    for uri in (
+        "select * from evaluation_1 where status == 'SCORED' limit 10",
+        "select * from evaluation_1 limit 10",
+        "select * from evaluation_1 order by createdOn",
+    ):
+        with pytest.raises(ValueError, match="Can't cache query"):
+            CachedQuery(uri)
+    assert CachedQuery("select * from evaluation_1 where name == 'limit'").where == (
+        "name == 'limit'"
+    )
+
+
+def test_uncacheable_query_is_run(tmpdir):
+    """Queries that can't be cached are run without the cache"""
+    cache = QueryCache(str(tmpdir / "cache.sqlite"))
+    uri = "select objectId from evaluation_1 order by createdOn"
+    with patch.object(
+        utils, "evaluation_queue_query", return_value=iter([{"objectId": ["1"]}])
+    ) as patch_query:
+        assert list(cache.query(SYN, uri)) == [{"objectId": "1"}]
+        patch_query.assert_called_once_with(SYN, uri, limit=None, columnar=True)
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_unchanged_results_are_cached(queue, tmpdir):
+    """Unchanged results are served from the cache after two probes"""
+    server, syn, evaluationid = queue
+    cache = QueryCache(str(tmpdir / "cache.sqlite"))
+    uri = f"select objectId from evaluation_{evaluationid}"
+    rows = list(cache.query(syn, uri))
+    assert len(rows) == 5
+    assert list(rows[0]) == ["objectId"]
+    server.requests.clear()
+    assert list(cache.query(syn, uri)) == rows
+    assert server.requests["evaluation_query"] == 2
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_modified_results_are_fetched(queue, tmpdir):
+    """Results are fetched again once a submission is modified"""
+    _, syn, evaluationid = queue
+    cache = QueryCache(str(tmpdir / "cache.sqlite"))
+    uri = f"select objectId, status from evaluation_{evaluationid}"
+    list(cache.query(syn, uri))
+    _, status = next(syn.getSubmissionBundles(evaluationid))
+    status.status = "SCORED"
+    syn.store(status)
+    rows = list(cache.query(syn, uri))
+    assert cache.misses == 2
+    assert sum(row["status"] == "SCORED" for row in rows) == 1
+
+
+def test_expired_results_are_fetched(queue, tmpdir):
+    """Results older than the time to live aren't revalidated"""
+    _, syn, evaluationid = queue
+    cache = QueryCache(str(tmpdir / "cache.sqlite"), ttl=timedelta(seconds=-1))
+    uri = f"select * from evaluation_{evaluationid}"
+    list(cache.query(syn, uri))
+    list(cache.query(syn, uri))
+    assert cache.misses == 2
+
+
+def test_size_limit(queue, tmpdir):
+    """The least recently used results are removed past the size limit"""
+    _, syn, evaluationid = queue
+    cache = QueryCache(str(tmpdir / "cache.sqlite"), max_size=0)
+    list(cache.query(syn, f"select * from evaluation_{evaluationid}"))
+    assert cache._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0] == 0
@@ -0,0 +1,139 @@
+"""Test streaming evaluation queue query output"""
+import io
+import json
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from challengeutils import query_output
+from challengeutils.query_output import PageTyper
+
+
+def _pages():
+    return [
+        {
+            "objectId": ["1", "2"],
+            "createdOn": ["1600000000000", "1600000001000"],
+            "score": ["0.5", "1"],
+        },
+        {"objectId": ["3"], "createdOn": ["1600000002000"], "score": ["0.25"]},
+    ]
+
+
+def test_page_typer():
+    """Columns are typed from the first page they are in"""
+    typer = PageTyper()
+    frames = [typer(page) for page in _pages()]
+    assert typer.dtypes == {
+        "objectId": "string",
+        "createdOn": "Int64",
+        "score": "float64",
+    }
+    assert frames[1]["score"].tolist() == [0.25]
+    assert frames[1]["createdOn"].tolist() == [1600000002000]
+
+
+def test_page_typer_new_column():
+    """A column missing from a page is empty in it"""
+    typer = PageTyper()
+    typer({"objectId": ["1"], "score": ["1"]})
+    frame = typer({"objectId": ["2"]})
+    assert frame["score"].isna().all()
+
+
+def test_page_typer_widens_to_text():
+    """A numeric column with text in a later page becomes text"""
+    typer = PageTyper()
+    typer({"objectId": ["1"], "score": ["1"]})
+    frame = typer({"objectId": ["2"], "score": ["n/a"]})
+    assert typer.dtypes["score"] == "string"
+    assert frame["score"].tolist() == ["n/a"]
+
+
+def test_stream_csv_has_every_column(tmpdir):
+    """Spooled columns that first appear in a later page are written, and
+    their values keep the type of every page"""
+    pages = _pages() + [{"objectId": ["4"], "score": ["n/a"], "team": ["a"]}]
+    path = str(tmpdir / "query.csv")
+    with patch.object(
+        query_output.utils, "evaluation_queue_query", return_value=iter(pages)
+    ):
+        rows = query_output.stream_query(
+            None, "select * from evaluation_1", path=path, spool=True
+        )
+    assert rows == 4
+    written = pd.read_csv(path, dtype=str, keep_default_na=False)
+    assert list(written.columns) == ["objectId", "createdOn", "score", "team"]
+    assert written["score"].tolist() == ["0.5", "1", "0.25", "n/a"]
+    assert written["team"].tolist()[-1] == "a"
+
+
+def test_stream_csv_as_pages_arrive():
+    """Pages are written before the next one is fetched, and a page that
+    adds a column stops the query"""
+    output = io.StringIO()
+
+    def pages():
+        yield _pages()[0]
+        assert output.getvalue(), "the first page wasn't written"
+        yield {"objectId": ["3"], "team": ["a"]}
+
+    with patch.object(
+        query_output.utils, "evaluation_queue_query", return_value=pages()
+    ), patch.object(query_output.sys, "stdout", output), pytest.raises(
+        ValueError, match="Spool the pages"
+    ):
+        query_output.stream_query(None, "select * from evaluation_1")
+
+
+def test_write_csv_different_columns():
+    """Pages with different columns aren't silently cut down"""
+    frames = [pd.DataFrame({"a": [1]}), pd.DataFrame({"a": [2], "b": [3]})]
+    with pytest.raises(ValueError, match="same columns"):
+        query_output.write_query(frames, query_output.CSV, None)
+
+
+def test_write_csv(tmpdir):
+    """The header is written once"""
+    typer = PageTyper()
+    path = str(tmpdir / "query.csv")
+    rows = query_output.write_query(
+        (typer(page) for page in _pages()), query_output.CSV, path
+    )
+    assert rows == 3
+    written = pd.read_csv(path)
+    assert written["createdOn"].tolist() == [
+        1600000000000,
+        1600000001000,
+        1600000002000,
+    ]
+
+
+def test_write_jsonl(tmpdir):
+    """Each row is a line with typed values"""
+    typer = PageTyper()
+    path = str(tmpdir / "query.jsonl")
+    query_output.write_query((typer(page) for page in _pages()), "jsonl", path)
+    with open(path) as jsonl:
+        rows = [json.loads(line) for line in jsonl]
+    assert rows[0] == {"objectId": "1", "createdOn": 1600000000000, "score": 0.5}
+    assert len(rows) == 3
+
+
+def test_write_parquet(tmpdir):
+    """Pages are written as row groups of one Parquet file"""
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    typer = PageTyper()
+    path = str(tmpdir / "query.parquet")
+    query_output.write_query((typer(page) for page in _pages()), "parquet", path)
+    table = pyarrow_parquet.read_table(path)
+    assert table.num_rows == 3
+    assert str(table.schema.field("createdOn").type) == "int64"
+
+
+def test_format_from_path():
+    """The output format is given by the extension of the output file"""
+    assert query_output.format_from_path("leaderboard.parquet") == "parquet"
+    assert query_output.format_from_path("leaderboard.jsonl") == "jsonl"
+    assert query_output.format_from_path(None) == "csv"
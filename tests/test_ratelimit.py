@@ -0,0 +1,130 @@
+"""
+Test rate limiting Synapse requests
+"""
+import io
+from unittest.mock import Mock
+
+import pytest
+import requests
+import synapseclient
+
+from benchmarks.fake_synapse import FakeSynapseServer, seed
+from challengeutils import ratelimit
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _request(method, url):
+    return requests.Request(method, url).prepare()
+
+
+def _response(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response.raw = io.BytesIO()
+    return response
+
+
+def test_token_bucket():
+    """Tokens are handed out up to the burst, then at the rate"""
+    clock = _Clock()
+    bucket = ratelimit.TokenBucket(2, clock=clock)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    clock.now = 0.5
+    assert bucket.reserve() == 0
+
+
+def test_token_bucket_throttle():
+    """Throttling pauses the bucket and halves its rate, which recovers
+    as requests succeed"""
+    clock = _Clock()
+    bucket = ratelimit.TokenBucket(10, clock=clock)
+    bucket.throttle(3)
+    assert bucket.rate == 5
+    assert bucket.reserve() == pytest.approx(3)
+    clock.now = 3.2
+    assert bucket.reserve() == 0
+    for _ in range(20):
+        bucket.succeed()
+    assert bucket.rate == 10
+
+
+@pytest.mark.parametrize(
+    "method,url,expected",
+    [
+        ("GET", "https://repo-prod.prod.sagebase.org/repo/v1/entity/syn1", "read"),
+        ("PUT", "https://repo-prod.prod.sagebase.org/repo/v1/entity/syn1", "write"),
+        (
+            "GET",
+            "https://repo-prod.prod.sagebase.org/repo/v1/evaluation/submission/"
+            "query?query=select+*+from+evaluation_1",
+            "query",
+        ),
+        (
+            "POST",
+            "https://repo-prod.prod.sagebase.org/file/v1/fileHandle/batch",
+            "file",
+        ),
+    ],
+)
+def test_classify(method, url, expected):
+    """Requests are classified by method and endpoint"""
+    assert ratelimit.RateLimiter.classify(_request(method, url)) == expected
+
+
+def test_send_retries_after_retry_after():
+    """Throttled requests are retried after the Retry-After time"""
+    limiter = ratelimit.RateLimiter()
+    send = Mock(side_effect=[_response(429, {"Retry-After": "0.01"}), _response(200)])
+    request = _request("GET", "https://repo-prod.prod.sagebase.org/repo/v1/entity/1")
+    response = limiter.send(request, send)
+    assert response.status_code == 200
+    assert send.call_count == 2
+    assert limiter.buckets["read"].throttled == 1
+
+
+def test_send_doesnt_replay_unavailable_writes():
+    """POST and PUT requests aren't retried after a 503"""
+    limiter = ratelimit.RateLimiter()
+    send = Mock(side_effect=[_response(503, {"Retry-After": "0.01"}), _response(200)])
+    request = _request("POST", "https://repo-prod.prod.sagebase.org/repo/v1/entity")
+    assert limiter.send(request, send).status_code == 503
+    assert send.call_count == 1
+    assert limiter.buckets["write"].throttled == 1
+
+
+def test_only_budgeted_classes_are_limited():
+    """Without defaults, classes missing from the budgets aren't limited"""
+    limiter = ratelimit.RateLimiter({"write": 5}, defaults=False)
+    assert set(limiter.buckets) == {"write"}
+    send = Mock(return_value=_response(429))
+    request = _request("GET", "https://repo-prod.prod.sagebase.org/repo/v1/entity/1")
+    assert limiter.send(request, send).status_code == 429
+    assert send.call_count == 1
+
+
+def test_client_within_throttle(tmpdir):
+    """A client sharing a limiter gets every response from a server that
+    throttles it, and requests to the server are limited"""
+    with FakeSynapseServer(throttle=20) as server:
+        evaluationid = seed(server.synapse, submissions=30)["evaluations"][0]
+        syn = synapseclient.Synapse(
+            skip_checks=True, cache_root_dir=str(tmpdir), **server.endpoints()
+        )
+        limiter = ratelimit.install(syn, ratelimit.RateLimiter({"read": 100}))
+        syn.login(authToken="fake", silent=True)
+        submissions = [
+            syn.getSubmission(submission.id, downloadFile=False)
+            for submission, _ in syn.getSubmissionBundles(evaluationid)
+        ]
+    assert len(submissions) == 30
+    assert server.throttled == limiter.buckets["read"].throttled >= 1
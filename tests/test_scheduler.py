@@ -0,0 +1,91 @@
+"""Test the fair scheduler"""
+from contextlib import contextmanager
+from unittest.mock import Mock
+
+from scoring_harness.scheduler import fair_order, interleave, run_interleaved
+
+
+def test_fair_order():
+    """Keys take turns and keep the order of their items"""
+    items = ["a1", "a2", "a3", "b1", "c1", "b2"]
+    assert list(fair_order(items, key=lambda item: item[0])) == [
+        "a1",
+        "b1",
+        "c1",
+        "a2",
+        "b2",
+        "a3",
+    ]
+
+
+def test_interleave():
+    """Queues take turns until they are empty"""
+    queues = {"one": [1, 2, 3], "two": ["a"]}
+    assert list(interleave(queues)) == [
+        ("one", 1),
+        ("two", "a"),
+        ("one", 2),
+        ("one", 3),
+    ]
+
+
+def test_interleave_weights():
+    """Queues get turns in proportion to their weight"""
+    queues = {"heavy": range(6), "light": range(2)}
+    names = [name for name, _ in interleave(queues, weights={"heavy": 3})]
+    assert names[:4].count("heavy") == 3
+    assert names == ["heavy", "heavy", "light", "heavy"] * 2
+
+
+def test_interleave_priorities():
+    """Higher priority queues are emptied first"""
+    queues = {"low": [1, 2], "high": [3, 4]}
+    items = [item for _, item in interleave(queues, priorities={"high": 1})]
+    assert items == [3, 4, 1, 2]
+
+
+def _processor(submissions):
+    processor = Mock()
+
+    @contextmanager
+    def processing_run():
+        yield iter([(Mock(id=submission), Mock()) for submission in submissions])
+
+    processor.processing_run = processing_run
+    return processor
+
+
+def test_run_interleaved():
+    """Submissions of several processors are processed interleaved"""
+    order = []
+    processors = {"one": _processor(["1a", "1b"]), "two": _processor(["2a"])}
+    for processor in processors.values():
+        processor.process_submission.side_effect = (
+            lambda submission, status: order.append(submission.id)
+        )
+    assert run_interleaved(processors) == {"one": 2, "two": 1}
+    assert order == ["1a", "2a", "1b"]
+
+
+def test_run_interleaved_bounded():
+    """Only about max_workers submissions are scheduled ahead of those
+    that were processed"""
+    processed = []
+    in_flight = []
+    processor = Mock()
+
+    @contextmanager
+    def processing_run():
+        def bundles():
+            for number in range(6):
+                in_flight.append(number + 1 - len(processed))
+                yield Mock(id=str(number)), Mock()
+
+        yield bundles()
+
+    processor.processing_run = processing_run
+    processor.process_submission.side_effect = (
+        lambda submission, status: processed.append(submission.id)
+    )
+    assert run_interleaved({"one": processor}, max_workers=2) == {"one": 6}
+    assert max(in_flight) <= 2
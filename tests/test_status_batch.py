@@ -0,0 +1,163 @@
+"""Test batched submission status writes"""
+import json
+from unittest import mock
+from unittest.mock import Mock, patch
+
+import pytest
+import synapseclient
+from synapseclient.core.exceptions import SynapseHTTPError
+
+from challengeutils import status_update
+from challengeutils.status_batch import SubmissionStatusBatchWriter
+
+SYN = mock.create_autospec(synapseclient.Synapse)
+
+
+def _statuses(count):
+    return [
+        synapseclient.SubmissionStatus(id=str(subid), status="SCORED", etag="etag")
+        for subid in range(count)
+    ]
+
+
+def _conflict():
+    return SynapseHTTPError("conflict", response=Mock(status_code=412))
+
+
+def test_invalid_batch_size():
+    """Synapse doesn't accept more than 500 statuses per batch"""
+    with pytest.raises(ValueError, match="batch_size must be between"):
+        SubmissionStatusBatchWriter(SYN, "1234", batch_size=501)
+
+
+def test_flush_chains_batches():
+    """Buffered statuses are stored in batches linked by batch tokens"""
+    statuses = _statuses(5)
+    with patch.object(
+        SYN, "restPUT", side_effect=[{"nextUploadToken": "a"}, {}, {}]
+    ) as patch_put:
+        writer = SubmissionStatusBatchWriter(SYN, "1234", batch_size=2, buffer_size=5)
+        for status in statuses[:4]:
+            writer.add(status)
+        patch_put.assert_not_called()
+        writer.add(statuses[4])
+        assert patch_put.call_count == 3
+        requests = [json.loads(call[0][1]) for call in patch_put.call_args_list]
+        assert all(
+            call[0][0] == "/evaluation/1234/statusBatch"
+            for call in patch_put.call_args_list
+        )
+        assert [len(request["statuses"]) for request in requests] == [2, 2, 1]
+        assert [request["isFirstBatch"] for request in requests] == [
+            True,
+            False,
+            False,
+        ]
+        assert [request["isLastBatch"] for request in requests] == [
+            False,
+            False,
+            True,
+        ]
+        assert "batchToken" not in requests[0]
+        assert requests[1]["batchToken"] == "a"
+
+
+def test_context_manager_flushes():
+    """Remaining statuses are stored when leaving the context"""
+    on_flush = Mock()
+    statuses = _statuses(2)
+    with patch.object(SYN, "restPUT", return_value={}) as patch_put:
+        with SubmissionStatusBatchWriter(SYN, "1234", on_flush=on_flush) as writer:
+            for status in statuses:
+                writer.add(status)
+        patch_put.assert_called_once()
+        on_flush.assert_called_once_with(statuses)
+
+
+def test_conflict_falls_back_to_each():
+    """A conflicting batch is read again and stored one status at a time"""
+    statuses = _statuses(3)
+    fresh = {
+        status.id: synapseclient.SubmissionStatus(
+            id=status.id, status="RECEIVED", etag="fresh"
+        )
+        for status in statuses
+    }
+
+    def store(status):
+        if status.id == "1":
+            raise _conflict()
+        return status
+
+    def validate(status):
+        status.status = "VALIDATED"
+        return status
+
+    with patch.object(SYN, "restPUT", side_effect=_conflict()), patch.object(
+        SYN, "getSubmissionStatus", side_effect=lambda subid: fresh[subid]
+    ), patch.object(SYN, "store", side_effect=store), patch.object(
+        status_update.time, "sleep"
+    ):
+        writer = SubmissionStatusBatchWriter(SYN, "1234")
+        for status in statuses:
+            writer.add(status, merge=validate)
+        stored = writer.flush()
+    assert stored == [fresh["0"], fresh["2"]]
+    assert [status.status for status in stored] == ["VALIDATED", "VALIDATED"]
+    assert writer.failed == [statuses[1]]
+
+
+def test_merge_skips():
+    """Statuses that their merge leaves as they are aren't stored"""
+    statuses = _statuses(2)
+    with patch.object(SYN, "restPUT", return_value={}) as patch_put:
+        writer = SubmissionStatusBatchWriter(SYN, "1234")
+        writer.add(statuses[0], merge=lambda status: None)
+        writer.add(statuses[1], merge=lambda status: status)
+        assert writer.flush() == [statuses[1]]
+    assert writer.skipped == [statuses[0]]
+    assert len(json.loads(patch_put.call_args[0][1])["statuses"]) == 1
+
+
+def test_other_errors_raise():
+    """Errors other than conflicts are raised"""
+    error = SynapseHTTPError("error", response=Mock(status_code=500))
+    with patch.object(SYN, "restPUT", side_effect=error):
+        writer = SubmissionStatusBatchWriter(SYN, "1234")
+        writer.add(_statuses(1)[0])
+        with pytest.raises(SynapseHTTPError):
+            writer.flush()
+
+
+def test_statuses_are_sent_as_synapse_json():
+    """Submission annotations are sent in the shape Synapse expects and
+    the stored statuses get their new etags if asked to"""
+    status = synapseclient.SubmissionStatus(
+        id="1", etag="old", status="SCORED", submissionAnnotations={"foo": ["bar"]}
+    )
+    fresh = synapseclient.SubmissionStatus(
+        id="1", etag="new", status="SCORED", submissionAnnotations={"foo": ["bar"]}
+    )
+    on_flush = Mock()
+    with patch.object(SYN, "restPUT", return_value={}) as patch_put, patch.object(
+        SYN, "getSubmissionStatus", return_value=fresh
+    ):
+        with SubmissionStatusBatchWriter(
+            SYN, "1234", on_flush=on_flush, refresh_etags=True
+        ) as writer:
+            writer.add(status)
+        request = json.loads(patch_put.call_args[0][1])
+    assert request["statuses"] == [
+        {
+            "id": "1",
+            "etag": "old",
+            "status": "SCORED",
+            "submissionAnnotations": {
+                "id": "1",
+                "etag": "old",
+                "annotations": {"foo": {"type": "STRING", "value": ["bar"]}},
+            },
+        }
+    ]
+    on_flush.assert_called_once_with([status])
+    assert status.etag == "new"
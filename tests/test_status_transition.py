@@ -0,0 +1,95 @@
+"""Test changing the status of every submission of a queue"""
+# pylint: disable=redefined-outer-name
+import json
+from unittest import mock
+from unittest.mock import Mock, patch
+
+import pytest
+import synapseclient
+from synapseclient.core.exceptions import SynapseHTTPError
+
+from benchmarks.fake_synapse import FakeSynapseServer, seed
+from challengeutils import status_update
+from challengeutils.status_transition import (
+    TransitionCheckpoint,
+    transition_submission_statuses,
+)
+
+SYN = mock.create_autospec(synapseclient.Synapse)
+
+
+@pytest.fixture
+def queue():
+    """Fake Synapse with a queue of 12 scored submissions"""
+    with FakeSynapseServer() as server:
+        evaluationid = seed(server.synapse, submissions=12, status="SCORED")[
+            "evaluations"
+        ][0]
+        yield server.client(), evaluationid
+
+
+def test_transition(queue, tmpdir):
+    """Every submission is changed even when there are more than a batch"""
+    syn, evaluationid = queue
+    checkpoint = str(tmpdir / "checkpoint.jsonl")
+    summary = transition_submission_statuses(
+        syn, evaluationid, checkpoint=checkpoint, batch_size=5, max_workers=2
+    )
+    assert summary.changed == 12
+    assert not summary.failed
+    assert len(list(syn.getSubmissionBundles(evaluationid, status="VALIDATED"))) == 12
+    with open(checkpoint) as checkpoint_file:
+        lines = [json.loads(line) for line in checkpoint_file]
+    assert lines[0] == {"evaluation": evaluationid, "from": "SCORED", "to": "VALIDATED"}
+    assert sum(len(line["ids"]) for line in lines[1:]) == 12
+
+
+def test_transition_keeps_annotations(queue):
+    """Annotations of the changed submissions are kept"""
+    syn, evaluationid = queue
+    for _, status in syn.getSubmissionBundles(evaluationid, status="SCORED"):
+        status.submissionAnnotations = {"score": [0.5], "team": ["a"]}
+        syn.store(status)
+    transition_submission_statuses(syn, evaluationid, batch_size=5, progress=False)
+    for _, status in syn.getSubmissionBundles(evaluationid, status="VALIDATED"):
+        assert dict(status.submissionAnnotations) == {"score": [0.5], "team": ["a"]}
+
+
+def test_resume(queue, tmpdir):
+    """Submissions recorded in the checkpoint are skipped"""
+    syn, evaluationid = queue
+    path = str(tmpdir / "checkpoint.jsonl")
+    _, status = next(syn.getSubmissionBundles(evaluationid, status="SCORED"))
+    checkpoint = TransitionCheckpoint(path, evaluationid, "SCORED", "VALIDATED")
+    checkpoint.record([status.id])
+    checkpoint.close()
+    summary = transition_submission_statuses(
+        syn, evaluationid, checkpoint=path, progress=False
+    )
+    assert (summary.resumed, summary.changed) == (1, 11)
+    with pytest.raises(ValueError, match="another transition"):
+        TransitionCheckpoint(path, evaluationid, "SCORED", "ACCEPTED")
+
+
+def test_conflicts_are_stored_again():
+    """Conflicting statuses are read again and skipped if they moved"""
+    statuses = [
+        synapseclient.SubmissionStatus(id=str(subid), status="SCORED", etag="a")
+        for subid in range(2)
+    ]
+    fresh = {
+        "0": synapseclient.SubmissionStatus(id="0", status="SCORED", etag="b"),
+        "1": synapseclient.SubmissionStatus(id="1", status="ACCEPTED", etag="b"),
+    }
+    conflict = SynapseHTTPError("conflict", response=Mock(status_code=412))
+    with patch.object(
+        SYN, "getSubmissionBundles", return_value=[(None, s) for s in statuses]
+    ), patch.object(SYN, "restPUT", side_effect=conflict), patch.object(
+        SYN, "store", side_effect=[fresh["0"]]
+    ), patch.object(
+        SYN, "getSubmissionStatus", side_effect=lambda subid: fresh[subid]
+    ), patch.object(
+        status_update.time, "sleep"
+    ):
+        summary = transition_submission_statuses(SYN, "1234", progress=False)
+    assert (summary.changed, summary.moved, summary.failed) == (1, 1, [])
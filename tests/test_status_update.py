@@ -0,0 +1,96 @@
+"""Test read-merge-write submission status updates"""
+from unittest import mock
+from unittest.mock import Mock, patch
+
+import pytest
+import synapseclient
+from synapseclient.core.exceptions import SynapseHTTPError
+
+from challengeutils import status_update
+from challengeutils.status_update import (
+    ConflictStats,
+    update_submission_status_with_retry,
+)
+
+SYN = mock.create_autospec(synapseclient.Synapse)
+
+
+def _status(etag):
+    return synapseclient.SubmissionStatus(id="1", status="RECEIVED", etag=etag)
+
+
+def _conflict():
+    return SynapseHTTPError("conflict", response=Mock(status_code=412))
+
+
+def _score(status):
+    status.status = "SCORED"
+    return status
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    with patch.object(status_update.time, "sleep") as patch_sleep:
+        yield patch_sleep
+
+
+def test_update_given_status():
+    """A status that was just read is stored without reading it again"""
+    stats = ConflictStats()
+    status = _status("a")
+    with patch.object(SYN, "getSubmissionStatus") as patch_get, patch.object(
+        SYN, "store", return_value=status
+    ) as patch_store:
+        stored = update_submission_status_with_retry(SYN, status, _score, stats=stats)
+        patch_get.assert_not_called()
+        patch_store.assert_called_once_with(status)
+    assert stored.status == "SCORED"
+    assert stats.summary() == {
+        "updates": 1,
+        "conflicts": 0,
+        "failures": 0,
+        "conflict_rate": 0.0,
+    }
+
+
+def test_conflict_merges_fresh_status(no_sleep):
+    """After a conflict the change is applied to the status read again"""
+    stats = ConflictStats()
+    on_conflict = Mock()
+    fresh = _status("b")
+    with patch.object(
+        SYN, "getSubmissionStatus", side_effect=[_status("a"), fresh]
+    ), patch.object(SYN, "store", side_effect=[_conflict(), fresh]) as patch_store:
+        update_submission_status_with_retry(
+            SYN, "1", _score, on_conflict=on_conflict, stats=stats
+        )
+        assert patch_store.call_args[0][0].etag == "b"
+    on_conflict.assert_called_once()
+    no_sleep.assert_called_once()
+    assert stats.conflict_rate == 1
+
+
+def test_gives_up_after_retries():
+    """The conflict is raised once the retries are used up"""
+    stats = ConflictStats()
+    with patch.object(
+        SYN, "getSubmissionStatus", side_effect=lambda _: _status("a")
+    ), patch.object(SYN, "store", side_effect=_conflict()) as patch_store:
+        with pytest.raises(SynapseHTTPError):
+            update_submission_status_with_retry(
+                SYN, "1", _score, retries=2, stats=stats
+            )
+        assert patch_store.call_count == 3
+    assert stats.failures == 1
+    assert stats.conflicts == 3
+
+
+def test_other_errors_raise():
+    """Errors other than conflicts aren't retried"""
+    error = SynapseHTTPError("error", response=Mock(status_code=500))
+    with patch.object(SYN, "store", side_effect=error) as patch_store:
+        with pytest.raises(SynapseHTTPError):
+            update_submission_status_with_retry(
+                SYN, _status("a"), _score, stats=ConflictStats()
+            )
+        patch_store.assert_called_once()
@@ -13,7 +13,9 @@ import synapseclient
 from synapseclient.annotations import to_submission_status_annotations
 from synapseclient.core.exceptions import SynapseHTTPError
 
+from benchmarks.fake_synapse import FakeSynapseServer, seed
 import challengeutils.utils
+from challengeutils.identity_cache import IdentityCache
 
 syn = mock.create_autospec(synapseclient.Synapse)
 
@@ -126,6 +128,24 @@ def test_topublic_update_single_submission_status():
     assert new_status == expected_status
 
 
+def test_failed_update_all_submissions_annotation_acl():
+    """Statuses that couldn't be updated are reported"""
+    status = synapseclient.SubmissionStatus(id="1", etag="a", annotations={})
+    conflict = SynapseHTTPError("conflict", response=Mock(status_code=412))
+    with patch.object(
+        syn, "getSubmissionBundles", return_value=[(None, status)]
+    ), patch.object(syn, "restPUT", side_effect=conflict), patch.object(
+        syn, "getSubmissionStatus", return_value=status
+    ), patch.object(
+        syn, "store", side_effect=conflict
+    ), patch.object(
+        challengeutils.status_update.time, "sleep"
+    ), pytest.raises(
+        ValueError, match="submissions: 1"
+    ):
+        challengeutils.utils.update_all_submissions_annotation_acl(syn, "1234", ["foo"])
+
+
 def test_valid__check_date_range():
     """
     Test checking valid date range
@@ -146,27 +166,54 @@ def test_invalid__check_date_range():
     datetime2 = "2019-06-01 1:00"
     result = challengeutils.utils._check_date_range(date_str, datetime2, None)
     assert not result
+    result = challengeutils.utils._check_date_range(
+        date_str, datetime2, "2019-07-01 1:00"
+    )
+    assert not result
+
+
+@pytest.mark.parametrize(
+    "start,end,expected",
+    [
+        (None, None, True),
+        ("2019-05-26 23:59", None, True),
+        ("2019-05-27 0:00", None, False),
+        (None, "2019-05-27 0:00", True),
+        (None, "2019-05-26 23:58", False),
+        # The end bound doesn't override the start bound
+        ("2019-05-27 0:00", "2019-06-01 1:00", False),
+        ("2019-05-01 0:00", "2019-05-26 23:58", False),
+        ("2019-05-01 0:00", "2019-06-01 1:00", True),
+    ],
+)
+def test_bounds__check_date_range(start, end, expected):
+    """Bounds are inclusive and a date must be within both of them"""
+    date_str = "2019-05-26T23:59:59.062Z"
+    assert challengeutils.utils._check_date_range(date_str, start, end) == expected
 
 
 def test__get_contributors():
     """
     Test getting contributors by evaluationID, status, and date range
     """
-    sub = synapseclient.Submission(
-        evaluationId=123,
-        entityId="syn1234",
-        versionNumber=1,
-        contributors=[{"principalId": 321}],
-        createdOn="2019-05-26T23:59:59.062Z",
-    )
-    bundle = [(sub, "temp")]
-    with patch.object(
-        syn, "getSubmissionBundles", return_value=bundle
-    ) as patch_syn_get_bundles:
+    subs = [
+        {
+            "contributors": [{"principalId": 321}],
+            "createdOn": "2019-05-26T23:59:59.062Z",
+        },
+        {
+            "contributors": [{"principalId": 456}],
+            "createdOn": "2019-04-26T23:59:59.062Z",
+        },
+    ]
+    page = {"results": subs, "totalNumberOfResults": 2}
+    with patch.object(syn, "restGET", return_value=page) as patch_rest_get:
         contributors = challengeutils.utils._get_contributors(
             syn, 123, "SCORED", "2019-05-06 1:00", "2019-06-01 1:00"
         )
-        patch_syn_get_bundles.assert_called_once_with(123, status="SCORED")
+        patch_rest_get.assert_called_once_with(
+            "/evaluation/123/submission/all?limit=100&status=SCORED&offset=0"
+        )
         assert contributors == set([321])
 
 
@@ -183,6 +230,22 @@ def test_get_contributors():
         assert all_contributors == set([321])
 
 
+def test_get_contributors_pages(tmpdir):
+    """Submissions of every queue are paged with a status filter"""
+    with FakeSynapseServer() as server:
+        seeded = seed(server.synapse, evaluations=2, submissions=150, status="SCORED")
+        for evaluationid in seeded["evaluations"]:
+            seed_queue = server.synapse._queues[evaluationid]
+            assert len(seed_queue["SCORED"]) == 150
+        syn_fake = server.client()
+        contributors = challengeutils.utils.get_contributors(
+            syn_fake, seeded["evaluations"], "SCORED"
+        )
+        # Two pages per queue
+        assert server.requests["submissions_page"] == 4
+    assert len(contributors) == 10
+
+
 def test_list_evaluations():
     with mock.patch.object(syn, "getEvaluationByContentSource") as patch_geteval:
         challengeutils.utils.list_evaluations(syn, "syn1234")
@@ -284,3 +347,81 @@ def test_delete_submission():
         challengeutils.utils.delete_submission(syn, "12345")
         patch_get.assert_called_once_with("12345", downloadFile=False)
         patch_delete.assert_called_once_with(sub)
+
+
+def test_cached__get_submitter_name():
+    """Names are reused from the identity cache"""
+    cache = IdentityCache()
+    with mock.patch.object(
+        syn, "getUserProfile", return_value={"userName": "foo"}
+    ) as patch_get_user:
+        for _ in range(2):
+            submittername = challengeutils.utils._get_submitter_name(
+                syn, 2222, identity_cache=cache
+            )
+            assert submittername == "foo"
+        patch_get_user.assert_called_once_with(2222)
+
+
+def _query_response(start, stop, total, headers=("objectId", "score")):
+    return {
+        "headers": list(headers),
+        "rows": [{"values": [str(index), index / 10]} for index in range(start, stop)],
+        "totalNumberOfResults": total,
+    }
+
+
+def _fake_query(total):
+    """restGET of an evaluation queue query with total results"""
+
+    def rest_get(uri):
+        query = challengeutils.utils.urllib.parse.unquote_plus(uri)
+        limit, offset = (int(value) for value in re.findall(r"\d+", query)[-2:])
+        return _query_response(offset, min(offset + limit, total), total)
+
+    return rest_get
+
+
+def test_evaluation_queue_query_pages():
+    """Pages are sized from the number of results, without an extra
+    empty page at the end"""
+    with patch.object(syn, "restGET", side_effect=_fake_query(1050)) as patch_get:
+        rows = list(
+            challengeutils.utils.evaluation_queue_query(
+                syn, "select * from evaluation_1"
+            )
+        )
+        # First page of 100, then 4 pages of up to 238 rows
+        assert patch_get.call_count == 5
+    assert [row["objectId"] for row in rows] == [str(index) for index in range(1050)]
+    assert rows[1] == {"objectId": "1", "score": 0.1}
+
+
+def test_evaluation_queue_query_columnar():
+    """Columnar results are a dict of columns per page"""
+    with patch.object(syn, "restGET", side_effect=_fake_query(30)):
+        pages = list(
+            challengeutils.utils.evaluation_queue_query(
+                syn, "select * from evaluation_1", limit=20, columnar=True
+            )
+        )
+    assert [len(page["objectId"]) for page in pages] == [20, 10]
+    assert pages[1]["score"][0] == 2.0
+
+
+def test_evaluation_queue_query_truncated():
+    """The rest of a truncated page is asked for again"""
+    responses = [
+        _query_response(0, 2, 6),
+        _query_response(2, 3, 6),
+        _query_response(3, 4, 6),
+        _query_response(4, 6, 6),
+    ]
+    with patch.object(syn, "restGET", side_effect=responses) as patch_get:
+        rows = list(
+            challengeutils.utils.evaluation_queue_query(
+                syn, "select * from evaluation_1", limit=2, max_workers=1
+            )
+        )
+        assert patch_get.call_count == 4
+    assert [row["objectId"] for row in rows] == ["0", "1", "2", "3", "4", "5"]
@@ -69,6 +69,7 @@ def test_valid_notify(validator):
             userids=[SUBMISSION.userId],
             acknowledge_receipt=False,
             dry_run=False,
+            outbox=None,
             username=SYN_USERPROFILE.userName,
             queue_name=EVALUATION.name,
             submission_name=SUBMISSION.name,
@@ -92,6 +93,7 @@ def test_error_notify(validator):
             userids=[1, 3],
             send_messages=False,
             dry_run=False,
+            outbox=None,
             username="Challenge Administrator",
             queue_name=EVALUATION.name,
             submission_name=SUBMISSION.name,
@@ -116,6 +118,7 @@ def test_invalid__notify(validator):
             userids=[SUBMISSION.userId],
             send_messages=False,
             dry_run=False,
+            outbox=None,
             username=SYN_USERPROFILE.userName,
             queue_name=EVALUATION.name,
             submission_name=SUBMISSION.name,
@@ -123,3 +126,13 @@ def test_invalid__notify(validator):
             message=info["message"],
             challenge_synid=CHALLENGE_SYNID,
         )
+
+
+def test_notify_reuses_submitter_name(validator):
+    """The submitter's name is only looked up once"""
+    with patch.object(messages, "validation_passed"), patch.object(
+        SYN, "getUserProfile", return_value=SYN_USERPROFILE
+    ) as patch_get_user:
+        validator.notify(SUBMISSION, SUB_INFO)
+        validator.notify(SUBMISSION, SUB_INFO)
+        patch_get_user.assert_called_once_with(SUBMISSION.userId)